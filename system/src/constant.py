@@ -15,6 +15,10 @@ config_dir = "../../resources/application/"
 #data extraction configuration
 num_file = 1
 current_date = 20230601 #to filter out expired contracts
+json_read_chunk_size = 1 << 20 #characters read per chunk when streaming raw records (memory bound = chunk + largest record)
+extraction_chunk_size = 100000 #records accumulated per data frame chunk
+num_workers = 1 #number of extraction worker processes (1 = single process; e.g., os.cpu_count() on extraction hosts)
+parallel_chunk_size = 10000 #records per worker task in multi-process extraction
 
 #local data repo settings
 local_indir = "../../data/"
@@ -23,6 +27,9 @@ all_infiles = ['organization_sample_data.json', 'practitioner_sample_data.json',
 data_types = ["organization", "practitioner"]
 
 all_outfiles = [x[:x.rfind(".")] + ".pkl" for x in all_infiles]
+output_format = "pickle" #extracted data format: "pickle" (.pkl file) or "columnar" (.cols directory of memory-mapped numpy arrays)
+delta_mode = False #incremental extraction/feed: keep a document hash manifest and feed only new/changed/removed documents
+partial_update = False #delta feed: send changed documents as partial updates against the previous snapshot (asyncio feed only)
 
 org_infiles = all_infiles[0:1]
 org_outfiles = [x[:x.rfind(".")] + ".pkl" for x in org_infiles]
@@ -32,7 +39,7 @@ prov_outfiles = [x[:x.rfind(".")] + ".pkl" for x in prov_infiles]
 
 #vespa data/config files
 schema_name = 'organization' #practitioner
-data_feed_flag = 1 #1. batch feed, 2. point-wise feed, 3. data frame feed, 0. no feed
+data_feed_flag = 1 #1. batch feed, 2. point-wise feed, 3. data frame feed (not resumable), 4. asyncio feed, 5. replay exported JSONL (asyncio), 0. no feed
 data_feed_debug = False #for point-by-point feed debug
 key_id_field = "generated_key" #the unique ID for each doc
 num_dispay = 1000 #record number trigger for information display
@@ -40,6 +47,52 @@ batch_size = 1000 #batch feed size (small number to avoid crash)
 num_connections = 5 #number of connections to host (default=100; max connection depends on JVM GC spped and heap size)
 timeout = 100 #time out (in sec) for a batch feed
 vespa_url_local = "http://localhost:8080"
+nan_fill_value = 999999 #value for NaN fields in the feed (vespa can not process NaN)
+feed_conversion_chunk_size = 10000 #rows converted to python values at a time when streaming a data frame to the feed
+max_in_flight = 128 #max concurrent operations (and keep-alive connections) for the asyncio feed (ceiling for adaptive concurrency)
+adaptive_concurrency = True #asyncio feed: adjust concurrency by AIMD from latency and 429/503/timeout responses
+initial_in_flight = 8 #initial concurrency for adaptive concurrency
+min_in_flight = 2 #floor for adaptive concurrency
+aimd_increase = 1 #additive increase per round of successful operations
+aimd_decrease_factor = 0.5 #multiplicative decrease on 429/503/timeout or high latency
+aimd_latency_threshold = 3.0 #high latency: smoothed latency > threshold x lowest observed latency (None = off)
+aimd_latency_min = 0.05 #latency (in sec) below which there is no congestion
+concurrency_log_interval = 5 #min interval (in sec) between concurrency log lines
+feed_namespace = None #document namespace for /document/v1 (None = schema name, as pyvespa)
+max_retries = 5 #retries of a failed feed operation (timeout/connection error, 429, 5xx) before it goes to the dead-letter file
+retry_backoff_base = 0.5 #backoff (in sec) before the first retry, doubled per retry with full jitter
+retry_backoff_max = 30 #max backoff (in sec) between retries
+resume_feed = True #resume each data file from its feed checkpoint (a finished file is skipped until it is re-extracted)
+checkpoint_interval = 10000 #completed operations between feed checkpoint saves
+
+#feed metrics
+feed_metrics_interval = 5 #secs between metric samples (docs/sec, bytes/sec, in-flight over time) and JSON snapshots
+feed_metrics_file = None #periodic JSON snapshot file of the feed metrics (e.g., local_outdir + "feed_metrics.json"; None = off)
+feed_metrics_port = None #Prometheus text endpoint http://localhost:<port>/metrics while feeding (None = off)
+
+#expiry sweep
+sweep_date = None #YYYYMMDD date: documents and contract map entries expiring before it are removed (None = today)
+sweep_mode = "selection" #"selection" (server-side delete by selection) or "stream" (visit expired ids and stream removes)
+sweep_prune_maps = True #remove expired contract map entries with partial updates
+content_cluster = "provider_content" #content cluster id in services.xml (visit/delete by selection)
+visit_batch_size = 1000 #documents per visit page
+
+#feed export (JSONL document operations for vespa-feed-client or replay)
+export_serializer = "auto" #"orjson", "json" (stdlib) or "auto" (orjson if installed)
+export_shard_size = 100000 #operations per JSONL shard
+export_compression = None #None or "gzip"
+export_compress_level = 1 #gzip level (1 = fastest)
+export_buffer_size = 1 << 20 #bytes buffered before a write
+
+#search client
+search_connections = 32 #keep-alive connections (and max queries in flight) of the search client
+search_timeout = 15 #client time out (in sec) per query
+cache_max_entries = 100000 #max cached queries of the search result cache
+cache_max_bytes = 256 << 20 #max estimated memory (bytes) of the search result cache
+cache_ttl = 300 #time to live (in sec) of a cached search result (None = until evicted/invalidated)
+cache_geo_grid = 0.05 #grid (in degrees, ~5.5 km in latitude) for geoLocation coordinates of cache keys (None = exact)
+cache_version_dir = local_outdir + "data_versions/" #data version markers published by the feed/expiry sweep for caches in other processes (None = in-process only)
+cache_version_check_interval = 1.0 #min time (in sec) between two reads of the data version markers by a cache
 
 #performance testing
 local_query_dir = "../../query/"
@@ -50,8 +103,47 @@ query_per_set = int(n_queries/num_file) #select n queries per data file
 n_clients = 5 #clients querying at the same time
 n_returned_results = 10 #number of returned results per query
 performance_test_time = 30 #in seconds
+load_generator = "native" #native (in-process load generator) or fbench (vespa-fbench in the local docker container)
+performance_test_url = None #endpoint of the native load generator (None = vespa_url_local)
+target_qps = None #open loop target query rate (None = closed loop with n_clients clients)
+cycle_time = 0 #closed loop: min time (in ms) between the queries of a client (fbench -c)
+warmup_queries = 20 #responses ignored for the system warming up (fbench -i)
+query_timing = False #request presentation.timing (vespa query/summary fetch time per query class)
+performance_baseline = None #benchmark record (JSON) compared with each run (None = no comparison)
+max_p99_regression = 0.10 #max relative increase of the p99 latency against the baseline
+max_qps_regression = 0.10 #max relative decrease of the query rate against the baseline
+performance_test_sweep = False #run the throughput-vs-latency sweep instead of a single load point
+sweep_clients = [1, 2, 4, 8, 16, 32] #closed loop steps (clients)
+sweep_qps = None #open loop steps (target Q/s, e.g., [100, 200, 400, 800]); overrides sweep_clients
+sweep_query_classes = ["all", "bm25", "geo", "filter"] #query classes swept (all = the whole query set)
+sweep_profiles = None #rank profiles swept (e.g., ["org_bm25", "geo_ranking"]; None = the profile of each query)
+sweep_step_time = 20 #measured time (in sec) per step
+sweep_warmup_time = 5 #warmup time (in sec) before each step
+p99_slo = 100 #p99 latency SLO (in ms) of the knee point
+sweep_stop_after_breach = True #stop a curve at the first step above the SLO
 filter_fileds = ['csp_contract', 'national_taxonomy', 'cosmos_contract', 'unet_contract', 'specialty_org', 'contract_org']
 geo_search_perc = 0.5 #percentage of queries including geo search
 filter_search_perc = 0.2 #percentage of queries including structured filters
 contract_date_filter = current_date #expire date filter
-geo_random_scale = 0.75
\ No newline at end of file
+geo_random_scale = 0.75
+query_seed = 20230601 #seed of the query generation (same seed and data = same query set)
+query_pool_size = 1000000 #max sampled rows per data file (larger query sets reuse the rows)
+query_chunk_size = 500000 #queries assembled and written per chunk
+workload_model = "uniform" #uniform, zipf (popular documents/terms) or replay (captured query log with its timing)
+zipf_exponent = 1.0 #Zipf exponent of the document popularity (zipf workload)
+zipf_term_exponent = None #Zipf exponent of the search term popularity (None = the terms of the drawn document)
+repeat_ratio = 0.0 #fraction of queries repeating a recent distinct query (0 = no repeats)
+working_set_size = 10000 #distinct queries a repeat is drawn from
+query_log_file = None #captured query log of the replay workload (vespa access log JSON or "epoch<tab>/search/..." lines)
+replay_speedup = 1.0 #replay speed (2 = twice the original query rate)
+
+#embedded search engine (see src.search.embedded_engine)
+embedded_grid_size = 0.5 #cell size (degrees) of the geo grid index
+
+#extraction benchmark
+extraction_benchmark_sizes = [10000, 100000, 1000000] #number of synthetic records per benchmark run
+contract_benchmark_size = 100000 #number of synthetic records for the contract section microbenchmark
+
+#feed benchmark
+feed_benchmark_rows = 1000000 #rows of the synthetic data frame for the feed conversion benchmark
+serialization_benchmark_rows = 100000 #rows of the synthetic data frame for the export serialization benchmark
\ No newline at end of file
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - benchmark report
+structured benchmark records (JSON per run, CSV history) of the performance test, and the
+comparison of a run against a stored baseline with regression gating
+
+a record has the run context (time, git revision, schema, load generator and its settings) and
+the results (clients, Q/s, every percentile, failures, zero hit rate); vespa-fbench text reports
+are parsed into the same fields
+
+usage (from the system directory):
+    python -m src.evaluation.benchmark_report compare run.json baseline.json --max-p99-regression 0.1 --max-qps-regression 0.1
+    python -m src.evaluation.benchmark_report parse vespa_performance_report_organization.txt run.json
+
+compare exits with 1 when the p99 latency or the throughput regresses past its threshold
+
+v0.1 - benchmark records, fbench report parser and baseline comparison
+v0.2 - per query class results in the record
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, re, sys, csv, json, argparse, subprocess
+from datetime import datetime
+from .load_generator import PERCENTILES
+
+FBENCH_LINE = re.compile(r"^\s*([a-z][a-z ]*?|[\d.]+\s+percentile)\s*:\s*(-?[\d.]+)")
+FBENCH_STATUS = re.compile(r"^\s*(\d{3})\s*:\s*(\d+)\s*$")
+FBENCH_FIELDS = {'clients': 'clients', 'ran for': 'ran_for', 'cycle time': 'cycle_time',
+                 'skipped requests': 'ignored_requests', 'failed requests': 'failed_requests',
+                 'successful requests': 'successful_requests', 'cycles not held': 'cycles_not_held',
+                 'minimum response time': 'min_response_time', 'maximum response time': 'max_response_time',
+                 'average response time': 'avg_response_time', 'actual query rate': 'actual_query_rate',
+                 'utilization': 'utilization', 'zero hit queries': 'zero_hit_queries',
+                 'zero hit percentage': 'zero_hit_percentage'}
+FBENCH_COUNTS = ('clients', 'ignored_requests', 'failed_requests', 'successful_requests', 'cycles_not_held',
+                 'zero_hit_queries')
+
+RESULT_FIELDS = ['mode', 'clients', 'target_qps', 'ran_for', 'cycle_time', 'ignored_requests', 'failed_requests',
+                 'successful_requests', 'cycles_not_held', 'min_response_time', 'max_response_time',
+                 'avg_response_time'] + ["p{}".format(p) for p in PERCENTILES] + \
+                ['actual_query_rate', 'utilization', 'zero_hit_queries', 'zero_hit_percentage', 'failure_rate']
+CONTEXT_FIELDS = ['timestamp', 'git_revision', 'git_dirty', 'schema_name', 'load_generator', 'query_file', 'url']
+SETTING_FIELDS = ['n_clients', 'performance_test_time', 'target_qps', 'cycle_time', 'warmup_queries', 'search_timeout',
+                  'workload_model', 'zipf_exponent', 'zipf_term_exponent', 'repeat_ratio', 'working_set_size',
+                  'replay_speedup', 'query_seed', 'query_timing']
+
+
+def git_revision(path=None):
+    """
+    git revision of the working tree (None if not in a git repository)
+    Output:
+        revision - commit hash
+        dirty - True if there are uncommitted changes
+    """
+    path = path or os.path.dirname(os.path.abspath(__file__))
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=path,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision, bool(status.strip())
+
+
+def parse_fbench_report(text):
+    """
+    benchmark summary of a vespa-fbench text report (the fields of load_generator.summarize)
+    """
+    summary = {'mode': "closed", 'target_qps': None, 'percentiles': dict(), 'status_breakdown': dict()}
+    in_status = False
+
+    for line in text.splitlines():
+        if line.strip().startswith("http request status breakdown"):
+            in_status = True
+            continue
+
+        match = FBENCH_STATUS.match(line) if in_status else None
+        if match:
+            summary['status_breakdown'][int(match.group(1))] = int(match.group(2))
+            continue
+
+        match = FBENCH_LINE.match(line)
+        if not match:
+            continue
+        name, value = " ".join(match.group(1).split()), float(match.group(2))
+        if name.endswith("percentile"):
+            percentile = float(name.split()[0])
+            summary['percentiles'][int(percentile) if percentile.is_integer() else percentile] = value
+        elif name in FBENCH_FIELDS:
+            field = FBENCH_FIELDS[name]
+            summary[field] = int(value) if field in FBENCH_COUNTS else value
+
+    if 'successful_requests' not in summary:
+        raise ValueError("Not a vespa-fbench benchmark summary")
+    return summary
+
+
+def build_record(summary, settings, load_generator=None, query_file=None, url=None):
+    """
+    benchmark record of a run
+
+    Input:
+        summary - benchmark summary (load_generator.summarize or parse_fbench_report)
+        settings - configuration of the run
+    Output:
+        record - (dict) context, settings and results (flat, latencies in ms)
+    """
+    revision, dirty = git_revision()
+
+    values = dict(summary)
+    for percentile in PERCENTILES:
+        values["p{}".format(percentile)] = summary['percentiles'].get(percentile)
+    n_requests = (summary.get('successful_requests') or 0) + (summary.get('failed_requests') or 0)
+    values['failure_rate'] = (summary.get('failed_requests') or 0)/n_requests if n_requests else 0.0
+    results = {name: values.get(name) for name in RESULT_FIELDS}
+
+    return {'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': revision,
+            'git_dirty': dirty,
+            'schema_name': settings.schema_name,
+            'load_generator': load_generator or settings.load_generator,
+            'query_file': query_file,
+            'url': url,
+            'settings': {name: getattr(settings, name, None) for name in SETTING_FIELDS},
+            'results': results,
+            'status_breakdown': {str(status): count for status, count in summary.get('status_breakdown', {}).items()},
+            'classes': summary.get('classes', {})}
+
+
+def save_record(record, json_file, csv_file=None):
+    """
+    write a record as JSON and append it to a CSV history (one row per run)
+    """
+    with open(json_file, 'w', encoding='utf8') as file:
+        json.dump(record, file, indent=2)
+
+    if csv_file:
+        new_file = not os.path.exists(csv_file)
+        #settings columns are prefixed (target_qps and cycle_time are also results)
+        row = {name: record.get(name) for name in CONTEXT_FIELDS}
+        row.update({"setting_" + name: value for name, value in record['settings'].items()})
+        row.update(record['results'])
+        fieldnames = CONTEXT_FIELDS + ["setting_" + name for name in SETTING_FIELDS] + RESULT_FIELDS
+
+        with open(csv_file, 'a', encoding='utf8', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+
+def load_record(json_file):
+    with open(json_file, 'r', encoding='utf8') as file:
+        return json.load(file)
+
+
+def compare(record, baseline, max_p99_regression=0.10, max_qps_regression=0.10):
+    """
+    compare a run against a baseline
+
+    Input:
+        record, baseline - benchmark records
+        max_p99_regression - max relative increase of the p99 latency (0.1 = 10%)
+        max_qps_regression - max relative decrease of the actual query rate
+    Output:
+        rows - list of (metric, baseline, current, relative change, regressed)
+        regressed - True if a gated metric regressed past its threshold
+    """
+    gates = {'p99': ('increase', max_p99_regression), 'actual_query_rate': ('decrease', max_qps_regression)}
+    metrics = ['actual_query_rate', 'avg_response_time', 'p50', 'p90', 'p95', 'p99', 'p99.9',
+               'failure_rate', 'zero_hit_percentage']
+
+    rows = []
+    for metric in metrics:
+        old, new = baseline['results'].get(metric), record['results'].get(metric)
+        change = (new - old)/old if old and new is not None else None
+
+        failed = False
+        if metric in gates and change is not None:
+            direction, threshold = gates[metric]
+            failed = change > threshold if direction == 'increase' else -change > threshold
+        rows.append((metric, old, new, change, failed))
+
+    return rows, any(row[4] for row in rows)
+
+
+def format_comparison(rows, record, baseline):
+    """
+    comparison table text
+    """
+    lines = ["Benchmark comparison: {} ({}) vs. baseline {} ({})".format(
+                 (record.get('git_revision') or "unknown")[:10], record.get('timestamp'),
+                 (baseline.get('git_revision') or "unknown")[:10], baseline.get('timestamp')),
+             "{:<22}{:>12}{:>12}{:>10}".format("metric", "baseline", "current", "change")]
+
+    for metric, old, new, change, failed in rows:
+        lines.append("{:<22}{:>12}{:>12}{:>10}{}".format(
+            metric, "n/a" if old is None else "{:.3f}".format(old), "n/a" if new is None else "{:.3f}".format(new),
+            "n/a" if change is None else "{:+.1%}".format(change), "  REGRESSION" if failed else ""))
+    return "\n".join(lines)
+
+
+def compare_files(record_file, baseline_file, max_p99_regression=0.10, max_qps_regression=0.10):
+    """
+    compare two record files and print the table
+    Output:
+        regressed - True if a gated metric regressed
+    """
+    record, baseline = load_record(record_file), load_record(baseline_file)
+    rows, regressed = compare(record, baseline, max_p99_regression, max_qps_regression)
+    print(format_comparison(rows, record, baseline))
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark records and baseline comparison")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compare_parser = commands.add_parser("compare", help="compare a run against a baseline (exit 1 on regression)")
+    compare_parser.add_argument("record", help="benchmark record (JSON) of the run")
+    compare_parser.add_argument("baseline", help="benchmark record (JSON) of the baseline")
+    compare_parser.add_argument("--max-p99-regression", type=float, default=0.10, help="max relative p99 increase")
+    compare_parser.add_argument("--max-qps-regression", type=float, default=0.10, help="max relative Q/s decrease")
+
+    parse_parser = commands.add_parser("parse", help="convert a vespa-fbench text report to a record")
+    parse_parser.add_argument("report", help="vespa-fbench text report")
+    parse_parser.add_argument("record", help="output record (JSON)")
+    parse_parser.add_argument("--schema-name", default="organization")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        return 1 if compare_files(args.record, args.baseline, args.max_p99_regression, args.max_qps_regression) else 0
+
+    with open(args.report, 'r', encoding='utf8') as file:
+        summary = parse_fbench_report(file.read())
+    settings = argparse.Namespace(schema_name=args.schema_name, load_generator="fbench")
+    save_record(build_record(summary, settings, query_file=args.report), args.record)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - extraction benchmark
+measure data extraction time on synthetic provider records of increasing size
+
+v0.1 - record accumulation benchmark (time should grow linearly with the number of records)
+v0.2 - contract section microbenchmark (per-record cost before/after the cached reducer)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import time
+from datetime import datetime
+from ..ingestion import provider_data_extraction
+
+
+def make_synthetic_record(n):
+    """
+    create a synthetic raw provider record with all required sections
+
+    Inputs:
+        n - record number (used for keys and to vary the content)
+
+    Outputs:
+        record - raw provider record (dict)
+    """
+
+    cancel_dates = ['9999-12-31', '2024-12-31', '2022-01-31']
+    cancel_date = cancel_dates[n % len(cancel_dates)]
+
+    record = {
+        'enterpriseProviderId': str(100000000 + n),
+        'generatedKey': 'key-{}'.format(n),
+        'providerData': [{'voidedIndicator': 'N', 'cancelDate': '9999-12-31', 'lastName': 'Wellness Clinic {}'.format(n % 5000),
+                          'firstName': '', 'middleName': '', 'providerTypeCode': 'HO', 'organizationTypeCode': 'CLN'}],
+        'providerTinAddressData': [{'zipCode': str(1000 + n % 99000), 'addressId': str(n), 'addressLine1': '{} Main St'.format(n % 900),
+                                    'cityName': 'Boston', 'countyName': 'Suffolk', 'stateCode': 'MA',
+                                    'latitude': '42.36', 'longitude': '-71.06'}],
+        'cspContractData': [{'cspProviderId': 'C1', 'voidedIndicator': 'N', 'ovationLOBTypeCode': 'CS', 'cancelDate': cancel_date},
+                            {'cspProviderId': 'C2', 'voidedIndicator': 'N', 'ovationLOBTypeCode': 'EI', 'cancelDate': '9999-12-31'}],
+        'nationalProviderIdData': [{'nationalProviderId': 'N1', 'voidedIndicator': 'N', 'taxonomyCode': '207Q00000X', 'cancelDate': '9999-12-31'}],
+        'cosmosContractData': [{'cosmosProviderNumber': 'P1', 'voidedIndicator': 'N', 'cosmosDiv': 'NY1', 'cosmosPanelNumber': '01', 'cancelDate': cancel_date}],
+        'unetContractData': [{'contractId': 'U1', 'voidedIndicator': 'N', 'marketNumber': '0001', 'productOfferId': 'PO1',
+                              'acceptingPatientCode': 'A', 'cancelDate': '9999-12-31'}],
+        'specialtyContractingOrgData': [{'specialtyTypeCode': '015', 'voidedIndicator': 'N', 'contractingOrgCode': 'UHN',
+                                         'primaryCode': 'P', 'cancelDate': cancel_date}],
+        'addressContractingOrgData': [{'contractingOrgCode': 'UHN', 'voidedIndicator': 'N', 'primaryCode': 'P',
+                                       'correspondenceIndicator': 'Y', 'cancelDate': '9999-12-31'}],
+        }
+
+    return record
+
+
+def iter_synthetic_records(n_records):
+    """
+    yield n_records synthetic raw provider records
+    """
+    for n in range(n_records):
+        yield make_synthetic_record(n)
+
+
+def benchmark_extraction(n_records, settings):
+    """
+    time the extraction of n_records synthetic records into a data frame
+
+    Inputs:
+        n_records - number of synthetic records
+
+    Outputs:
+        exec_time - extraction time (in sec)
+        df - extracted data frame
+    """
+
+    start_time = time.time()
+    df, _, _ = provider_data_extraction.extract_records(iter_synthetic_records(n_records), settings)
+    exec_time = time.time() - start_time
+
+    return exec_time, df
+
+
+def legacy_reduce_contract_section(dsection, spec, settings):
+    """
+    reference contract section processing before the table-driven reducer 
+    (strptime/strftime/int for every sub-record)
+    """
+
+    contract = dict()
+
+    for record in dsection:
+        m_id = record[spec['id_field']].lower()
+        void_ind = record['voidedIndicator']
+
+        if m_id and void_ind == 'N':
+            code = "-".join([record[x].lower() for x in spec['key_fields']])
+            expire_date = int(datetime.strftime(datetime.strptime(record[spec['date_field']], '%Y-%m-%d'),'%Y%m%d'))
+
+            if expire_date >= settings.current_date:
+                #get the max expire date for a code for non-expired contracts
+                if code in contract:
+                    if expire_date > contract[code]:
+                        contract[code] = expire_date
+                else:
+                    contract[code] = expire_date
+
+    return {spec['output_field']: contract}
+
+
+def benchmark_contract_sections(n_records, settings):
+    """
+    time the six contract sections of n_records synthetic records 
+    with the legacy processing and with the cached reducer
+
+    Inputs:
+        n_records - number of synthetic records
+
+    Outputs:
+        legacy_time - legacy processing time (in sec)
+        reducer_time - reducer processing time (in sec)
+    """
+
+    specs = provider_data_extraction.contract_section_specs
+    records = [make_synthetic_record(n) for n in range(n_records)]
+    provider_data_extraction.cancel_date_to_int.cache_clear()
+
+    timings = []
+    for reduce_section in [legacy_reduce_contract_section, provider_data_extraction.reduce_contract_section]:
+        start_time = time.time()
+        for record in records:
+            for section, spec in specs.items():
+                reduce_section(record[section], spec, settings)
+        timings.append(time.time() - start_time)
+
+    #both implementations must agree
+    for record in records[:1000]:
+        for section, spec in specs.items():
+            if legacy_reduce_contract_section(record[section], spec, settings) != provider_data_extraction.reduce_contract_section(record[section], spec, settings):
+                raise ValueError("Contract reducer output differs for section {}.".format(section))
+
+    return timings[0], timings[1]
+
+
+def main_process(settings):
+    benchmark_sizes = settings.extraction_benchmark_sizes
+
+    #temp settings for the benchmark (restored at the end)
+    num_dispay = settings.num_dispay
+    data_type = getattr(settings, 'data_type', None)
+    settings.num_dispay = max(benchmark_sizes) + 1 #no progress display
+    settings.data_type = settings.data_types[0]
+
+    try:
+        print("{:>12} {:>12} {:>16} {:>10}".format("records", "time (sec)", "usec per record", "scale"))
+        base_cost = None
+
+        for n_records in benchmark_sizes:
+            exec_time, df = benchmark_extraction(n_records, settings)
+            cost = 1e6*exec_time/n_records
+            base_cost = base_cost or cost
+
+            #a linear extraction keeps the per-record cost (scale) close to 1
+            print("{:>12} {:>12.2f} {:>16.2f} {:>10.2f}".format(n_records, exec_time, cost, cost/base_cost))
+            del df
+
+        #contract section microbenchmark
+        n_records = settings.contract_benchmark_size
+        legacy_time, reducer_time = benchmark_contract_sections(n_records, settings)
+        print("\nContract sections ({} records):".format(n_records))
+        print("{:>12} {:>16.2f} usec per record".format("before", 1e6*legacy_time/n_records))
+        print("{:>12} {:>16.2f} usec per record".format("after", 1e6*reducer_time/n_records))
+        print("{:>12} {:>16.2f}x".format("speedup", legacy_time/max(reducer_time, 1e-9)))
+    finally:
+        settings.num_dispay = num_dispay
+        settings.data_type = data_type
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - feed benchmark
+measure client-side feed costs without a vespa container
+
+v0.1 - data frame to feed document conversion: peak RSS and time-to-first-document
+       (legacy fillna + iterrows list vs. lazy conversion)
+v0.2 - JSONL export serialization throughput (MB/s per serializer and compression)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, sys, time, resource, tempfile
+import multiprocessing as mp
+import numpy as np
+from ..ingestion import provider_data_extraction, provider_data_export
+from ..ingestion.provider_data_async_feed import iter_put_operations
+from ..ingestion.feed_conversion import iter_vespa_documents
+from .extraction_benchmark import iter_synthetic_records
+
+
+def make_synthetic_frame(n_rows, settings, n_unique=1000):
+    """
+    create an extracted data frame of n_rows rows (synthetic records replicated, unique keys)
+
+    Inputs:
+        n_rows - number of rows
+        n_unique - number of distinct synthetic records
+    """
+    num_dispay = settings.num_dispay
+    settings.num_dispay = n_unique + 1 #no progress display
+    settings.data_type = settings.data_types[0]
+
+    try:
+        base, _, _ = provider_data_extraction.extract_records(iter_synthetic_records(n_unique), settings)
+    finally:
+        settings.num_dispay = num_dispay
+
+    data = base.iloc[np.arange(n_rows) % len(base)].reset_index(drop=True)
+    data[settings.key_id_field] = ["key-{}".format(n) for n in range(n_rows)]
+
+    #some missing values (converted to the NaN fill value in the feed)
+    data['address_id'] = data['address_id'].astype(float)
+    data.loc[::100, 'address_id'] = np.nan
+
+    return data
+
+
+def legacy_documents(data, id_field):
+    """
+    reference conversion before the lazy pipeline: fillna copy + iterrows into a full list
+    """
+    data = data.fillna(999999)
+    data_list = []
+
+    for idx, row in data.iterrows():
+        temp_data = dict()
+        temp_data['id'] = row[id_field]
+        temp_data['fields'] = dict(row)
+        data_list.append(temp_data)
+
+    return data_list
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/(1024*1024) if sys.platform == "darwin" else peak/1024 #bytes on macOS, KB on linux
+
+
+def _run_conversion(method, n_rows, settings, queue):
+    """
+    worker: build the frame, then convert and consume all documents (one process per method,
+    so the peak RSS of each method is measured separately)
+    """
+    data = make_synthetic_frame(n_rows, settings)
+    id_field = settings.key_id_field
+    base_rss = _peak_rss_mb()
+
+    start_time = time.time()
+    if method == "legacy":
+        documents = legacy_documents(data, id_field)
+    else:
+        documents = iter_vespa_documents(data, id_field, settings.nan_fill_value, settings.feed_conversion_chunk_size)
+
+    first_time = None
+    count = 0
+    for document in documents:
+        if first_time is None:
+            first_time = time.time() - start_time
+        count += 1
+
+    total_time = time.time() - start_time
+    queue.put({'method': method, 'documents': count, 'first_document_secs': first_time,
+               'total_secs': total_time, 'frame_rss_mb': base_rss, 'extra_peak_rss_mb': _peak_rss_mb() - base_rss})
+
+
+def benchmark_conversion(n_rows, settings):
+    """
+    measure the legacy and lazy conversions of an n_rows data frame
+
+    Outputs:
+        results - list of dict (method, documents, first_document_secs, total_secs, frame_rss_mb, extra_peak_rss_mb)
+    """
+    results = []
+    for method in ["legacy", "lazy"]:
+        queue = mp.Queue()
+        worker = mp.Process(target=_run_conversion, args=(method, n_rows, provider_data_extraction.settings_snapshot(settings), queue))
+        worker.start()
+        results.append(queue.get())
+        worker.join()
+
+    return results
+
+
+def benchmark_serialization(n_rows, settings):
+    """
+    measure the JSONL export throughput of an n_rows data frame for each available serializer
+    and compression (serialization only, and conversion + serialization + write)
+
+    Outputs:
+        results - list of dict (serializer, compression, serialize_mb_per_sec, export_mb_per_sec, mb, file_mb)
+    """
+    data = make_synthetic_frame(n_rows, settings)
+    id_field = settings.key_id_field
+    schema_name = settings.schema_name
+    serializers = ["json"] + (["orjson"] if provider_data_export.orjson is not None else [])
+
+    documents = [provider_data_export.to_document_json(x, schema_name, schema_name)
+                 for x in iter_put_operations(data, id_field, settings.nan_fill_value, settings.feed_conversion_chunk_size)]
+
+    results = []
+    for serializer in serializers:
+        serialize, _ = provider_data_export.create_serializer(serializer)
+
+        start_time = time.time()
+        n_bytes = sum(len(serialize(document)) + 1 for document in documents)
+        serialize_time = time.time() - start_time
+
+        for compression in [None, "gzip"]:
+            with tempfile.TemporaryDirectory() as outdir:
+                start_time = time.time()
+                operations = iter_put_operations(data, id_field, settings.nan_fill_value, settings.feed_conversion_chunk_size)
+                serialize, _ = provider_data_export.create_serializer(serializer)
+                with provider_data_export.ShardedJsonlWriter(outdir, settings.export_shard_size, compression,
+                                                             settings.export_compress_level, settings.export_buffer_size) as writer:
+                    for operation in operations:
+                        writer.write(serialize(provider_data_export.to_document_json(operation, schema_name, schema_name)))
+                export_time = time.time() - start_time
+                file_bytes = sum(os.path.getsize(x) for x in writer.filenames)
+
+            results.append({'serializer': serializer, 'compression': compression or "none",
+                            'serialize_mb_per_sec': n_bytes/1e6/max(serialize_time, 1e-9),
+                            'export_mb_per_sec': writer.n_bytes/1e6/max(export_time, 1e-9),
+                            'mb': writer.n_bytes/1e6, 'file_mb': file_bytes/1e6})
+
+    return results
+
+
+def main_process(settings):
+    n_rows = settings.feed_benchmark_rows
+    print("Feed document conversion ({} rows):".format(n_rows))
+    print("{:>8} {:>12} {:>20} {:>12} {:>14} {:>18}".format(
+        "method", "documents", "first document (s)", "total (s)", "frame RSS (MB)", "extra peak (MB)"))
+
+    for result in benchmark_conversion(n_rows, settings):
+        print("{method:>8} {documents:>12} {first_document_secs:>20.4f} {total_secs:>12.2f} {frame_rss_mb:>14.1f} {extra_peak_rss_mb:>18.1f}".format(**result))
+
+    n_rows = settings.serialization_benchmark_rows
+    print("\nJSONL export serialization ({} rows):".format(n_rows))
+    print("{:>10} {:>12} {:>18} {:>16} {:>10} {:>10}".format(
+        "serializer", "compression", "serialize (MB/s)", "export (MB/s)", "MB", "file MB"))
+
+    for result in benchmark_serialization(n_rows, settings):
+        print("{serializer:>10} {compression:>12} {serialize_mb_per_sec:>18.1f} {export_mb_per_sec:>16.1f} {mb:>10.1f} {file_mb:>10.1f}".format(**result))
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - load generator
+in-process replacement of vespa-fbench: runs a query file (/search/ url lines) against a vespa
+endpoint (or the local stub server) over pooled keep-alive connections
+
+modes:
+    closed - n clients, each sends its next query when the previous one returns
+             (optionally one query per cycle time, as fbench -c)
+    open - queries are scheduled at a target rate (Q/s) regardless of the responses
+    replay - queries are sent at the given send times (e.g., a captured query log, see workload_models)
+
+coordinated omission correction:
+    open/replay - latency is measured from the scheduled send time, so the queueing behind a slow
+                  server is part of the latency
+    closed - with a cycle time, a response slower than the cycle adds the latencies of the
+             requests that would have been sent meanwhile (HdrHistogram expected interval)
+
+latencies are recorded in HDR-style (log-linear) histograms; the report has the fields of the
+fbench benchmark summary (percentiles, actual query rate, utilization, zero hit percentage,
+http status breakdown)
+
+with query tags (see query_classes) the results are also broken down per query class and rank
+profile, optionally with the vespa presentation.timing (query/summary fetch time) and totalCount
+
+v0.1 - closed/open loop load generator with HDR histograms and an fbench-style report
+v0.2 - replay of a query schedule (original inter-arrival timing of a query log)
+v0.3 - per query class breakdown with the vespa timing and total count
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import asyncio, time, itertools
+from collections import Counter
+from ..http_pool import HttpConnectionPool, HttpError
+from ..search.search_client import search_path, parse_stats
+from .query_classes import tag_label
+
+PERCENTILES = (25, 50, 75, 90, 95, 98, 99, 99.5, 99.6, 99.7, 99.8, 99.9) #percentiles of the fbench summary
+
+
+class HdrHistogram:
+    """
+    HDR-style latency histogram: values (in microseconds) are counted in log-linear buckets with
+    a fixed relative precision (significant_digits) from 1 us up to any latency
+
+    Input:
+        significant_digits - decimal digits of precision of the recorded values (1-5)
+    """
+
+    def __init__(self, significant_digits=3):
+        self.significant_digits = significant_digits
+        self.sub_bucket_bits = (2*10**significant_digits - 1).bit_length()
+        self.counts = Counter() #bucket index -> count
+        self.count = 0
+        self.total = 0 #sum of the values (in us)
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return (shift << self.sub_bucket_bits) | (value >> shift)
+
+    def _value(self, index):
+        #highest value of the bucket (values are reported at their upper bound, as HdrHistogram)
+        shift = index >> self.sub_bucket_bits
+        sub_bucket = index & ((1 << self.sub_bucket_bits) - 1)
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, latency, count=1):
+        """
+        record a latency (in sec)
+        """
+        value = max(1, int(latency*1e6 + 0.5))
+        self.counts[self._index(value)] += count
+        self.count += count
+        self.total += value*count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def record_corrected(self, latency, expected_interval):
+        """
+        record a latency (in sec) with coordinated omission correction: a latency longer than the
+        expected interval between requests also records the requests that were held back
+        (latency - interval, latency - 2*interval, ...)
+        """
+        self.record(latency)
+        if not expected_interval or expected_interval <= 0:
+            return
+
+        missing = latency - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def merge(self, other):
+        """
+        add the counts of another histogram (same significant digits)
+        """
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        return self
+
+    def percentile(self, percentile):
+        """
+        latency (in sec) at a percentile (0-100)
+        """
+        if not self.count:
+            return None
+
+        rank = max(1, int(percentile/100*self.count + 0.5))
+        cumulative = 0
+        for index in sorted(self.counts):
+            cumulative += self.counts[index]
+            if cumulative >= rank:
+                return min(self._value(index), self.max)/1e6
+        return self.max/1e6
+
+    def mean(self):
+        return self.total/self.count/1e6 if self.count else None
+
+
+def load_queries(queryfile):
+    """
+    /search/ url lines of a query file (empty lines are skipped)
+    """
+    with open(queryfile, 'r', encoding='utf8') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+class ClassResult:
+    """
+    measurements of a query class
+    """
+
+    def __init__(self):
+        self.latency = HdrHistogram()
+        self.query_time = HdrHistogram() #vespa timing: query (matching and ranking) time
+        self.summary_fetch_time = HdrHistogram() #vespa timing: summary fetch time
+        self.successful = 0
+        self.failed = 0
+        self.zero_hits = 0
+        self.total_count = 0 #sum of totalCount
+
+
+class LoadResult:
+    """
+    measurements of a load run
+    """
+
+    def __init__(self):
+        self.latency = HdrHistogram() #corrected latencies (the service time seen by the users)
+        self.service_latency = HdrHistogram() #measured from the request call (without the schedule/cycle corrections)
+        self.statuses = Counter() #http status (or "error") -> count
+        self.successful = 0
+        self.failed = 0
+        self.zero_hits = 0
+        self.cycles_not_held = 0
+        self.ignored = 0
+        self.busy_time = 0.0 #time (in sec) the clients spent waiting for responses
+        self.duration = 0.0
+        self.by_class = dict() #tag label -> ClassResult (with query tags)
+
+
+class LoadGenerator:
+    """
+    closed/open loop load generator
+
+    Input:
+        url - vespa url (e.g., http://localhost:8080)
+        queries - list of queries (/search/ url lines or query parameters); cycled until the end of the run
+        clients - closed loop: number of clients; open loop: max queries in flight
+        duration - run time (in sec)
+        qps - target query rate (None = closed loop)
+        cycle_time - closed loop: min time (in sec) between the queries of a client (0 = none, fbench -c)
+        ignore_first - responses ignored for the system warming up (fbench -i)
+        timeout - client time out (in sec) per query
+        max_queries - stop after this number of queries (None = run for duration)
+        schedule - send times (in sec from the start) of the queries (replay; the queries are not cycled)
+        tags - (class, rank profile) of each query (None = no breakdown)
+        timing - request the vespa presentation.timing of each query
+    """
+
+    def __init__(self, url, queries, clients=5, duration=30, qps=None, cycle_time=0, ignore_first=20,
+                 timeout=15, max_queries=None, schedule=None, tags=None, timing=False):
+        self.url = url
+        self.queries = queries
+        self.clients = clients
+        self.duration = duration
+        self.qps = qps
+        self.cycle_time = cycle_time
+        self.ignore_first = ignore_first
+        self.timeout = timeout
+        self.max_queries = max_queries
+        self.schedule = schedule
+        self.labels = [tag_label(tag) for tag in tags] if tags is not None else None
+        self.timing = timing
+
+    @property
+    def mode(self):
+        if self.schedule is not None:
+            return "replay"
+        return "open" if self.qps else "closed"
+
+    def _path(self, query):
+        path = search_path(query)
+        if self.timing:
+            path += ("&" if "?" in path else "?") + "presentation.timing=true"
+        return path
+
+    async def _query(self, pool, n, query, result, scheduled_time):
+        #send query n; the latency of the result is measured from scheduled_time
+        send_time = time.perf_counter()
+        try:
+            status, body = await pool.request("GET", self._path(query))
+        except (HttpError, OSError, asyncio.TimeoutError):
+            status, body = None, None
+        end_time = time.perf_counter()
+        result.busy_time += end_time - send_time
+
+        if result.ignored < self.ignore_first:
+            result.ignored += 1
+            return end_time - send_time
+
+        by_class = None
+        if self.labels is not None:
+            label = self.labels[n]
+            by_class = result.by_class.get(label) or result.by_class.setdefault(label, ClassResult())
+
+        result.statuses["error" if status is None else status] += 1
+        if status != 200:
+            result.failed += 1
+            if by_class is not None:
+                by_class.failed += 1
+            return end_time - send_time
+
+        result.successful += 1
+        total_count, n_hits, timing = parse_stats(body)
+        zero_hit = not total_count and not n_hits
+        result.zero_hits += zero_hit
+
+        if self.qps or self.schedule is not None:
+            result.latency.record(end_time - scheduled_time)
+        else:
+            result.latency.record_corrected(end_time - send_time, self.cycle_time)
+        result.service_latency.record(end_time - send_time)
+
+        if by_class is not None:
+            by_class.successful += 1
+            by_class.zero_hits += zero_hit
+            by_class.total_count += total_count
+            by_class.latency.record(end_time - (scheduled_time if self.qps or self.schedule is not None else send_time))
+            if timing:
+                by_class.query_time.record(timing.get('querytime', 0.0))
+                by_class.summary_fetch_time.record(timing.get('summaryfetchtime', 0.0))
+        return end_time - send_time
+
+    async def _closed_loop(self, pool, result, queries, end_time):
+        async def client():
+            for n, query in queries:
+                start_time = time.perf_counter()
+                if start_time >= end_time:
+                    break
+
+                latency = await self._query(pool, n, query, result, start_time)
+                if self.cycle_time:
+                    if latency > self.cycle_time:
+                        result.cycles_not_held += 1
+                    else:
+                        await asyncio.sleep(self.cycle_time - latency)
+
+        await asyncio.gather(*[client() for _ in range(self.clients)])
+
+    async def _open_loop(self, pool, result, queries, start_time, end_time):
+        interval = 1.0/self.qps if self.schedule is None else None
+        tasks = set()
+
+        for k, (n, query) in enumerate(queries):
+            scheduled_time = start_time + (self.schedule[n] if interval is None else k*interval)
+            if scheduled_time >= end_time:
+                break
+
+            delay = scheduled_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            #queries behind the in-flight limit wait in the pool; their latency still starts at the schedule
+            task = asyncio.ensure_future(self._query(pool, n, query, result, scheduled_time))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def run(self):
+        """
+        run the load
+        Output:
+            LoadResult
+        """
+        result = LoadResult()
+        #(index, query), shared by the clients
+        queries = enumerate(self.queries)
+        if self.schedule is None:
+            queries = itertools.cycle(queries)
+        if self.max_queries:
+            queries = itertools.islice(queries, self.max_queries + self.ignore_first)
+
+        async with HttpConnectionPool(self.url, self.clients, self.timeout) as pool:
+            start_time = time.perf_counter()
+            end_time = start_time + self.duration
+            if self.qps or self.schedule is not None:
+                await self._open_loop(pool, result, queries, start_time, end_time)
+            else:
+                await self._closed_loop(pool, result, queries, end_time)
+            result.duration = time.perf_counter() - start_time
+
+        return result
+
+
+def summarize(result, generator):
+    """
+    benchmark summary of a load run (the fields of the fbench report; latencies in ms)
+    """
+    latency = result.latency
+    n_queries = result.successful + result.failed
+
+    summary = {'mode': generator.mode,
+               'clients': generator.clients,
+               'target_qps': generator.qps if generator.mode == "open" else None,
+               'ran_for': result.duration,
+               'cycle_time': generator.cycle_time*1000,
+               'ignored_requests': result.ignored,
+               'failed_requests': result.failed,
+               'successful_requests': result.successful,
+               'cycles_not_held': result.cycles_not_held if generator.cycle_time else result.successful,
+               'min_response_time': latency.min/1000 if latency.count else None,
+               'max_response_time': latency.max/1000 if latency.count else None,
+               'avg_response_time': latency.mean()*1000 if latency.count else None,
+               'percentiles': {p: latency.percentile(p)*1000 if latency.count else None for p in PERCENTILES},
+               'service_percentiles': {p: result.service_latency.percentile(p)*1000 if latency.count else None
+                                       for p in (50, 99)},
+               'actual_query_rate': n_queries/result.duration if result.duration else 0.0,
+               'utilization': 100*result.busy_time/(generator.clients*result.duration) if result.duration else 0.0,
+               'zero_hit_queries': result.zero_hits,
+               'zero_hit_percentage': 100*result.zero_hits/result.successful if result.successful else 0.0,
+               'status_breakdown': dict(result.statuses)}
+
+    if result.by_class:
+        summary['classes'] = {label: summarize_class(by_class, result.duration)
+                              for label, by_class in sorted(result.by_class.items())}
+    return summary
+
+
+def summarize_class(by_class, duration):
+    """
+    summary of a query class (latencies in ms; the vespa timing percentiles are None without timing data)
+    """
+    def percentile(histogram, p):
+        return histogram.percentile(p)*1000 if histogram.count else None
+
+    return {'successful_requests': by_class.successful,
+            'failed_requests': by_class.failed,
+            'query_rate': (by_class.successful + by_class.failed)/duration if duration else 0.0,
+            'avg_response_time': by_class.latency.mean()*1000 if by_class.latency.count else None,
+            'percentiles': {p: percentile(by_class.latency, p) for p in (50, 90, 99, 99.9)},
+            'zero_hit_percentage': 100*by_class.zero_hits/by_class.successful if by_class.successful else 0.0,
+            'avg_total_count': by_class.total_count/by_class.successful if by_class.successful else 0.0,
+            'query_time': {p: percentile(by_class.query_time, p) for p in (50, 99)},
+            'summary_fetch_time': {p: percentile(by_class.summary_fetch_time, p) for p in (50, 99)}}
+
+
+def format_report(summary):
+    """
+    benchmark summary text (layout of the vespa-fbench summary)
+    """
+    def ms(value):
+        return "{:.2f} ms".format(value) if value is not None else "n/a"
+
+    lines = ["***************** Benchmark Summary *****************",
+             "{:<24}{:>13}".format("mode:", summary['mode']),
+             "{:<24}{:>13}".format("clients:", summary['clients'])]
+    if summary['target_qps']:
+        lines.append("{:<24}{:>13}".format("target query rate:", "{:.2f} Q/s".format(summary['target_qps'])))
+    lines += ["{:<24}{:>13}".format("ran for:", "{:.0f} seconds".format(summary['ran_for'])),
+              "{:<24}{:>13}".format("cycle time:", "{:.0f} ms".format(summary['cycle_time'])),
+              "{:<24}{:>13}".format("ignored requests:", summary['ignored_requests']),
+              "{:<24}{:>13}".format("failed requests:", summary['failed_requests']),
+              "{:<24}{:>13}".format("successful requests:", summary['successful_requests']),
+              "{:<24}{:>13}".format("cycles not held:", summary['cycles_not_held']),
+              "{:<24}{:>13}".format("minimum response time:", ms(summary['min_response_time'])),
+              "{:<24}{:>13}".format("maximum response time:", ms(summary['max_response_time'])),
+              "{:<24}{:>13}".format("average response time:", ms(summary['avg_response_time']))]
+    for percentile, value in summary['percentiles'].items():
+        lines.append("{:<24}{:>13}".format("{:<5}percentile:".format(percentile), ms(value)))
+    lines += ["{:<24}{:>13}".format("actual query rate:", "{:.2f} Q/s".format(summary['actual_query_rate'])),
+              "{:<24}{:>13}".format("utilization:", "{:.2f} %".format(summary['utilization'])),
+              "{:<24}{:>13}".format("zero hit queries:", summary['zero_hit_queries']),
+              "{:<24}{:>13}".format("zero hit percentage:", "{:.2f} %".format(summary['zero_hit_percentage'])),
+              "http request status breakdown:"]
+    for status, count in sorted(summary['status_breakdown'].items(), key=lambda x: str(x[0])):
+        lines.append("{:>10} : {:>8}".format(status, count))
+
+    if summary.get('classes'):
+        lines += ["per query class (latencies in ms; query/fetch = vespa querytime/summaryfetchtime p50/p99):",
+                  "{:<28}{:>9}{:>9}{:>9}{:>9}{:>9}{:>9}{:>8}{:>11}{:>15}{:>15}".format(
+                      "class/profile", "queries", "Q/s", "avg", "p50", "p99", "p99.9", "zero%", "totalCount",
+                      "query", "fetch")]
+        for label, stats in summary['classes'].items():
+            def pair(values):
+                return "n/a" if values[50] is None else "{:.2f}/{:.2f}".format(values[50], values[99])
+            lines.append("{:<28}{:>9}{:>9.1f}{:>9}{:>9}{:>9}{:>9}{:>8.1f}{:>11.1f}{:>15}{:>15}".format(
+                label, stats['successful_requests'] + stats['failed_requests'], stats['query_rate'],
+                "n/a" if stats['avg_response_time'] is None else "{:.2f}".format(stats['avg_response_time']),
+                *["n/a" if stats['percentiles'][p] is None else "{:.2f}".format(stats['percentiles'][p]) for p in (50, 99, 99.9)],
+                stats['zero_hit_percentage'], stats['avg_total_count'],
+                pair(stats['query_time']), pair(stats['summary_fetch_time'])))
+
+    return "\n".join(lines)
+
+
+def create_load_generator(settings, queries, url=None, schedule=None, tags=None):
+    """
+    load generator from the settings (n_clients, performance_test_time, target_qps, cycle_time,
+    warmup_queries, search_timeout, query_timing)
+    """
+    return LoadGenerator(url or settings.performance_test_url or settings.vespa_url_local, queries,
+                         settings.n_clients, settings.performance_test_time, settings.target_qps,
+                         settings.cycle_time/1000, settings.warmup_queries, settings.search_timeout,
+                         schedule=schedule, tags=tags, timing=settings.query_timing)
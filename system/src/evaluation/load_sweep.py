@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - load sweep
+throughput-vs-latency curves of the search endpoint: for each query class (bm25, geo, filter or all)
+and rank profile, the load steps through client counts (closed loop) or target rates (open loop);
+every step is warmed up before it is measured
+
+the knee point of a curve is the step with the highest query rate that still meets the p99 SLO
+(the capacity for planning; on a saturation plateau the first step within KNEE_TOLERANCE of the
+highest rate, i.e., the one with the least queueing); the curve table is printed and saved as
+CSV/JSON next to the query file
+
+v0.1 - client/QPS sweep per query class and rank profile with knee point detection
+v0.2 - query classes of the query tags (see query_classes)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import re, csv, json, time
+from datetime import datetime
+from ..http_pool import run_async
+from . import load_generator, benchmark_report, query_classes
+
+KNEE_TOLERANCE = 0.02 #query rates within 2% are the same throughput (measurement noise)
+PROFILE_PARAM = re.compile(r"(ranking\.profile=)[^&]*")
+CURVE_FIELDS = ['query_class', 'ranking_profile', 'clients', 'target_qps', 'actual_query_rate', 'p50', 'p90',
+                'p99', 'p99.9', 'avg_response_time', 'failed_requests', 'zero_hit_percentage', 'utilization',
+                'meets_slo', 'knee']
+
+
+def select_queries(queries, tags, name, profile=None):
+    """
+    queries of a class ("all" = every query), with the rank profile replaced if given
+    """
+    selected = [query for query, tag in zip(queries, tags) if name == "all" or tag[0] == name]
+    if profile:
+        selected = [PROFILE_PARAM.sub(r"\g<1>" + profile, query) for query in selected]
+    return selected
+
+
+def mark_knee(points, p99_slo):
+    """
+    mark the steps of a curve meeting the p99 SLO (in ms, no failed requests) and the knee point
+    Output:
+        knee - the point with the highest query rate meeting the SLO (None if no step does)
+    """
+    for point in points:
+        point['meets_slo'] = point['p99'] is not None and point['p99'] <= p99_slo and not point['failed_requests']
+        point['knee'] = False
+
+    rates = [point['actual_query_rate'] for point in points if point['meets_slo']]
+    if not rates:
+        return None
+
+    knee = next(point for point in points
+                if point['meets_slo'] and point['actual_query_rate'] >= (1 - KNEE_TOLERANCE)*max(rates))
+    knee['knee'] = True
+    return knee
+
+
+class LoadSweep:
+    """
+    sweep harness
+
+    Input:
+        url - vespa url
+        queries - /search/ url lines
+        settings - configuration (sweep_clients, sweep_qps, sweep_query_classes, sweep_profiles,
+                   sweep_step_time, sweep_warmup_time, p99_slo, sweep_stop_after_breach, search_connections,
+                   search_timeout)
+    """
+
+    def __init__(self, url, queries, settings, tags=None):
+        self.url = url
+        self.queries = queries
+        self.tags = tags if tags is not None else [query_classes.query_tag(query) for query in queries]
+        self.settings = settings
+        self.points = []
+
+    def _steps(self):
+        #(clients, target qps): open loop steps use the search connections as the max queries in flight
+        settings = self.settings
+        if settings.sweep_qps:
+            return [(settings.search_connections, qps) for qps in settings.sweep_qps]
+        return [(clients, None) for clients in settings.sweep_clients]
+
+    async def _run_step(self, queries, clients, qps):
+        settings = self.settings
+        if settings.sweep_warmup_time:
+            warmup = load_generator.LoadGenerator(self.url, queries, clients, settings.sweep_warmup_time, qps,
+                                                  ignore_first=0, timeout=settings.search_timeout)
+            await warmup.run()
+
+        generator = load_generator.LoadGenerator(self.url, queries, clients, settings.sweep_step_time, qps,
+                                                 ignore_first=0, timeout=settings.search_timeout)
+        result = await generator.run()
+        return load_generator.summarize(result, generator)
+
+    async def run(self):
+        """
+        run all curves
+        Output:
+            points - list of curve points (dict, latencies in ms)
+        """
+        settings = self.settings
+
+        for name in settings.sweep_query_classes:
+            for profile in settings.sweep_profiles or [None]:
+                queries = select_queries(self.queries, self.tags, name, profile)
+                if not queries:
+                    print("No {} queries in the query set; skipped.".format(name))
+                    continue
+
+                curve = []
+                for clients, qps in self._steps():
+                    summary = await self._run_step(queries, clients, qps)
+                    point = {'query_class': name, 'ranking_profile': profile or "query",
+                             'clients': clients, 'target_qps': qps,
+                             'actual_query_rate': summary['actual_query_rate'],
+                             'p50': summary['percentiles'][50], 'p90': summary['percentiles'][90],
+                             'p99': summary['percentiles'][99], 'p99.9': summary['percentiles'][99.9],
+                             'avg_response_time': summary['avg_response_time'],
+                             'failed_requests': summary['failed_requests'],
+                             'zero_hit_percentage': summary['zero_hit_percentage'],
+                             'utilization': summary['utilization']}
+                    curve.append(point)
+                    print("  {} / {}: {} clients{} -> {:.1f} Q/s, p99 {} ms".format(
+                        name, point['ranking_profile'], clients, ", {} Q/s target".format(qps) if qps else "",
+                        point['actual_query_rate'], "n/a" if point['p99'] is None else "{:.2f}".format(point['p99'])))
+
+                    #past saturation more load only adds latency
+                    if settings.sweep_stop_after_breach and (point['p99'] is None or point['p99'] > settings.p99_slo):
+                        break
+
+                mark_knee(curve, settings.p99_slo)
+                self.points += curve
+
+        return self.points
+
+
+def format_curves(points, p99_slo):
+    """
+    throughput/latency curve table (the knee point of each curve is marked with *)
+    """
+    def ms(value):
+        return "n/a" if value is None else "{:.2f}".format(value)
+
+    lines = ["Throughput vs. latency (p99 SLO {} ms; * = knee point, highest Q/s within the SLO)".format(p99_slo),
+             "{:<8}{:<18}{:>8}{:>10}{:>11}{:>9}{:>9}{:>9}{:>9}{:>8}{:>5}".format(
+                 "class", "profile", "clients", "target", "Q/s", "p50", "p90", "p99", "p99.9", "failed", "SLO")]
+
+    for point in points:
+        lines.append("{:<8}{:<18}{:>8}{:>10}{:>11.1f}{:>9}{:>9}{:>9}{:>9}{:>8}{:>5}{}".format(
+            point['query_class'], point['ranking_profile'], point['clients'],
+            "-" if not point['target_qps'] else point['target_qps'], point['actual_query_rate'],
+            ms(point['p50']), ms(point['p90']), ms(point['p99']), ms(point['p99.9']), point['failed_requests'],
+            "ok" if point['meets_slo'] else "no", " *" if point['knee'] else ""))
+    return "\n".join(lines)
+
+
+def save_curves(points, settings, csvfile, jsonfile):
+    """
+    write the curve points as CSV and a JSON record (with the git revision and the knee points)
+    """
+    with open(csvfile, 'w', encoding='utf8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CURVE_FIELDS)
+        writer.writeheader()
+        for point in points:
+            writer.writerow(point)
+
+    revision, dirty = benchmark_report.git_revision()
+    record = {'timestamp': datetime.now().isoformat(timespec='seconds'), 'git_revision': revision, 'git_dirty': dirty,
+              'schema_name': settings.schema_name, 'p99_slo': settings.p99_slo,
+              'knees': [point for point in points if point['knee']], 'points': points}
+    with open(jsonfile, 'w', encoding='utf8') as file:
+        json.dump(record, file, indent=2)
+
+
+def main_process(settings, url=None):
+    schema_name = settings.schema_name
+    queryfile = settings.local_query_dir + "sample_query_" + schema_name + ".txt"
+    csvfile = settings.local_query_dir + "vespa_performance_sweep_" + schema_name + ".csv"
+    jsonfile = settings.local_query_dir + "vespa_performance_sweep_" + schema_name + ".json"
+    url = url or settings.performance_test_url or settings.vespa_url_local
+
+    start_time = time.time()
+    queries = load_generator.load_queries(queryfile)
+    sweep = LoadSweep(url, queries, settings, query_classes.load_tags(queryfile, queries))
+    print("Perform Vespa load sweep ({} steps x {} secs + {} secs warmup)...".format(
+        "Q/s" if settings.sweep_qps else "client", settings.sweep_step_time, settings.sweep_warmup_time))
+    points = run_async(sweep.run())
+
+    print(format_curves(points, settings.p99_slo))
+    save_curves(points, settings, csvfile, jsonfile)
+    print("Sweep saved to {} and {}.".format(csvfile, jsonfile))
+
+    end_time = time.time()
+    print("Execution time: {} secs.".format(end_time-start_time))
+    return points
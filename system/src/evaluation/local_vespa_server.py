@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - local vespa stub server
+a lightweight asyncio HTTP/1.1 server implementing enough of /document/v1 and /search/ to accept
+feed and query traffic without a vespa container (client-side throughput and load tests)
+
+server behavior can be injected (see FaultInjection): added latency, 500/503 errors, 429 throttling
+(at random or above a max number of requests in flight), for all or some request kinds
+(put, update, remove, get, visit, search); the operation and response status counters are served
+on /local/v1/stats (GET; DELETE resets them)
+
+usage (from the system directory; the default port is the one of vespa_url_local):
+    python -m src.evaluation.local_vespa_server --port 8080
+    python -m src.evaluation.local_vespa_server --latency 5 --latency-jitter 10 --throttle-rate 0.02 --fault-kinds put update
+
+v0.1 - /document/v1 put/update/remove/get with operation counts
+v0.2 - map entry updates (field{key} assign/remove)
+v0.3 - visit (GET) and delete by selection on /document/v1/{namespace}/{doctype}/docid
+v0.4 - /search/ with userQuery term matching (all terms) over the string fields of the fed documents
+v0.5 - presentation.timing (querytime/summaryfetchtime/searchtime of the search)
+v0.6 - latency/error/429 injection, status counters (/local/v1/stats) and a clean shutdown
+v0.7 - visit pages from a cached sorted id list (rebuilt after writes that add or remove ids)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import asyncio, json, threading, argparse, re, operator, time, random
+import urllib.parse
+from bisect import bisect_right
+from collections import Counter
+
+SELECTION_TERM = re.compile(r"^\s*(\w+)\.(\w+)\s*(<=|>=|==|!=|<|>)\s*(-?\d+(?:\.\d+)?)\s*$")
+SOURCES = re.compile(r"from\s+sources\s+(\w+)")
+TOKEN = re.compile(r"\w+")
+SELECTION_OPS = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+                 '==': operator.eq, '!=': operator.ne}
+REQUEST_KINDS = ('put', 'update', 'remove', 'get', 'visit', 'search')
+DOCUMENT_KINDS = {'POST': 'put', 'PUT': 'update', 'DELETE': 'remove', 'GET': 'get'}
+
+
+def request_kind(method, path_parts):
+    """
+    kind of a request (one of REQUEST_KINDS; None for the status and stats endpoints)
+    """
+    if path_parts[:2] == ["document", "v1"]:
+        if len(path_parts) == 5 and path_parts[4] == "docid":
+            return 'remove' if method == "DELETE" else 'visit'
+        return DOCUMENT_KINDS.get(method)
+    if path_parts[:1] == ["search"]:
+        return 'search'
+    return None
+
+
+class FaultInjection:
+    """
+    injected server behavior
+
+    Input:
+        latency - added service time (in ms) of each request
+        latency_jitter - extra service time drawn uniformly from 0 to latency_jitter ms
+        error_rate - fraction of the requests answered with 500/503 (half each)
+        throttle_rate - fraction of the requests answered with 429
+        max_in_flight - requests in flight above which the server answers 429 (None = no limit; requests
+                        overlap only while they wait for the injected latency)
+        kinds - request kinds the faults apply to (None = all; see REQUEST_KINDS)
+        seed - random seed (None = not reproducible)
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, throttle_rate=0.0, max_in_flight=None,
+                 kinds=None, seed=None):
+        unknown = set(kinds or ()) - set(REQUEST_KINDS)
+        if unknown:
+            raise ValueError("Unknown request kinds: {}".format(sorted(unknown)))
+
+        self.latency = latency/1000
+        self.latency_jitter = latency_jitter/1000
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_in_flight = max_in_flight
+        self.kinds = set(kinds) if kinds else set(REQUEST_KINDS)
+        self._random = random.Random(seed)
+
+    def draw(self, kind, in_flight):
+        """
+        injected behavior of a request
+        Output:
+            delay - added service time (in sec)
+            status - injected error status (None = handle the request)
+        """
+        if kind not in self.kinds:
+            return 0.0, None
+
+        delay = self.latency + (self._random.random()*self.latency_jitter if self.latency_jitter else 0.0)
+        if self.max_in_flight is not None and in_flight > self.max_in_flight:
+            return delay, 429
+
+        draw = self._random.random()
+        if draw < self.throttle_rate:
+            return delay, 429
+        if draw < self.throttle_rate + self.error_rate:
+            return delay, 500 if draw < self.throttle_rate + self.error_rate/2 else 503
+        return delay, None
+
+
+class LocalVespaServer:
+    """
+    in-memory stand-in for the vespa container
+
+    Input:
+        host - bind address
+        port - port (0 = pick a free port)
+        faults - FaultInjection (None = no injected latency/errors)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, faults=None):
+        self.host = host
+        self.port = port
+        self.faults = faults
+        self.documents = dict() #(namespace, doctype) -> {doc id -> fields}
+        self.counts = Counter() #operation -> count
+        self.statuses = Counter() #(request kind, response status) -> count
+        self.in_flight = 0
+        self.max_in_flight = 0 #peak of the requests in flight
+        self._indexes = dict() #doctype -> term index of the searchable documents (rebuilt after writes)
+        self._visit_ids = dict() #(namespace, doctype) -> sorted doc ids (rebuilt after writes that add or remove ids)
+        self._server = None
+        self._connections = set() #connection handler tasks (cancelled on stop)
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+    def stats(self):
+        """
+        operation and response status counters
+        Output:
+            stats - (dict) operations, statuses ("kind status" -> count), injected, documents, max_in_flight
+        """
+        return {'operations': dict(self.counts),
+                'statuses': {"{} {}".format(kind, status): count for (kind, status), count in sorted(self.statuses.items())},
+                'injected': sum(count for (kind, status), count in self.statuses.items() if kind.startswith("injected")),
+                'documents': {"{}/{}".format(*key): len(docs) for key, docs in self.documents.items()},
+                'max_in_flight': self.max_in_flight}
+
+    def reset_stats(self):
+        self.counts.clear()
+        self.statuses.clear()
+        self.max_in_flight = self.in_flight
+
+    #----------------- request handling -----------------
+    def handle_document(self, method, path_parts, body):
+        """
+        handle a /document/v1/{namespace}/{doctype}/docid/{id} request
+        Output:
+            status, response (dict)
+        """
+        if len(path_parts) != 4 or path_parts[2] != "docid":
+            return 400, {'message': "Unsupported document path"}
+
+        namespace, doctype, _, data_id = path_parts
+        data_id = urllib.parse.unquote(data_id)
+        docs = self.documents.setdefault((namespace, doctype), dict())
+        path = "/document/v1/{}/{}/docid/{}".format(namespace, doctype, path_parts[3])
+        if method != "GET":
+            self._indexes.pop(doctype, None)
+            if (data_id in docs) == (method == "DELETE"): #the write adds or removes a doc id
+                self._visit_ids.pop((namespace, doctype), None)
+        response = {'pathId': path, 'id': "id:{}:{}::{}".format(namespace, doctype, data_id)}
+
+        if method == "POST":
+            docs[data_id] = json.loads(body).get('fields', {})
+            self.counts['put'] += 1
+        elif method == "PUT":
+            update = json.loads(body)
+            if data_id not in docs:
+                if not update.get('create'):
+                    self.counts['update_not_found'] += 1
+                    return 404, dict(response, message="Document not found")
+                docs[data_id] = dict()
+            apply_update(docs[data_id], update.get('fields', {}))
+            self.counts['update'] += 1
+        elif method == "DELETE":
+            docs.pop(data_id, None)
+            self.counts['remove'] += 1
+        elif method == "GET":
+            self.counts['get'] += 1
+            if data_id not in docs:
+                return 404, response
+            response['fields'] = docs[data_id]
+        else:
+            return 405, {'message': "Method not allowed"}
+
+        return 200, response
+
+    def handle_visit(self, method, path_parts, params):
+        """
+        handle a /document/v1/{namespace}/{doctype}/docid request with a selection:
+        GET visits a page of documents (continuation = last visited id), DELETE removes all selected documents
+        Output:
+            status, response (dict)
+        """
+        namespace, doctype = path_parts[:2]
+        docs = self.documents.setdefault((namespace, doctype), dict())
+        path = "/document/v1/{}/{}/docid".format(namespace, doctype)
+
+        try:
+            selected = compile_selection(params.get('selection'), doctype)
+        except ValueError as e:
+            return 400, {'pathId': path, 'message': str(e)}
+
+        if method == "DELETE":
+            if not params.get('selection') or not params.get('cluster'):
+                return 400, {'pathId': path, 'message': "Delete by selection requires selection and cluster"}
+            removed = [data_id for data_id, fields in docs.items() if selected(fields)]
+            for data_id in removed:
+                del docs[data_id]
+            self._indexes.pop(doctype, None)
+            self._visit_ids.pop((namespace, doctype), None)
+            self.counts['remove_selection'] += len(removed)
+            return 200, {'pathId': path, 'documentCount': len(removed)}
+        elif method != "GET":
+            return 405, {'message': "Method not allowed"}
+
+        wanted = int(params.get('wantedDocumentCount', 100))
+        field_set = params.get('fieldSet', "[document]")
+        ids = self._visit_ids.get((namespace, doctype))
+        if ids is None:
+            ids = self._visit_ids[(namespace, doctype)] = sorted(docs)
+        start = bisect_right(ids, params['continuation']) if params.get('continuation') else 0
+
+        documents = []
+        last_id = None
+        for data_id in ids[start:]:
+            last_id = data_id
+            fields = docs[data_id]
+            if selected(fields):
+                documents.append({'id': "id:{}:{}::{}".format(namespace, doctype, data_id),
+                                  'fields': select_fields(fields, field_set)})
+                if len(documents) >= wanted:
+                    break
+
+        self.counts['visit'] += len(documents)
+        response = {'pathId': path, 'documents': documents, 'documentCount': len(documents)}
+        if last_id is not None and last_id != ids[-1]:
+            response['continuation'] = last_id
+        return 200, response
+
+    def _term_index(self, doctype):
+        #term -> doc ids over the string fields of all namespaces of the document type
+        index = self._indexes.get(doctype)
+        if index is None:
+            index = dict()
+            for (_, name), docs in self.documents.items():
+                if name != doctype:
+                    continue
+                for data_id, fields in docs.items():
+                    for value in fields.values():
+                        if isinstance(value, str):
+                            for term in TOKEN.findall(value.lower()):
+                                index.setdefault(term, set()).add((data_id, fields.get('generated_key', data_id)))
+            self._indexes[doctype] = index
+        return index
+
+    def handle_search(self, params):
+        """
+        handle a /search/ request: documents of the source matching all query terms (the geo and
+        structured filters are not evaluated; relevance is the number of matched terms)
+        Output:
+            status, response (dict)
+        """
+        match = SOURCES.search(params.get('yql', ""))
+        if not match:
+            return 400, {'root': {'errors': [{'code': 3, 'message': "Missing sources in yql"}]}}
+
+        start_time = time.perf_counter()
+        index = self._term_index(match.group(1))
+        terms = TOKEN.findall(params.get('query', "").lower())
+        matched = set.intersection(*[index.get(term, set()) for term in terms]) if terms else set()
+        hits = sorted(matched)[:int(params.get('hits', 10))]
+        self.counts['search'] += 1
+        query_time = time.perf_counter() - start_time
+
+        children = [{'id': "index:provider_content/0/{}".format(data_id), 'relevance': float(len(terms)),
+                     'fields': {'generated_key': generated_key}} for data_id, generated_key in hits]
+        response = {'root': {'id': "toplevel", 'relevance': 1.0, 'fields': {'totalCount': len(matched)},
+                             'coverage': {'coverage': 100, 'full': True}, 'children': children}}
+
+        if params.get('presentation.timing') == "true":
+            summary_fetch_time = time.perf_counter() - start_time - query_time
+            response['timing'] = {'querytime': query_time, 'summaryfetchtime': summary_fetch_time,
+                                  'searchtime': query_time + summary_fetch_time}
+        return 200, response
+
+    def route(self, method, target, body):
+        """
+        route a request
+        Output:
+            status, response (dict)
+        """
+        url = urllib.parse.urlsplit(target)
+        parts = [x for x in url.path.split("/") if x]
+
+        if parts[:2] == ["document", "v1"] and len(parts) == 5 and parts[4] == "docid":
+            return self.handle_visit(method, parts[2:], dict(urllib.parse.parse_qsl(url.query)))
+        elif parts[:2] == ["document", "v1"]:
+            return self.handle_document(method, parts[2:], body)
+        elif parts[:1] == ["search"]:
+            return self.handle_search(dict(urllib.parse.parse_qsl(url.query)))
+        elif parts[:2] == ["state", "v1"] or parts[:2] == ["ApplicationStatus"]:
+            return 200, {'status': {'code': 'up'}}
+        elif parts == ["local", "v1", "stats"]:
+            if method == "DELETE":
+                self.reset_stats()
+            return 200, self.stats()
+
+        return 404, {'message': "Unknown path {}".format(url.path)}
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, target, version = request_line.decode('latin-1').split()
+                content_length = 0
+                keep_alive = version != "HTTP/1.0"
+
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    name = name.strip().lower()
+                    if name == "content-length":
+                        content_length = int(value)
+                    elif name == "connection":
+                        keep_alive = value.strip().lower() != "close"
+
+                body = await reader.readexactly(content_length) if content_length else b""
+
+                status, response = await self._handle_request(method, target, body)
+                await self._respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            self._connections.discard(asyncio.current_task())
+
+    async def _handle_request(self, method, target, body):
+        #a request with the injected latency/errors of its kind
+        kind = request_kind(method, [x for x in urllib.parse.urlsplit(target).path.split("/") if x])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            delay, status = self.faults.draw(kind, self.in_flight) if self.faults and kind else (0.0, None)
+            if delay:
+                await asyncio.sleep(delay)
+
+            if status is not None:
+                response = {'message': "Injected {} error".format(status)}
+                kind = "injected " + kind
+            else:
+                try:
+                    status, response = self.route(method, target, body)
+                except Exception as e:
+                    status, response = 500, {'message': str(e)}
+        finally:
+            self.in_flight -= 1
+
+        self.statuses[(kind or "other", status)] += 1
+        return status, response
+
+    async def _respond(self, writer, status, response, keep_alive):
+        payload = json.dumps(response).encode('utf8')
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n" % (
+            status, b"OK" if status == 200 else b"ERROR", len(payload), b"keep-alive" if keep_alive else b"close") + payload)
+        await writer.drain()
+
+    #----------------- server lifecycle -----------------
+    async def start(self):
+        """
+        start serving in the running event loop
+        """
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """
+        stop serving and close the open (keep-alive) connections
+        """
+        self._server.close()
+        connections = list(self._connections)
+        for task in connections:
+            task.cancel()
+        await asyncio.gather(*connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def start_in_thread(self):
+        """
+        start serving in a background thread (for synchronous callers)
+        """
+        started = threading.Event()
+
+        def target():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        """
+        stop the background thread server
+        """
+        future = asyncio.run_coroutine_threadsafe(self.stop(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start_in_thread() if self._thread is None else self
+
+    def __exit__(self, *exc):
+        self.stop_thread()
+
+
+def compile_selection(selection, doctype):
+    """
+    document selection predicate (supported: the document type and field comparisons
+    with a number, joined by "and", e.g., "organization.doc_expire_date < 1685592000")
+    """
+    terms = []
+    for term in re.split(r"\s+and\s+", (selection or "").strip()):
+        term = term.strip().strip("()").strip()
+        if not term or term == doctype:
+            continue
+        match = SELECTION_TERM.match(term)
+        if not match or match.group(1) != doctype:
+            raise ValueError("Unsupported selection: {}".format(selection))
+        terms.append((match.group(2), SELECTION_OPS[match.group(3)], float(match.group(4))))
+
+    def selected(fields):
+        return all(isinstance(fields.get(field), (int, float)) and op(fields[field], value) for field, op, value in terms)
+
+    return selected
+
+
+def select_fields(fields, field_set):
+    """
+    fields of a visited document for a field set ([id], [document]/[all] or doctype:field1,field2)
+    """
+    if field_set == "[id]":
+        return dict()
+    if ":" in field_set:
+        names = field_set.split(":", 1)[1].split(",")
+        return {name: fields[name] for name in names if name in fields}
+    return fields
+
+
+def apply_update(fields, update_fields):
+    """
+    apply a vespa partial update to stored fields:
+    {field: {"assign": value}} and map entries {"field{key}": {"assign": value} / {"remove": 0}}
+    """
+    for field, update in update_fields.items():
+        if field.endswith("}") and "{" in field:
+            name, key = field[:-1].split("{", 1)
+            entries = fields.get(name) or dict()
+            fields[name] = entries
+            if 'assign' in update:
+                entries[key] = update['assign']
+            elif 'remove' in update:
+                entries.pop(key, None)
+        elif 'assign' in update:
+            fields[field] = update['assign']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="local vespa stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="added service time (ms) per request")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="extra uniform random service time (0 to ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 500/503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of requests answered 429")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="answer 429 above this number of requests in flight")
+    parser.add_argument("--fault-kinds", nargs="+", choices=REQUEST_KINDS, default=None,
+                        help="request kinds with injected faults (default: all)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    faults = None
+    if args.latency or args.latency_jitter or args.error_rate or args.throttle_rate or args.max_in_flight is not None:
+        faults = FaultInjection(args.latency, args.latency_jitter, args.error_rate, args.throttle_rate,
+                                args.max_in_flight, args.fault_kinds, args.seed)
+
+    async def serve():
+        server = await LocalVespaServer(args.host, args.port, faults).start()
+        print("Local vespa stub server on {} (stats: {}/local/v1/stats)".format(server.url, server.url))
+        await server._server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,31 @@
 # -*- coding: utf-8 -*-
 """
 Search engine evaluation - performance test
-performance test within the local vespa container and save performance report in local dir
+performance test of the vespa search endpoint and save performance report in local dir
 
-v0.1 - version for local prototype; 
+v0.1 - version for local prototype;
        require vespa-fbench in the local docker image.
-       
+v0.2 - in-process load generator (closed/open loop) by default; the vespa-fbench docker run
+       is kept as load_generator = "fbench"
+v0.3 - structured benchmark record (JSON + CSV history) and comparison against a baseline record
+v0.4 - replay of a captured query log with its original timing (workload_model = "replay")
+v0.5 - throughput-vs-latency sweep mode (performance_test_sweep, see load_sweep)
+v0.6 - per query class breakdown (query tags) with the optional vespa timing
+
 @author: Yizhao Ni, PhD, MBA, FAMIA
 @email: yizhao_ni@optum.com
 """
 
 import sys, os, time, re
+from ..http_pool import run_async
+from . import load_generator, benchmark_report, workload_models, load_sweep, query_classes
 
-def main_process(settings):
-    schema_name = settings.schema_name
-    data_type = schema_name
-    container_name = settings.app_name
 
-    queryfile = settings.local_query_dir + "sample_query_"+data_type + ".txt"
-    reportfile = settings.local_query_dir + "vespa_performance_report_"+data_type + ".txt"
+def run_fbench(settings, queryfile, reportfile):
+    """
+    run vespa-fbench in the local vespa container (the benchmark bash template)
+    """
+    container_name = settings.app_name
 
     performance_test_bash_template = settings.performance_test_bash_template
     performance_test_time = str(settings.performance_test_time)
@@ -36,9 +43,74 @@ def main_process(settings):
 
     #run the bash content
     os.system(bash_content)
-    
+
+
+def run_native(settings, queryfile, reportfile, url=None):
+    """
+    run the in-process load generator and write the benchmark summary to the report file
+    Output:
+        summary - (dict) benchmark summary
+    """
+    if settings.workload_model == "replay":
+        schedule, queries = workload_models.load_query_log(settings.query_log_file, settings.replay_speedup)
+        tags = [query_classes.query_tag(query) for query in queries]
+        generator = load_generator.create_load_generator(settings, queries, url, schedule, tags)
+    else:
+        queries = load_generator.load_queries(queryfile)
+        generator = load_generator.create_load_generator(settings, queries, url,
+                                                         tags=query_classes.load_tags(queryfile, queries))
+    print("Perform Vespa benchmark test ({} mode, {} secs)...".format(generator.mode, generator.duration))
+
+    result = run_async(generator.run())
+    summary = load_generator.summarize(result, generator)
+
+    with open(reportfile, 'w', encoding='utf8') as file:
+        file.write(load_generator.format_report(summary) + "\n")
+
+    return summary
+
+
+def main_process(settings):
+    if settings.performance_test_sweep:
+        return load_sweep.main_process(settings)
+
+    schema_name = settings.schema_name
+    data_type = schema_name
+
+    queryfile = settings.local_query_dir + "sample_query_"+data_type + ".txt"
+    reportfile = settings.local_query_dir + "vespa_performance_report_"+data_type + ".txt"
+    recordfile = settings.local_query_dir + "vespa_performance_report_"+data_type + ".json"
+    historyfile = settings.local_query_dir + "vespa_performance_history_"+data_type + ".csv"
+    url = None
+
+    if settings.load_generator == "fbench":
+        run_fbench(settings, queryfile, reportfile)
+    elif settings.load_generator == "native":
+        url = settings.performance_test_url or settings.vespa_url_local
+        summary = run_native(settings, queryfile, reportfile, url)
+    else:
+        raise ValueError("Unknown load generator: {}".format(settings.load_generator))
+
     #print the report
     with open(reportfile, 'r', encoding='utf8') as file:
         report_content = file.read()
-        
-    print(report_content)
\ No newline at end of file
+
+    print(report_content)
+
+    #structured record (the fbench text report is parsed)
+    if settings.load_generator == "fbench":
+        summary = benchmark_report.parse_fbench_report(report_content)
+    record = benchmark_report.build_record(summary, settings, query_file=queryfile, url=url)
+    benchmark_report.save_record(record, recordfile, historyfile)
+    print("Benchmark record saved to {} (history: {}).".format(recordfile, historyfile))
+
+    if settings.performance_baseline:
+        baseline = benchmark_report.load_record(settings.performance_baseline)
+        rows, regressed = benchmark_report.compare(record, baseline, settings.max_p99_regression,
+                                                   settings.max_qps_regression)
+        print(benchmark_report.format_comparison(rows, record, baseline))
+        record['regressed'] = regressed
+        if regressed:
+            print("WARNING: performance regression against the baseline {}.".format(settings.performance_baseline))
+
+    return record
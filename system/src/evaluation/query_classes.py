@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - query classes
+class and rank profile tags of the benchmark queries, so the load results can be broken down per class
+
+classes:
+    bm25 - text only (userQuery)
+    geo - with the geoLocation filter
+    filter - with a sameElement structured filter on a contract map (with or without geo)
+
+the query generation writes the tags to a sidecar file next to the query file (one "class<tab>profile"
+line per query; the query file stays in the vespa-fbench format); query files without tags
+(e.g., a replayed query log) are classified from the yql
+
+v0.1 - query class tags (sidecar tag file and yql classification)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, re
+
+QUERY_CLASSES = ("bm25", "geo", "filter")
+PROFILE_PARAM = re.compile(r"[?&]ranking\.profile=([^&]*)")
+
+
+def query_class(query):
+    """
+    class of a /search/ url line: filter (structured filter), geo (geo filter) or bm25 (text only)
+    """
+    if "sameElement" in query:
+        return "filter"
+    if "geoLocation" in query:
+        return "geo"
+    return "bm25"
+
+
+def query_profile(query):
+    """
+    rank profile of a /search/ url line ("default" if not set)
+    """
+    match = PROFILE_PARAM.search(query)
+    return match.group(1) if match else "default"
+
+
+def query_tag(query):
+    """
+    (class, rank profile) of a /search/ url line
+    """
+    return query_class(query), query_profile(query)
+
+
+def tag_filename(queryfile):
+    """
+    sidecar tag file of a query file (e.g., sample_query_organization.txt -> sample_query_organization.tags)
+    """
+    return os.path.splitext(queryfile)[0] + ".tags"
+
+
+def load_tags(queryfile, queries):
+    """
+    (class, rank profile) tags of the queries of a query file: the sidecar tag file if it matches
+    the queries, otherwise classified from the queries
+    """
+    filename = tag_filename(queryfile)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(queryfile) - 1:
+        with open(filename, 'r', encoding='utf8') as file:
+            tags = [tuple(line.rstrip("\n").split("\t", 1)) for line in file if line.strip()]
+        if len(tags) == len(queries):
+            return tags
+
+    return [query_tag(query) for query in queries]
+
+
+def tag_label(tag):
+    """
+    report label of a tag (e.g., "geo/org_geo_filter")
+    """
+    return "/".join(tag)
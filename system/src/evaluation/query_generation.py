@@ -3,10 +3,17 @@
 Search engine evaluation - performance test
 generate a set of pesudo queries for search engine performance test
 
-v0.1 - version for local prototype; 
+v0.1 - version for local prototype;
        require vespa-fbench in the local docker image.
-       
+
 v0.2 - add contraints including geo search and structured filters
+v0.3 - read only the sampled rows and required columns of the extracted data
+v0.4 - build queries with the shared query builder (see src.search.query_builder)
+v0.5 - vectorized generation with a seeded random generator: the random choices are drawn as arrays,
+       the url-encoded pieces are built once per sampled row and queries are assembled and written
+       in chunks (large query sets for soak tests, e.g., 10M queries)
+v0.6 - workload models (zipf popularity, working set repeats; a replayed query log is copied as the query set)
+v0.7 - class/rank profile tags of the queries in a sidecar tag file (see query_classes)
 
 @author: Yizhao Ni, PhD, MBA, FAMIA
 @email: yizhao_ni@optum.com
@@ -14,56 +21,153 @@ v0.2 - add contraints including geo search and structured filters
 
 
 
-import sys, os, time, re, urllib
+import sys, os, time
+import urllib.parse
 import pandas as pd
 import numpy as np
+from ..ingestion import provider_data_store
+from ..search.query_builder import build_yql, geo_clause, contract_clause, ranking_profile
+from . import workload_models, query_classes
+
+#search term fields by data type (one combination drawn uniformly per query)
+#Note: use city_name for the address field.
+TERM_FIELDS = {'organization': [['org_name'], ['city_name'], ['org_name', 'city_name']],
+               'practitioner': [['first_name'], ['last_name'], ['city_name'], ['first_name', 'last_name'],
+                                ['first_name', 'last_name', 'city_name']]}
+
 
 def search_term_selection(data_type):
     """
-    select data fields to create search terms. 
-    Note: use city_name for the address field. 
-    
+    data field combinations to create search terms
+
     Inputs:
         data_type - organization/practitioner
-        
+
     Outputs:
-        data_fields - data fields to be used
+        choices - list of data field lists (one is drawn per query)
 
     """
-    
-    if data_type.startswith("o"):
-        #0. org_name, 1. address, 2. use both.
-        rand_selection = int(np.random.rand()*3)
-        if rand_selection == 0:
-            return ['org_name']
-        elif rand_selection == 1:
-            return ['city_name']
-        else:
-            return ['org_name', 'city_name']
-    else:
-        #0. first name, 1. last name, 2. address, 3. first/last name, 4. first/last name, address.
-        rand_selection = int(np.random.rand()*5)
-        if rand_selection == 0:
-            return ['first_name']
-        elif rand_selection == 1:
-            return ['last_name']
-        elif rand_selection == 2:
-            return ['city_name']
-        elif rand_selection == 3:
-            return ['first_name', 'last_name']
-        else:
-            return ['first_name', 'last_name', 'city_name']
+    return TERM_FIELDS['organization' if data_type.startswith("o") else 'practitioner']
+
 
+def encode_terms(pool, choices):
+    """
+    url-encoded search terms of the sampled rows for each field combination
+    Output:
+        terms - object array (n rows x n choices)
+    """
+    columns = {field: pool[field].fillna("").astype(str).tolist() for fields in choices for field in fields}
+    terms = np.empty((len(pool), len(choices)), dtype=object)
 
+    for c, fields in enumerate(choices):
+        terms[:, c] = [urllib.parse.quote_plus(" ".join(values).strip()) for values in zip(*[columns[f] for f in fields])]
+    return terms
+
+
+def encode_contract_clauses(pool, filter_fields, min_value):
+    """
+    url-encoded structured filter clause of each sampled row and filter field (the first key of the map)
+    Output:
+        clauses - object array (n rows x n fields)
+        available - bool array (n rows x n fields), False if the map has no (non-empty) key
+    """
+    clauses = np.full((len(pool), len(filter_fields)), "", dtype=object)
+    available = np.zeros((len(pool), len(filter_fields)), dtype=bool)
+
+    for f, field in enumerate(filter_fields):
+        for n, entries in enumerate(pool[field].tolist()):
+            key = next(iter(entries), None) if isinstance(entries, dict) else None
+            if key:
+                clauses[n, f] = urllib.parse.quote_plus(contract_clause(field, key, min_value))
+                available[n, f] = True
+
+    return clauses, available
+
+
+def generate_query_lines(pool, n_queries, schema_name, settings, rng, chunk_size=1000000, workload=None,
+                         working_set=None, with_tags=False):
+    """
+    generate /search/ url lines (the format of query_path(build_query(...))) in chunks
+
+    Input:
+        pool - data frame of sampled rows (search term fields, geocode and the filter fields)
+        n_queries - number of queries (rows are used in order, drawn with replacement beyond the pool)
+        schema_name - schema name in vespa
+        settings - configuration (geo/filter percentages, filter fields, n returned results)
+        rng - np.random.Generator
+        chunk_size - queries assembled per chunk
+        workload - document/term popularity model (e.g., workload_models.ZipfWorkload; None = uniform)
+        working_set - workload_models.WorkingSet for query repeats (None = no repeats)
+        with_tags - also yield the "class<tab>profile" tag of each query
+    Output:
+        yields lists of url lines (or lists of url lines and lists of tags)
+    """
+    quote = urllib.parse.quote_plus
+    choices = search_term_selection(schema_name)
+    terms = encode_terms(pool, choices)
+    clauses, available = encode_contract_clauses(pool, settings.filter_fileds, settings.contract_date_filter)
+    n_available = available.sum(axis=1)
+    lat = np.array([geocode['lat'] for geocode in pool['geocode']], dtype=float)
+    lng = np.array([geocode['lng'] for geocode in pool['geocode']], dtype=float)
+
+    #constant url pieces
+    yql = build_yql(schema_name)
+    yql_start = "/search/?yql=" + quote(yql[:yql.rindex(");")])
+    yql_end = quote(");")
+    geo_start, geo_sep, geo_end = [quote(x) for x in geo_clause("\0", "\0").split("\0")]
+    params = "&hits={}&ranking.profile=".format(settings.n_returned_results)
+    profiles = [ranking_profile(schema_name, False), ranking_profile(schema_name, True)]
+    tail = "&" + urllib.parse.urlencode({'timeout': '15s', 'ranking.softtimeout.enable': 'false'})
+    #tag of (filter, geo): a filter query is tagged filter with or without the geo filter
+    tag_table = np.array(["{}\t{}".format(name, profiles[is_geo]) for name in ("bm25", "filter")
+                          for is_geo in (0, 1)], dtype=object)
+    tag_table[1] = "geo\t" + profiles[1]
+
+    for start in range(0, n_queries, chunk_size):
+        size = min(chunk_size, n_queries - start)
+
+        #random choices of the chunk
+        if workload is not None:
+            rows, term_rows = workload.draw_rows(rng, size, len(pool))
+        elif n_queries <= len(pool):
+            rows = term_rows = np.arange(start, start + size)
+        else:
+            rows = term_rows = rng.integers(0, len(pool), size)
+        term = terms[term_rows, rng.integers(0, len(choices), size)]
+        geo = rng.random(size) < settings.geo_search_perc
+        lat_jitter = (rng.random(size) - 0.5)*settings.geo_random_scale
+        lng_jitter = (rng.random(size) - 0.5)*settings.geo_random_scale
+        use_filter = (rng.random(size) < settings.filter_search_perc) & (n_available[rows] > 0)
+
+        #filter field: uniform among the available fields of the row
+        contract = np.full(size, "", dtype=object)
+        if use_filter.any():
+            filter_rows = rows[use_filter]
+            kth = (rng.random(len(filter_rows))*n_available[filter_rows]).astype(int)
+            field = np.argmax(np.cumsum(available[filter_rows], axis=1) > kth[:, None], axis=1)
+            contract[use_filter] = clauses[filter_rows, field]
+
+        geo_part = np.full(size, "", dtype=object)
+        if geo.any():
+            geo_part[geo] = [geo_start + repr(x) + geo_sep + repr(y) + geo_end for x, y in
+                             zip((lat[rows[geo]] + lat_jitter[geo]).tolist(), (lng[rows[geo]] + lng_jitter[geo]).tolist())]
+
+        lines = [yql_start + g + c + yql_end + "&query=" + t + params + profiles[is_geo] + tail
+                 for g, c, t, is_geo in zip(geo_part.tolist(), contract.tolist(), term.tolist(), geo.tolist())]
+        if not with_tags:
+            yield working_set.mix(lines, rng) if working_set is not None else lines
+            continue
+
+        tags = tag_table[use_filter.astype(int)*2 + geo].tolist()
+        yield working_set.mix(lines, rng, tags) if working_set is not None else (lines, tags)
 
 
-        
 def main_process(settings):
     #configuration
     filedir = settings.local_outdir
     schema_name = settings.schema_name
     data_type = schema_name
-    
+
     if schema_name.startswith("o"):
         filenames = settings.org_outfiles
         file_indices = [x for x in range(len(filenames))]
@@ -71,96 +175,51 @@ def main_process(settings):
         filenames = settings.prov_outfiles
         file_indices = [x for x in range(len(filenames))]
 
-    
+
     outfile = settings.local_query_dir + "sample_query_" + schema_name + ".txt"
 
-    #query configuration
-    geo_search_perc = settings.geo_search_perc
-    filter_search_perc = settings.filter_search_perc
-    filter_fileds = settings.filter_fileds
-    n_filter_fields = len(filter_fileds)
-    contract_date_filter = settings.contract_date_filter
+    if settings.workload_model == "replay":
+        #the captured queries are the query set (the timing is replayed by the load generator)
+        _, queries = workload_models.load_query_log(settings.query_log_file)
+        with open(outfile, 'w', encoding='utf8', buffering=1 << 20) as f:
+            f.write("\n".join(queries) + "\n")
+        with open(query_classes.tag_filename(outfile), 'w', encoding='utf8', buffering=1 << 20) as f:
+            f.write("\n".join("\t".join(query_classes.query_tag(query)) for query in queries) + "\n")
+        print("Copied {} queries of the query log {} to {}.".format(len(queries), settings.query_log_file, outfile))
+        return
 
+    #query configuration
     query_per_set = settings.query_per_set
-    vespa_query_template = {
-        'yql': 'select generated_key from sources {} where(userQuery()xxxxxxyyyyyy);'.format(schema_name),
-        'query': 'temp',
-        'hits': settings.n_returned_results,
-        'ranking.profile': 'temp',
-        'timeout': '15s',
-        'ranking.softtimeout.enable': 'false' 
-      }
+    rng = np.random.default_rng(settings.query_seed)
 
+    #columns read from the extracted data (search terms, geocode and structured filters)
+    query_columns = sorted(set(f for fields in search_term_selection(data_type) for f in fields))
+    query_columns += ['geocode'] + settings.filter_fileds
 
-    with open(outfile, 'w', encoding='utf8') as f:
+    workload = workload_models.create_workload(settings)
+    working_set = workload_models.create_working_set(settings)
+
+    start_time = time.time()
+    n_written = 0
+
+    with open(outfile, 'w', encoding='utf8', buffering=1 << 20) as f, \
+            open(query_classes.tag_filename(outfile), 'w', encoding='utf8', buffering=1 << 20) as tag_file:
         #for each data file
         for findex in file_indices:
             filename = filedir + filenames[findex]
             print("Select data points from file: {}".format(filename))
 
-            data = pd.read_pickle(filename)
-            selected_indices = np.random.permutation(len(data))[:query_per_set]
-            selected_data = data.iloc[selected_indices]
-
-            #for each selected data sample
-            for n in range(query_per_set):
-                query_body = vespa_query_template.copy()
-
-                #create search term
-                search_term = ""
-                selected_fields = search_term_selection(data_type)
-                for selected_field in selected_fields:
-                    search_term += selected_data.iloc[n][selected_field] + " "
-
-                query_body['query'] = search_term.strip()
-
-                #add geo filter if selected
-                if np.random.rand()<geo_search_perc:
-                    lat = selected_data.iloc[n]['geocode']['lat'] + (np.random.rand()-0.5)*settings.geo_random_scale
-                    lng = selected_data.iloc[n]['geocode']['lng'] + (np.random.rand()-0.5)*settings.geo_random_scale
-                    geo_filter = ' and geoLocation(geocode, {}, {}, "25 miles")'.format(lat, lng)
-                    query_body['yql'] = re.sub("xxxxxx", geo_filter, query_body['yql'])
-
-                    #set ranking profile without geo search
-                    if data_type.startswith("o"):
-                        query_body['ranking.profile'] = 'org_geo_filter'
-                    else:
-                        query_body['ranking.profile'] = 'prov_geo_filter'
-
-                else:
-                    #set ranking profile without geo search
-                    if data_type.startswith("o"):
-                        query_body['ranking.profile'] = 'org_bm25'
-                    else:
-                        query_body['ranking.profile'] = 'prov_bm25'
-
-                    query_body['yql'] = re.sub("xxxxxx", "", query_body['yql'])
-
-
-                #add structured filters if selected
-                if np.random.rand()<filter_search_perc:
-                    selected_order = np.random.permutation(n_filter_fields)
-                    structured_filter = None
-
-                    for nn in selected_order:
-                        temp_field = filter_fileds[nn]
-
-                        if len(selected_data.iloc[n][temp_field]) > 0:
-                            temp_key = list(selected_data.iloc[n][temp_field].keys())[0]
-                            if temp_key:
-                                structured_filter = ' and {} contains sameElement(key contains "{}", value>{})'.format(temp_field, temp_key, contract_date_filter)
-                                break
-
-                    if structured_filter:
-                        query_body['yql'] = re.sub("yyyyyy", structured_filter, query_body['yql'])
-                    else:
-                        query_body['yql'] = re.sub("yyyyyy", "", query_body['yql'])
-                else:
-                    query_body['yql'] = re.sub("yyyyyy", "", query_body['yql'])
-
+            #sampled rows (without replacement; queries beyond the pool draw rows with replacement)
+            pool = provider_data_store.sample_data(filename, settings, min(query_per_set, settings.query_pool_size),
+                                                   columns=query_columns, rng=rng).reset_index(drop=True)
 
-                temp_query = "/search/?"+urllib.parse.urlencode(query_body)
+            for lines, tags in generate_query_lines(pool, query_per_set, schema_name, settings, rng,
+                                                    settings.query_chunk_size, workload, working_set, True):
+                f.write("\n".join(lines))
+                f.write("\n")
+                tag_file.write("\n".join(tags))
+                tag_file.write("\n")
+                n_written += len(lines)
 
-                f.write(temp_query+"\n")
-        
-        
+    print("Generated {} queries ({} workload) to {} in {:.1f} secs (seed {}).".format(
+        n_written, settings.workload_model, outfile, time.time() - start_time, settings.query_seed))
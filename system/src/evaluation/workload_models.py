@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Search engine evaluation - workload models
+query mixes of the benchmark query sets, so the benchmarks see realistic cache behavior and tail latency
+
+models:
+    uniform - sampled documents are used in order (drawn uniformly beyond the sample)
+    zipf - Zipf-distributed popularity over the sampled documents (geo/filters) and, optionally
+           with its own exponent, over the search terms
+    replay - a captured production query log replayed with its original inter-arrival timing
+             (see load_query_log and the schedule of load_generator.LoadGenerator)
+
+working set (any generated model): a repeat_ratio fraction of the queries repeat one of the last
+working_set_size distinct queries
+
+v0.1 - uniform/zipf popularity, working set repeats and query log replay
+v0.2 - working set repeats carry the query tags
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import gzip, json
+import numpy as np
+
+
+def zipf_cdf(n_rows, exponent):
+    """
+    cumulative distribution of a Zipf popularity over n_rows ranks (rank r has weight 1/r^exponent)
+    """
+    weights = 1.0/np.arange(1, n_rows + 1, dtype=float)**exponent
+    cdf = np.cumsum(weights)
+    return cdf/cdf[-1]
+
+
+class ZipfWorkload:
+    """
+    Zipf popularity over the sampled rows (the rows are a random sample, so row n has rank n + 1)
+
+    Input:
+        exponent - Zipf exponent of the documents (0 = uniform, ~1 = web search popularity)
+        term_exponent - Zipf exponent of the search terms over an independent ranking of the rows
+                        (None = the terms of the drawn document)
+    """
+
+    def __init__(self, exponent=1.0, term_exponent=None):
+        self.exponent = exponent
+        self.term_exponent = term_exponent
+        self._cdfs = dict()
+        self._term_order = None
+
+    def _draw(self, rng, size, n_rows, exponent):
+        if (n_rows, exponent) not in self._cdfs:
+            self._cdfs[(n_rows, exponent)] = zipf_cdf(n_rows, exponent)
+        return np.searchsorted(self._cdfs[(n_rows, exponent)], rng.random(size), side='right').clip(0, n_rows - 1)
+
+    def draw_rows(self, rng, size, n_rows):
+        """
+        rows of the documents and rows of the search terms of size queries
+        """
+        rows = self._draw(rng, size, n_rows, self.exponent)
+        if self.term_exponent is None:
+            return rows, rows
+
+        if self._term_order is None or len(self._term_order) != n_rows:
+            self._term_order = rng.permutation(n_rows)
+        return rows, self._term_order[self._draw(rng, size, n_rows, self.term_exponent)]
+
+
+class WorkingSet:
+    """
+    query repeats: a repeat_ratio fraction of the queries repeat one of the last size distinct
+    (generated) queries; the state carries over between chunks
+
+    Input:
+        size - working set size (distinct queries a repeat is drawn from)
+        repeat_ratio - fraction of repeated queries (0-1)
+    """
+
+    def __init__(self, size=10000, repeat_ratio=0.5):
+        self.size = max(1, int(size))
+        self.repeat_ratio = repeat_ratio
+        self.history = [] #last distinct queries
+        self.history_tags = [] #their tags (if mixed with tags)
+
+    def mix(self, lines, rng, tags=None):
+        """
+        replace a repeat_ratio fraction of the generated lines with repeats from the working set
+        Output:
+            lines (and tags if given; a repeat has the tag of the repeated query)
+        """
+        repeat = rng.random(len(lines)) < self.repeat_ratio
+        if not self.history and len(lines):
+            repeat[0] = False #the first query can not be a repeat
+
+        fresh = ~repeat
+        candidates = self.history + [lines[n] for n in np.flatnonzero(fresh)]
+
+        #distinct queries available before each repeat; draw from the last self.size of them
+        available = (len(self.history) + np.cumsum(fresh) - fresh)[repeat]
+        lowest = np.maximum(0, available - self.size)
+        picks = lowest + (rng.random(len(available))*(available - lowest)).astype(int)
+
+        mixed = np.array(lines, dtype=object)
+        mixed[repeat] = np.array(candidates, dtype=object)[picks]
+        self.history = candidates[-self.size:]
+        if tags is None:
+            return mixed.tolist()
+
+        tag_candidates = self.history_tags + [tags[n] for n in np.flatnonzero(fresh)]
+        mixed_tags = np.array(tags, dtype=object)
+        mixed_tags[repeat] = np.array(tag_candidates, dtype=object)[picks]
+        self.history_tags = tag_candidates[-self.size:]
+        return mixed.tolist(), mixed_tags.tolist()
+
+
+def load_query_log(filename, speedup=1.0):
+    """
+    load a captured query log (plain or gzip), in time order
+
+    formats (one query per line):
+        vespa access log JSON - {"time": epoch secs, "uri": "/search/?..."} (non-search requests are skipped)
+        text - "<epoch secs><tab>/search/?..."
+
+    Input:
+        speedup - replay speed (2 = twice the original rate)
+    Output:
+        offsets - np array of send times (in sec) relative to the first query
+        queries - list of /search/ url lines
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    times, queries = [], []
+
+    with opener(filename, 'rt', encoding='utf8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith("{"):
+                entry = json.loads(line)
+                timestamp, uri = entry.get('time'), entry.get('uri') or entry.get('url') or ""
+            else:
+                timestamp, _, uri = line.partition("\t")
+
+            if timestamp is None or not uri.startswith("/search/"):
+                continue
+            times.append(float(timestamp))
+            queries.append(uri)
+
+    if not queries:
+        raise ValueError("No /search/ queries in the query log {}".format(filename))
+
+    times = np.array(times)
+    order = np.argsort(times, kind='stable')
+    offsets = (times[order] - times[order[0]])/speedup
+    return offsets, [queries[n] for n in order]
+
+
+def create_workload(settings):
+    """
+    document/term popularity model of the settings (None = uniform)
+    """
+    if settings.workload_model == "zipf":
+        return ZipfWorkload(settings.zipf_exponent, settings.zipf_term_exponent)
+    elif settings.workload_model in ("uniform", "replay"):
+        return None
+    raise ValueError("Unknown workload model: {}".format(settings.workload_model))
+
+
+def create_working_set(settings):
+    """
+    working set repeats of the settings (None = no repeats)
+    """
+    if settings.repeat_ratio:
+        return WorkingSet(settings.working_set_size, settings.repeat_ratio)
+    return None
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+pooled keep-alive HTTP/1.1 client on asyncio streams
+(used by the async feed engine and the search client)
+
+v0.1 - connection pool with keep-alive reuse, content-length and chunked responses
+v0.2 - a timed-out request withdraws its cancellation (Task.uncancel, python 3.11+)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import asyncio, ssl, threading
+import urllib.parse
+from collections import deque
+
+
+class HttpError(Exception):
+    """
+    raised for a broken or malformed HTTP exchange (not for HTTP error status codes)
+    """
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class HttpConnectionPool:
+    """
+    pool of keep-alive HTTP/1.1 connections to one host
+
+    Input:
+        url - base url (e.g., http://localhost:8080)
+        max_connections - max number of open connections (also max concurrent requests)
+        timeout - time out (in sec) per request
+    """
+
+    def __init__(self, url, max_connections=100, timeout=100):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.ssl = ssl.create_default_context() if parsed.scheme == "https" else None
+        self.port = parsed.port or (443 if self.ssl else 80)
+        self.base_path = parsed.path.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._host_header = parsed.netloc.encode('ascii')
+        self._idle = deque()
+        self._semaphore = None #created in the running event loop
+        self.n_connects = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        self.n_connects += 1
+        return _Connection(reader, writer)
+
+    def close(self):
+        """
+        close all idle connections
+        """
+        while self._idle:
+            self._idle.pop().close()
+
+    async def request(self, method, path, body=None, headers=None):
+        """
+        send one request (reuses an idle connection when possible)
+
+        Input:
+            method - HTTP method
+            path - request path (with query string), relative to the base url
+            body - request body (bytes)
+            headers - extra headers (dict)
+        Output:
+            status - HTTP status code
+            body - response body (bytes)
+        Raise:
+            HttpError, OSError or asyncio.TimeoutError for a failed exchange
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+
+        request_bytes = self._build_request(method, path, body, headers)
+
+        async with self._semaphore:
+            #time out by cancelling the current task (cheaper than a wait_for task per request)
+            loop = asyncio.get_running_loop()
+            task = asyncio.current_task()
+            timed_out = []
+
+            def on_timeout():
+                timed_out.append(True)
+                task.cancel()
+
+            handle = loop.call_later(self.timeout, on_timeout)
+
+            try:
+                return await self._exchange(method, path, request_bytes)
+            except asyncio.CancelledError:
+                if timed_out:
+                    #the cancellation was ours: withdraw it, so structured concurrency (asyncio.timeout,
+                    #TaskGroup) around the caller does not see a pending cancel request
+                    if hasattr(task, 'uncancel'):
+                        task.uncancel()
+                    raise asyncio.TimeoutError("{} {}: timed out after {} secs".format(method, path, self.timeout))
+                raise
+            finally:
+                handle.cancel()
+
+    async def _exchange(self, method, path, request_bytes):
+        #retry once on a fresh connection if a reused one was closed by the server
+        for attempt in range(2):
+            reused = bool(self._idle)
+            conn = self._idle.pop() if reused else await self._connect()
+
+            try:
+                conn.writer.write(request_bytes)
+                status, keep_alive, response_body = await self._read_response(conn.reader, method)
+            except (ConnectionError, asyncio.IncompleteReadError, HttpError) as e:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise HttpError("{} {}: {}".format(method, path, e or type(e).__name__)) from e
+            except BaseException:
+                conn.close()
+                raise
+
+            if keep_alive:
+                self._idle.append(conn)
+            else:
+                conn.close()
+
+            return status, response_body
+
+    def _build_request(self, method, path, body, headers):
+        lines = [b"%s %s HTTP/1.1" % (method.encode('ascii'), (self.base_path + path).encode('utf8')),
+                 b"Host: " + self._host_header]
+
+        if headers:
+            for key, value in headers.items():
+                lines.append(("{}: {}".format(key, value)).encode('latin-1'))
+
+        if body is not None:
+            lines.append(b"Content-Length: %d" % len(body))
+
+        return b"\r\n".join(lines) + b"\r\n\r\n" + (body or b"")
+
+    async def _read_response(self, reader, method):
+        status_line = await reader.readline()
+        if not status_line:
+            raise HttpError("connection closed")
+
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise HttpError("malformed status line {!r}".format(status_line[:100]))
+        status = int(parts[1])
+
+        content_length = None
+        chunked = False
+        keep_alive = parts[0] != b"HTTP/1.0"
+
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line:
+                raise HttpError("connection closed in headers")
+
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            value = value.strip()
+
+            if name == b"content-length":
+                content_length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = b"chunked" in value.lower()
+            elif name == b"connection":
+                keep_alive = value.lower() == b"keep-alive" or (keep_alive and value.lower() != b"close")
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return status, keep_alive, b""
+
+        if chunked:
+            body = bytearray()
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    #skip trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+            return status, keep_alive, bytes(body)
+
+        if content_length is not None:
+            return status, keep_alive, await reader.readexactly(content_length)
+
+        #no length: body runs until the connection closes
+        return status, False, await reader.read()
+
+
+def run_async(coro):
+    """
+    run a coroutine to completion from synchronous code;
+    uses a separate thread when an event loop is already running (e.g., in a jupyter notebook)
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def target():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+    if 'error' in result:
+        raise result['error']
+    return result['value']
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - adaptive feed concurrency
+AIMD (additive increase, multiplicative decrease) control of the number of in-flight
+feed operations, driven by observed latency and by 429/503/timeout responses
+
+v0.1 - AIMD controller for the async feed engine
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import time
+
+
+class AimdController:
+    """
+    AIMD concurrency controller
+
+    - additive increase: +increase after a full round (concurrency successful operations)
+      without congestion
+    - multiplicative decrease: concurrency*decrease_factor on a throttle signal (429/503/timeout)
+      or when the smoothed latency exceeds latency_threshold x the lowest observed latency (and latency_min),
+      at most once per round (operations sent before a decrease do not trigger another one)
+
+    Input:
+        initial - initial concurrency
+        floor - min concurrency
+        ceiling - max concurrency
+        increase - additive increase per round
+        decrease_factor - multiplicative decrease factor (0-1)
+        latency_threshold - congestion if smoothed latency > latency_threshold x min latency (None = off)
+        latency_min - latency (in sec) below which there is no congestion
+        log_interval - interval (in sec) for logging the chosen concurrency (0 = off)
+    """
+
+    def __init__(self, initial, floor, ceiling, increase=1, decrease_factor=0.5,
+                 latency_threshold=3.0, latency_min=0.05, log_interval=5):
+        self.floor = max(1, int(floor))
+        self.ceiling = max(self.floor, int(ceiling))
+        self.concurrency = min(max(int(initial), self.floor), self.ceiling)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_threshold = latency_threshold
+        self.latency_min = latency_min
+        self.log_interval = log_interval
+
+        self.n_sent = 0 #sequence number of the next operation
+        self._round_successes = 0
+        self._decrease_mark = 0 #operations sent before this mark do not trigger a decrease
+        self._ewma_latency = None
+        self.min_latency = None
+
+        self.start_time = time.time()
+        self._last_log = self.start_time
+        self.history = [(0.0, self.concurrency)] #(secs since start, concurrency) at each change
+
+    def on_send(self):
+        """
+        register a sent operation
+        Output:
+            sequence number of the operation
+        """
+        self.n_sent += 1
+        return self.n_sent
+
+    def on_success(self, seq, latency):
+        """
+        register a successful operation and its latency (in sec)
+        """
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        self._ewma_latency = latency if self._ewma_latency is None else 0.9*self._ewma_latency + 0.1*latency
+
+        if (self.latency_threshold and self._ewma_latency > max(self.latency_threshold*self.min_latency, self.latency_min)
+                and self.n_sent > self.concurrency):
+            self.on_throttle(seq, "latency {:.1f} ms".format(1000*self._ewma_latency))
+            return
+
+        self._round_successes += 1
+        if self._round_successes >= self.concurrency:
+            self._round_successes = 0
+            self._set(self.concurrency + self.increase)
+
+    def on_throttle(self, seq, reason=""):
+        """
+        register a throttle signal (429/503/timeout or high latency) of the operation seq
+        """
+        if seq <= self._decrease_mark:
+            return #already decreased for this round
+
+        self._decrease_mark = self.n_sent
+        self._round_successes = 0
+        self._set(int(self.concurrency*self.decrease_factor), reason)
+
+    def _set(self, concurrency, reason=""):
+        concurrency = min(max(concurrency, self.floor), self.ceiling)
+        if concurrency == self.concurrency:
+            return
+
+        self.concurrency = concurrency
+        now = time.time()
+        self.history.append((now - self.start_time, concurrency))
+
+        if reason:
+            print("Decrease feed concurrency to {} ({}).".format(concurrency, reason))
+
+        if self.log_interval and now - self._last_log >= self.log_interval:
+            self._last_log = now
+            latency = 1000*self._ewma_latency if self._ewma_latency else 0
+            print("Feed concurrency: {} (smoothed latency {:.1f} ms, {:.0f} secs).".format(
+                concurrency, latency, now - self.start_time))
+
+    def summary(self):
+        """
+        concurrency summary (min/max/final and time-weighted average)
+        """
+        end_time = time.time() - self.start_time
+        weighted = 0.0
+        for (t0, c), (t1, _) in zip(self.history, self.history[1:] + [(end_time, None)]):
+            weighted += c*(t1 - t0)
+
+        values = [c for _, c in self.history]
+        return {'min': min(values), 'max': max(values), 'final': self.concurrency,
+                'average': weighted/end_time if end_time > 0 else self.concurrency}
+
+
+def create_controller(settings):
+    """
+    AIMD controller from the feed settings (None if adaptive concurrency is off)
+    """
+    if not settings.adaptive_concurrency:
+        return None
+
+    return AimdController(settings.initial_in_flight, settings.min_in_flight, settings.max_in_flight,
+                          settings.aimd_increase, settings.aimd_decrease_factor,
+                          settings.aimd_latency_threshold, settings.aimd_latency_min, settings.concurrency_log_interval)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - data frame to feed documents
+lazy conversion of an extracted data frame to vespa documents: rows are built from
+column arrays one chunk at a time and NaN is replaced per field during conversion
+(no full copy of the frame, feeding can start with the first document)
+
+v0.1 - streaming conversion for all feed paths
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import math
+
+
+def _nan_columns(data):
+    """
+    columns with at least one NaN value
+    """
+    return {column for column in data.columns if data[column].isna().any()}
+
+
+def iter_vespa_rows(data, fill_value=999999, chunk_size=10000):
+    """
+    yield the fields (dict) of each row of a data frame
+
+    Input:
+        data - data frame with all required fields
+        fill_value - value for NaN fields (vespa can not process NaN)
+        chunk_size - number of rows converted to python values at a time
+    """
+    columns = list(data.columns)
+    nan_columns = _nan_columns(data)
+    arrays = [data[column].to_numpy() for column in columns] #views of the column data (no copy for numeric columns)
+    nan_indices = [n for n, column in enumerate(columns) if column in nan_columns]
+
+    for start in range(0, len(data), chunk_size):
+        values = [array[start:start+chunk_size].tolist() for array in arrays]
+
+        for row in zip(*values):
+            fields = dict(zip(columns, row))
+
+            #replace NaN only in the columns that have one
+            for n in nan_indices:
+                value = row[n]
+                if value is None or (isinstance(value, float) and math.isnan(value)):
+                    fields[columns[n]] = fill_value
+
+            yield fields
+
+
+def iter_vespa_documents(data, id_field, fill_value=999999, chunk_size=10000):
+    """
+    yield documents in vespa dictionary format ({'id', 'fields'})
+
+    Input:
+        data - data frame with all required fields
+        id_field - the id field
+        fill_value - value for NaN fields
+        chunk_size - number of rows converted to python values at a time
+    """
+    for fields in iter_vespa_rows(data, fill_value, chunk_size):
+        yield {'id': fields[id_field], 'fields': fields}
+
+
+def iter_batches(items, batch_size):
+    """
+    group an iterable into lists of batch_size items
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
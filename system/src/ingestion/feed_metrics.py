@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - feed metrics
+per-operation latency histograms, docs/sec and bytes/sec over time, in-flight operations and
+retries/errors by HTTP status; exported as a Prometheus text endpoint and/or a periodic JSON
+snapshot file, with a summary per file and per run
+
+v0.1 - feed metrics for the point-wise and asyncio feeds
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, json, time, threading
+from bisect import bisect_left
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) #upper bounds (in sec)
+
+
+def status_label(status):
+    """
+    label of an HTTP status (a failed request/timeout has status None)
+    """
+    return "error" if status is None else str(status)
+
+
+class LatencyHistogram:
+    """
+    fixed-bucket latency histogram (Prometheus buckets; the last bucket is +Inf)
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def histogram_quantile(q, counts, buckets=LATENCY_BUCKETS):
+    """
+    quantile estimate of bucket counts (linear interpolation within the bucket, as Prometheus)
+    """
+    total = sum(counts)
+    if total == 0:
+        return None
+
+    rank = q*total
+    cumulative = 0
+    for n, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            if n == len(buckets):
+                return buckets[-1] #+Inf bucket
+            lower = buckets[n - 1] if n > 0 else 0.0
+            return lower + (buckets[n] - lower)*(rank - cumulative)/count
+        cumulative += count
+
+    return buckets[-1]
+
+
+class FeedMetrics:
+    """
+    feed metrics of a run (counters are cumulative; a file summary is the difference of two snapshots)
+
+    Input:
+        max_samples - number of samples (docs/sec, bytes/sec, in-flight over time) kept
+    """
+
+    def __init__(self, max_samples=3600):
+        self._lock = threading.Lock() #the reporter thread reads while the feed updates
+        self.start_time = time.time()
+
+        self.latency = dict() #op -> LatencyHistogram (per attempt)
+        self.responses = Counter() #(op, status) -> count (per attempt)
+        self.retries = Counter() #status -> count
+        self.errors = Counter() #status -> count of operations that failed after all retries
+        self.documents = Counter() #op -> count of successful operations
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.in_flight = 0
+        self.concurrency = 0
+
+        self.samples = deque(maxlen=max_samples) #(secs since start, docs/sec, bytes/sec, in flight, concurrency)
+        self._last_sample = (self.start_time, 0, 0)
+
+    def observe(self, op, status, latency, bytes_sent=0, bytes_received=0):
+        """
+        record one request (attempt) of an operation
+        """
+        with self._lock:
+            histogram = self.latency.get(op)
+            if histogram is None:
+                histogram = self.latency[op] = LatencyHistogram()
+            histogram.observe(latency)
+            self.responses[(op, status_label(status))] += 1
+            self.bytes_sent += bytes_sent
+            self.bytes_received += bytes_received
+
+    def on_retry(self, status):
+        with self._lock:
+            self.retries[status_label(status)] += 1
+
+    def on_done(self, op, status):
+        """
+        record the final result of an operation
+        """
+        with self._lock:
+            if status == 200:
+                self.documents[op] += 1
+            else:
+                self.errors[status_label(status)] += 1
+
+    def set_gauges(self, in_flight, concurrency):
+        self.in_flight = in_flight
+        self.concurrency = concurrency
+
+    def sample(self):
+        """
+        add a sample of docs/sec and bytes/sec since the previous sample
+        """
+        with self._lock:
+            now = time.time()
+            n_docs = sum(self.documents.values())
+            last_time, last_docs, last_bytes = self._last_sample
+            elapsed = max(now - last_time, 1e-9)
+            self.samples.append((round(now - self.start_time, 3), (n_docs - last_docs)/elapsed,
+                                 (self.bytes_sent - last_bytes)/elapsed, self.in_flight, self.concurrency))
+            self._last_sample = (now, n_docs, self.bytes_sent)
+
+    def snapshot(self):
+        """
+        copy of the metrics (json-serializable dict)
+        """
+        with self._lock:
+            return {'time': time.time(), 'elapsed_secs': time.time() - self.start_time,
+                    'latency': {op: {'counts': list(h.counts), 'sum': h.sum, 'count': h.count} for op, h in self.latency.items()},
+                    'responses': {"{}|{}".format(op, status): count for (op, status), count in self.responses.items()},
+                    'retries': dict(self.retries), 'errors': dict(self.errors), 'documents': dict(self.documents),
+                    'bytes_sent': self.bytes_sent, 'bytes_received': self.bytes_received,
+                    'in_flight': self.in_flight, 'concurrency': self.concurrency,
+                    'samples': [list(x) for x in self.samples]}
+
+    def to_prometheus(self):
+        """
+        metrics in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = ["# TYPE vespa_feed_latency_seconds histogram"]
+
+        for op, histogram in sorted(snapshot['latency'].items()):
+            cumulative = 0
+            for bound, count in zip(list(LATENCY_BUCKETS) + ["+Inf"], histogram['counts']):
+                cumulative += count
+                lines.append('vespa_feed_latency_seconds_bucket{{op="{}",le="{}"}} {}'.format(op, bound, cumulative))
+            lines.append('vespa_feed_latency_seconds_sum{{op="{}"}} {}'.format(op, histogram['sum']))
+            lines.append('vespa_feed_latency_seconds_count{{op="{}"}} {}'.format(op, histogram['count']))
+
+        lines.append("# TYPE vespa_feed_responses_total counter")
+        for key, count in sorted(snapshot['responses'].items()):
+            op, status = key.split("|")
+            lines.append('vespa_feed_responses_total{{op="{}",status="{}"}} {}'.format(op, status, count))
+
+        lines.append("# TYPE vespa_feed_documents_total counter")
+        for op, count in sorted(snapshot['documents'].items()):
+            lines.append('vespa_feed_documents_total{{op="{}"}} {}'.format(op, count))
+
+        for name in ['retries', 'errors']:
+            lines.append("# TYPE vespa_feed_{}_total counter".format(name))
+            for status, count in sorted(snapshot[name].items()):
+                lines.append('vespa_feed_{}_total{{status="{}"}} {}'.format(name, status, count))
+
+        lines.append("# TYPE vespa_feed_bytes_sent_total counter")
+        lines.append("vespa_feed_bytes_sent_total {}".format(snapshot['bytes_sent']))
+        lines.append("# TYPE vespa_feed_bytes_received_total counter")
+        lines.append("vespa_feed_bytes_received_total {}".format(snapshot['bytes_received']))
+        lines.append("# TYPE vespa_feed_in_flight gauge")
+        lines.append("vespa_feed_in_flight {}".format(snapshot['in_flight']))
+        lines.append("# TYPE vespa_feed_concurrency gauge")
+        lines.append("vespa_feed_concurrency {}".format(snapshot['concurrency']))
+
+        if snapshot['samples']:
+            _, docs_per_sec, bytes_per_sec, _, _ = snapshot['samples'][-1]
+            lines.append("# TYPE vespa_feed_documents_per_second gauge")
+            lines.append("vespa_feed_documents_per_second {}".format(docs_per_sec))
+            lines.append("# TYPE vespa_feed_bytes_per_second gauge")
+            lines.append("vespa_feed_bytes_per_second {}".format(bytes_per_sec))
+
+        return "\n".join(lines) + "\n"
+
+
+def _diff_counts(end, start):
+    return {key: count - start.get(key, 0) for key, count in end.items() if count - start.get(key, 0)}
+
+
+def summarize(end, start=None):
+    """
+    summary of the metrics between two snapshots (start = None: since the start of the run)
+
+    Output:
+        summary - (dict) secs, documents, docs_per_sec, mb_sent, mb_per_sec, latency (op -> p50/p90/p99 in ms),
+                  retries and errors by status
+    """
+    start = start or {'elapsed_secs': 0, 'latency': {}, 'responses': {}, 'retries': {}, 'errors': {},
+                      'documents': {}, 'bytes_sent': 0}
+
+    secs = max(end['elapsed_secs'] - start['elapsed_secs'], 1e-9)
+    n_docs = sum(end['documents'].values()) - sum(start['documents'].values())
+    n_bytes = end['bytes_sent'] - start['bytes_sent']
+
+    latency = dict()
+    for op, histogram in end['latency'].items():
+        start_counts = start['latency'].get(op, {}).get('counts', [0]*len(histogram['counts']))
+        counts = [x - y for x, y in zip(histogram['counts'], start_counts)]
+        if sum(counts):
+            latency[op] = {"p{}".format(int(100*q)): 1000*histogram_quantile(q, counts) for q in (0.5, 0.9, 0.99)}
+
+    return {'secs': secs, 'documents': n_docs, 'docs_per_sec': n_docs/secs,
+            'mb_sent': n_bytes/1e6, 'mb_per_sec': n_bytes/1e6/secs, 'latency': latency,
+            'retries': _diff_counts(end['retries'], start['retries']),
+            'errors': _diff_counts(end['errors'], start['errors'])}
+
+
+def print_summary(title, summary):
+    """
+    display a metrics summary
+    """
+    print("{}: {} documents in {:.1f} secs ({:.0f} docs/sec, {:.1f} MB sent, {:.2f} MB/sec).".format(
+        title, summary['documents'], summary['secs'], summary['docs_per_sec'], summary['mb_sent'], summary['mb_per_sec']))
+
+    for op, quantiles in sorted(summary['latency'].items()):
+        print("  {} latency: p50 {p50:.1f} ms, p90 {p90:.1f} ms, p99 {p99:.1f} ms.".format(op, **quantiles))
+    if summary['retries']:
+        print("  retries by status: {}".format(summary['retries']))
+    if summary['errors']:
+        print("  errors by status: {}".format(summary['errors']))
+
+
+class MetricsReporter:
+    """
+    background reporter: samples the metrics every interval secs, writes a JSON snapshot file
+    and serves the Prometheus text format on http://host:port/metrics
+
+    Input:
+        metrics - FeedMetrics
+        interval - secs between samples/snapshots
+        snapshot_file - JSON snapshot file (None = off)
+        port - Prometheus endpoint port (None = off)
+        host - Prometheus endpoint bind address
+    """
+
+    def __init__(self, metrics, interval=5, snapshot_file=None, port=None, host="127.0.0.1"):
+        self.metrics = metrics
+        self.interval = interval
+        self.snapshot_file = snapshot_file
+        self.port = port
+        self.host = host
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def write_snapshot(self):
+        if not self.snapshot_file:
+            return
+
+        tempfilename = self.snapshot_file + ".tmp"
+        with open(tempfilename, 'w', encoding='utf8') as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(tempfilename, self.snapshot_file)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.sample()
+            self.write_snapshot()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        if self.port is not None:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+                    body = metrics.to_prometheus().encode('utf8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.port = self._server.server_address[1]
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            print("Feed metrics at http://{}:{}/metrics".format(self.host, self.port))
+
+        return self
+
+    def stop(self):
+        """
+        stop the reporter (a final sample and snapshot are written)
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+        self.metrics.sample()
+        self.write_snapshot()
+
+
+def create_reporter(metrics, settings):
+    """
+    metrics reporter from the feed settings (started)
+    """
+    return MetricsReporter(metrics, settings.feed_metrics_interval, settings.feed_metrics_file,
+                           settings.feed_metrics_port).start()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - partial update feed
+diff changed documents against the previous extraction snapshot and send vespa partial
+updates instead of full puts (unchanged text fields are not re-indexed):
+    scalar fields - {"assign": value} for changed values
+    map fields - per entry: "field{key}": {"assign": value} for added/changed entries,
+                 "field{key}": {"remove": 0} for removed entries
+
+v0.1 - partial updates of contract maps and scalar fields
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import pandas as pd
+from .provider_data_extraction import contract_section_specs
+from .feed_conversion import iter_vespa_rows
+
+#map<string,int> fields updated entry by entry
+map_fields = frozenset(spec['output_field'] for spec in contract_section_specs.values())
+
+
+def map_entry_path(field, key):
+    """
+    field path of a map entry (e.g., csp_contract{key})
+    """
+    return "{}{{{}}}".format(field, key)
+
+
+def diff_fields(old_fields, new_fields, id_field, map_fields=map_fields):
+    """
+    partial update of a document
+
+    Input:
+        old_fields - document fields of the previous snapshot (dict)
+        new_fields - document fields of the current extraction (dict)
+        id_field - the id field (never updated)
+        map_fields - fields updated entry by entry
+    Output:
+        update - (dict) field (path) -> update operation (empty if nothing changed)
+    """
+    update = dict()
+
+    for field, value in new_fields.items():
+        if field == id_field:
+            continue
+
+        old_value = old_fields.get(field)
+
+        if field in map_fields:
+            old_map = old_value or dict()
+            new_map = value or dict()
+
+            for key, entry in new_map.items():
+                if old_map.get(key) != entry:
+                    update[map_entry_path(field, key)] = {'assign': entry}
+            for key in old_map:
+                if key not in new_map:
+                    update[map_entry_path(field, key)] = {'remove': 0}
+
+        elif old_value != value:
+            update[field] = {'assign': value}
+
+    return update
+
+
+def iter_update_operations(data, previous, id_field, fill_value=999999, chunk_size=10000):
+    """
+    yield partial updates of changed documents (a put if the document is not in the previous snapshot)
+
+    Input:
+        data - data frame of the changed documents
+        previous - data frame of the previous snapshot (None = no snapshot, all documents are put)
+        id_field - the id field
+        fill_value - value for NaN fields (applied to both snapshots before the comparison)
+        chunk_size - number of rows compared at a time
+    """
+    if previous is None:
+        previous = data.iloc[:0]
+
+    previous = previous[previous[id_field].isin(data[id_field])]
+    previous_index = pd.Index(previous[id_field])
+
+    for start in range(0, len(data), chunk_size):
+        chunk = data.iloc[start:start+chunk_size]
+        positions = previous_index.get_indexer(chunk[id_field])
+        old_rows = iter_vespa_rows(previous.iloc[positions[positions >= 0]], fill_value, chunk_size)
+
+        for fields, position in zip(iter_vespa_rows(chunk, fill_value, chunk_size), positions):
+            if position < 0:
+                yield {'op': 'put', 'id': fields[id_field], 'fields': fields}
+                continue
+
+            update = diff_fields(next(old_rows), fields, id_field)
+            if update:
+                yield {'op': 'update', 'id': fields[id_field], 'fields': update}
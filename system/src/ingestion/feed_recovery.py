@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - feed recovery
+retries with jittered exponential backoff, a dead-letter file of permanently failed
+documents and per-file checkpoints, so a restarted feed resumes where it stopped
+
+files next to each data file (e.g., organization_sample_data.pkl):
+    organization_sample_data_feed_checkpoint.json - number of leading operations done
+    organization_sample_data_dead_letter.jsonl - failed operations with their error bodies
+
+v0.1 - retry policy, dead-letter writer and feed checkpoints
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, json, time, random
+
+RETRY_STATUSES = (429, 500, 502, 503, 504) #transient errors (a failed request/timeout has status None)
+
+
+def is_retryable(status):
+    """
+    whether an operation with this response status should be retried
+    """
+    return status is None or status in RETRY_STATUSES
+
+
+def backoff_delay(attempt, base, cap):
+    """
+    jittered exponential backoff (full jitter) before retry number attempt (1, 2, ...)
+
+    Input:
+        base - backoff (in sec) of the first retry
+        cap - max backoff (in sec)
+    """
+    return random.uniform(0, min(cap, base*(2**(attempt - 1))))
+
+
+def checkpoint_filename(filename):
+    """
+    checkpoint file name of a data file (e.g., x.pkl -> x_feed_checkpoint.json)
+    """
+    return os.path.splitext(filename)[0] + "_feed_checkpoint.json"
+
+
+def dead_letter_filename(filename):
+    """
+    dead-letter file name of a data file (e.g., x.pkl -> x_dead_letter.jsonl)
+    """
+    return os.path.splitext(filename)[0] + "_dead_letter.jsonl"
+
+
+def file_signature(filename):
+    """
+    signature of an input file (a checkpoint is only valid for the same input)
+    """
+    stat = os.stat(filename)
+    return "{}:{}".format(stat.st_size, stat.st_mtime_ns)
+
+
+class DeadLetterWriter:
+    """
+    append permanently failed operations to a JSONL file (opened on the first failure)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        self._file = None
+
+    def write(self, operation, status, error, attempts):
+        if self._file is None:
+            self._file = open(self.filename, 'a', encoding='utf8')
+
+        if isinstance(error, bytes):
+            error = error.decode('utf8', errors='replace')
+
+        self._file.write(json.dumps({'id': operation['id'], 'op': operation.get('op', 'put'), 'status': status,
+                                     'error': error, 'attempts': attempts, 'time': time.time(),
+                                     'operation': operation}, default=str) + "\n")
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print("Dead-letter documents: {} (see {}).".format(self.count, self.filename))
+
+
+class FeedCheckpoint:
+    """
+    checkpoint of a feed: position = number of leading operations that are done
+    (accepted or dead-lettered); operations complete out of order, so the position is
+    the low watermark of the completed operations
+
+    Input:
+        filename - checkpoint file name
+        signature - signature of the input (a checkpoint of another input is ignored)
+        interval - save the checkpoint every interval completed operations
+        resume - start from the saved checkpoint (False: start from the beginning)
+    """
+
+    def __init__(self, filename, signature, interval=10000, resume=True):
+        self.filename = filename
+        self.signature = signature
+        self.interval = interval
+        self.start_position = 0
+        self.complete = False
+        self.failed = 0 #failed (dead-lettered) operations of the input
+
+        if resume and os.path.exists(filename):
+            with open(filename, 'r', encoding='utf8') as f:
+                saved = json.load(f)
+            if saved.get('signature') == signature:
+                self.start_position = saved['position']
+                self.complete = saved.get('complete', False)
+                self.failed = saved.get('failed', 0)
+
+        self.position = self.start_position
+        self._done = set() #completed operations above the position
+        self._since_save = 0
+
+    def mark_done(self, index, failed=False):
+        """
+        mark the operation index (counted from the start of the input) as done
+        (failed = dead-lettered; an operation above the saved position is counted again on resume)
+        """
+        self.failed += failed
+        if index == self.position:
+            self.position += 1
+            while self.position in self._done:
+                self._done.remove(self.position)
+                self.position += 1
+        else:
+            self._done.add(index)
+
+        self._since_save += 1
+        if self._since_save >= self.interval:
+            self.save()
+
+    def save(self, complete=False):
+        """
+        save the checkpoint (write + rename, so a crash keeps the previous checkpoint)
+        """
+        self._since_save = 0
+        self.complete = complete
+        tempfilename = self.filename + ".tmp"
+        with open(tempfilename, 'w', encoding='utf8') as f:
+            json.dump({'signature': self.signature, 'position': self.position,
+                       'complete': complete, 'failed': self.failed, 'time': time.time()}, f)
+        os.replace(tempfilename, self.filename)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - typed field parsers
+parse numeric fields of the raw provider data without eval(), one record at a time
+
+v0.1 - int, float and zero-padded zip code parsers for the address section
+v0.2 - remove the unused vectorized column parsers (per-record parsing is as fast on the address fields)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import math
+
+
+class FieldParseError(ValueError):
+    """
+    raised when one or more fields of a record can not be parsed
+
+    errors - list of (field, value, message)
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join("{}={!r}: {}".format(*x) for x in errors))
+
+
+def parse_int(value):
+    """
+    parse an integer field (e.g., '12345')
+    """
+    return int(value.strip())
+
+
+def parse_float(value):
+    """
+    parse a finite float field (e.g., '42.3601')
+    """
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError("not a finite number")
+    return number
+
+
+def parse_zipcode(value):
+    """
+    parse a zip code into a 5-digit string
+    Note: the current data trim the prefix 0 (e.g., '6320' -> '06320')
+    """
+    zip_code = int(value.strip())
+    if not 0 <= zip_code <= 99999:
+        raise ValueError("zip code out of range")
+    return "{:05d}".format(zip_code)
+
+
+def parse_fields(record, field_parsers):
+    """
+    parse the typed fields of a single record
+    Input:
+        record - raw record (dict)
+        field_parsers - (dict) field -> parser
+    Output:
+        parsed - (dict) field -> parsed value
+    Raise:
+        FieldParseError listing every field that can not be parsed
+    """
+    parsed = dict()
+    errors = []
+
+    for field, parser in field_parsers.items():
+        value = record.get(field)
+        try:
+            parsed[field] = parser(value)
+        except (ValueError, TypeError, AttributeError, OverflowError) as e:
+            errors.append((field, value, str(e) or type(e).__name__))
+
+    if errors:
+        raise FieldParseError(errors)
+
+    return parsed
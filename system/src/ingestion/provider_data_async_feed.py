@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - async feed engine
+feed documents to /document/v1 directly through a pooled keep-alive HTTP client,
+with a bounded number of in-flight operations and a streaming input iterator
+
+operation format (dict):
+    {'op': 'put', 'id': doc id, 'fields': {...}}
+    {'op': 'update', 'id': doc id, 'fields': {field: {"assign": value}, ...}}
+    {'op': 'remove', 'id': doc id}
+
+v0.1 - asyncio feed engine (data_feed_flag 4)
+v0.2 - adaptive concurrency (AIMD) from latency and 429/503/timeout responses
+v0.3 - lazy row conversion with per-field NaN handling (see feed_conversion)
+v0.4 - retries with jittered exponential backoff, dead-letter file and checkpoints (see feed_recovery)
+v0.5 - feed metrics: latency histograms, docs/bytes per sec, retries/errors by status (see feed_metrics)
+v0.6 - async iterables of operations (e.g., operations produced while visiting)
+v0.7 - optional callback with the final status of each operation
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import asyncio, json, time
+import urllib.parse
+import numpy as np
+from ..http_pool import HttpConnectionPool, HttpError, run_async
+from .feed_concurrency import create_controller
+from .feed_conversion import iter_vespa_rows
+from .feed_recovery import is_retryable, backoff_delay
+from .feed_metrics import FeedMetrics, summarize, print_summary
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+THROTTLE_STATUSES = (429, 503, 504) #overload responses (a failed request/timeout has status None)
+
+
+def json_default(value):
+    """
+    json conversion of numpy values
+    """
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+def document_path(namespace, schema_name, data_id):
+    """
+    /document/v1 path of a document
+    """
+    return "/document/v1/{}/{}/docid/{}".format(namespace, schema_name, urllib.parse.quote(str(data_id), safe=''))
+
+
+def encode_operation(operation, namespace, schema_name):
+    """
+    convert a feed operation to an HTTP request
+
+    Input:
+        operation - feed operation (dict)
+    Output:
+        method - HTTP method
+        path - request path
+        body - request body (bytes or None)
+    """
+    op = operation.get('op', 'put')
+    path = document_path(namespace, schema_name, operation['id'])
+
+    if op == 'put':
+        return "POST", path, json.dumps({'fields': operation['fields']}, separators=(',', ':'), default=json_default).encode('utf8')
+    elif op == 'update':
+        return "PUT", path, json.dumps({'fields': operation['fields']}, separators=(',', ':'), default=json_default).encode('utf8')
+    elif op == 'remove':
+        return "DELETE", path, None
+    else:
+        raise ValueError("Unknown feed operation: {}".format(op))
+
+
+def iter_put_operations(data, id_field, fill_value=999999, chunk_size=10000):
+    """
+    yield put operations from a data frame (one row at a time)
+
+    Input:
+        data - data frame with all required fields
+        id_field - the id field
+        fill_value - value for NaN fields
+        chunk_size - number of rows converted to python values at a time
+    """
+    for fields in iter_vespa_rows(data, fill_value, chunk_size):
+        yield {'op': 'put', 'id': fields[id_field], 'fields': fields}
+
+
+def iter_remove_operations(data_ids):
+    """
+    yield remove operations for document ids
+    """
+    for data_id in data_ids:
+        yield {'op': 'remove', 'id': data_id}
+
+
+async def _iter_async(operations):
+    """
+    async iterator over an iterable or async iterable of operations
+    """
+    if hasattr(operations, '__aiter__'):
+        async for operation in operations:
+            yield operation
+    else:
+        for operation in operations:
+            yield operation
+
+
+class AsyncFeeder:
+    """
+    asyncio feeder for /document/v1
+
+    Input:
+        schema_name - schema name in vespa
+        settings - configuration (vespa_url_local, max_in_flight, timeout, feed_namespace, num_dispay,
+                   adaptive_concurrency and the AIMD settings, max_retries and the backoff settings)
+        url - vespa url (default: settings.vespa_url_local)
+        checkpoint - FeedCheckpoint marked with each completed operation (optional)
+        dead_letter - DeadLetterWriter for operations that failed after all retries (optional)
+        metrics - FeedMetrics shared by the files of a run (default: metrics of this feeder only)
+        on_done - callback(operation, status) with the final status of each operation (optional)
+    """
+
+    def __init__(self, schema_name, settings, url=None, checkpoint=None, dead_letter=None, metrics=None, on_done=None):
+        self.schema_name = schema_name
+        self.namespace = settings.feed_namespace or schema_name
+        self.url = url or settings.vespa_url_local
+        self.controller = create_controller(settings) #None for a fixed concurrency
+        self.max_in_flight = settings.max_in_flight
+        self.max_connections = settings.max_in_flight
+        self.timeout = settings.timeout
+        self.num_dispay = settings.num_dispay
+        self.debug = settings.data_feed_debug
+        self.max_retries = settings.max_retries
+        self.backoff_base = settings.retry_backoff_base
+        self.backoff_max = settings.retry_backoff_max
+        self.checkpoint = checkpoint
+        self.dead_letter = dead_letter
+        self.metrics = metrics or FeedMetrics()
+        self.on_done = on_done
+
+        self.n_ok = 0
+        self.n_failed = 0
+        self.n_retries = 0
+        self.in_flight = 0
+
+    async def _send(self, pool, method, path, body):
+        """
+        send one encoded operation
+        Output:
+            status - HTTP status (None if the request failed)
+            body - response body (or error message)
+        """
+        try:
+            return await pool.request(method, path, body, JSON_HEADERS)
+        except (HttpError, OSError, asyncio.TimeoutError) as e:
+            return None, str(e) or type(e).__name__
+
+    @property
+    def concurrency(self):
+        """
+        current max number of in-flight operations
+        """
+        return self.controller.concurrency if self.controller else self.max_in_flight
+
+    async def _send_with_retries(self, pool, operation):
+        """
+        send one operation, retrying transient failures with jittered exponential backoff
+        (the operation keeps its in-flight slot while it waits)
+        Output:
+            status, body, attempts
+        """
+        controller = self.controller
+        metrics = self.metrics
+        op = operation.get('op', 'put')
+        method, path, request_body = encode_operation(operation, self.namespace, self.schema_name)
+        attempt = 0
+
+        while True:
+            seq = controller.on_send() if controller else 0
+            start_time = time.perf_counter()
+
+            status, body = await self._send(pool, method, path, request_body)
+
+            latency = time.perf_counter() - start_time
+            metrics.observe(op, status, latency, len(request_body or b""), len(body) if status else 0)
+
+            if controller:
+                if status == 200:
+                    controller.on_success(seq, latency)
+                elif status is None or status in THROTTLE_STATUSES:
+                    controller.on_throttle(seq, "status {}".format(status or "timeout/error"))
+
+            if status == 200 or not is_retryable(status) or attempt >= self.max_retries:
+                break
+
+            attempt += 1
+            self.n_retries += 1
+            metrics.on_retry(status)
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_max))
+
+        return status, body, attempt + 1
+
+    async def _process(self, pool, index, operation):
+        """
+        send one operation; every operation ends accepted or failed (dead-lettered), also when it
+        can not be encoded, so the checkpoint never passes a lost operation
+
+        Input:
+            index - position of the operation in the input (for the checkpoint)
+        """
+        op = operation.get('op', 'put')
+        try:
+            status, body, attempts = await self._send_with_retries(pool, operation)
+        except Exception as e:
+            status, body, attempts = None, "{}: {}".format(type(e).__name__, e), 1
+
+        self.metrics.on_done(op, status)
+
+        if status == 200:
+            self.n_ok += 1
+            if self.debug:
+                print("Feed doc: {}".format(body))
+            if self.n_ok % self.num_dispay == 0:
+                print("Have processed {} records.".format(self.n_ok))
+        else:
+            self.n_failed += 1
+            if self.dead_letter:
+                self.dead_letter.write(operation, status, body, attempts)
+            print("Error: {} {} for document {} after {} attempts. Skip this example.".format(
+                status, body, operation['id'], attempts))
+
+        if self.on_done:
+            self.on_done(operation, status)
+        if self.checkpoint:
+            self.checkpoint.mark_done(index, status != 200)
+
+    async def feed(self, operations):
+        """
+        feed operations with at most self.concurrency operations in flight
+
+        Input:
+            operations - iterable or async iterable of feed operations (consumed lazily); with a checkpoint,
+                         the operations before checkpoint.start_position are skipped
+        Output:
+            (n_ok, n_failed)
+        """
+        loop = asyncio.get_running_loop()
+        slot_freed = asyncio.Event()
+        tasks = set()
+        errors = [] #exceptions of the operation tasks (raised after the in-flight operations finish)
+
+        def on_done(task):
+            if not task.cancelled() and task.exception() is not None:
+                errors.append(task.exception())
+            tasks.discard(task)
+            self.in_flight -= 1
+            slot_freed.set()
+            self.metrics.set_gauges(self.in_flight, self.concurrency)
+
+        start_position = self.checkpoint.start_position if self.checkpoint else 0
+        if start_position:
+            print("Resume feed from checkpoint: skip {} operations.".format(start_position))
+
+        start_time = time.time()
+        start_snapshot = self.metrics.snapshot()
+
+        try:
+            async with HttpConnectionPool(self.url, self.max_connections, self.timeout) as pool:
+                index = -1
+                async for operation in _iter_async(operations):
+                    index += 1
+                    if index < start_position:
+                        continue
+
+                    while self.in_flight >= self.concurrency:
+                        slot_freed.clear()
+                        await slot_freed.wait()
+
+                    self.in_flight += 1
+                    self.metrics.set_gauges(self.in_flight, self.concurrency)
+                    task = loop.create_task(self._process(pool, index, operation))
+                    tasks.add(task)
+                    task.add_done_callback(on_done)
+
+                while tasks:
+                    await asyncio.gather(*list(tasks), return_exceptions=True)
+                if errors:
+                    raise errors[0]
+        except BaseException:
+            if self.checkpoint:
+                self.checkpoint.save() #keep the progress of an interrupted feed
+            raise
+        finally:
+            if self.dead_letter:
+                self.dead_letter.close()
+
+        exec_time = time.time() - start_time
+        print("In total processed {} records ({} failed, {} retries, {:.0f} docs/sec).".format(
+            self.n_ok, self.n_failed, self.n_retries, (self.n_ok + self.n_failed)/max(exec_time, 1e-9)))
+        print_summary("Feed metrics", summarize(self.metrics.snapshot(), start_snapshot))
+
+        if self.checkpoint:
+            self.checkpoint.save()
+
+        if self.controller:
+            summary = self.controller.summary()
+            print("Feed concurrency: final {final}, min {min}, max {max}, average {average:.1f}.".format(**summary))
+
+        return self.n_ok, self.n_failed
+
+
+def feed_operations(operations, schema_name, settings, url=None, checkpoint=None, dead_letter=None, metrics=None):
+    """
+    feed operations from synchronous code
+
+    Input:
+        operations - iterable of feed operations
+        schema_name - schema name in vespa
+        checkpoint - FeedCheckpoint (optional, resume + periodic checkpoints)
+        dead_letter - DeadLetterWriter (optional)
+        metrics - FeedMetrics (optional)
+    Output:
+        (n_ok, n_failed)
+    """
+    feeder = AsyncFeeder(schema_name, settings, url, checkpoint, dead_letter, metrics)
+    return run_async(feeder.feed(operations))
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - expiry sweep
+remove expired documents (doc_expire_date before the sweep date) from vespa without a reload,
+then prune expired contract map entries (expire date before the sweep date) with partial updates
+
+modes:
+    selection - server-side delete by document selection (one request per continuation)
+    stream - visit the expired document ids and stream removes through the asyncio feed
+             (retries, dead-letter file and metrics)
+
+v0.1 - expiry sweeper for /document/v1
+v0.2 - invalidate the registered search result caches after the sweep
+v0.3 - count the pruned documents/entries of the accepted updates only
+v0.4 - publish the data version of the schema for the search result caches of other processes
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import json, time
+import urllib.parse
+from datetime import datetime
+from ..http_pool import HttpConnectionPool, HttpError, run_async
+from .provider_data_extraction import cancel_date_to_epoch
+from .provider_data_async_feed import AsyncFeeder, JSON_HEADERS
+from .feed_partial_update import map_fields, map_entry_path
+from .feed_metrics import FeedMetrics
+from . import feed_recovery
+from ..search import result_cache
+
+
+def resolve_sweep_date(settings):
+    """
+    sweep date (int YYYYMMDD): settings.sweep_date or today
+    """
+    return settings.sweep_date or int(datetime.now().strftime('%Y%m%d'))
+
+
+def sweep_date_to_epoch(sweep_date):
+    """
+    int date (e.g., 20230601) to unix time epoch, as doc_expire_date in the extraction (local time)
+    """
+    return cancel_date_to_epoch(datetime.strptime(str(sweep_date), '%Y%m%d').strftime('%Y-%m-%d'))
+
+
+def expired_selection(schema_name, expire_epoch):
+    """
+    document selection of the documents expired before expire_epoch
+    """
+    return "{}.doc_expire_date < {}".format(schema_name, expire_epoch)
+
+
+def prune_update(fields, sweep_date, map_fields=map_fields):
+    """
+    partial update removing the expired entries (expire date < sweep_date) of the contract maps
+
+    Input:
+        fields - document fields (with the map fields)
+        sweep_date - int date (YYYYMMDD)
+    Output:
+        update - (dict) "field{key}" -> {"remove": 0} (empty if nothing expired)
+    """
+    update = dict()
+    for field in map_fields:
+        for key, expire_date in (fields.get(field) or dict()).items():
+            if expire_date < sweep_date:
+                update[map_entry_path(field, key)] = {'remove': 0}
+    return update
+
+
+def selection_path(namespace, schema_name, params):
+    """
+    /document/v1 path of a visit/delete by selection
+    """
+    return "/document/v1/{}/{}/docid?{}".format(namespace, schema_name, urllib.parse.urlencode(params))
+
+
+async def iter_visit(pool, namespace, schema_name, selection, cluster, field_set="[document]", wanted=1000):
+    """
+    visit the selected documents page by page (async generator of {'id', 'fields'})
+    """
+    params = {'selection': selection, 'cluster': cluster, 'fieldSet': field_set, 'wantedDocumentCount': wanted}
+
+    while True:
+        status, body = await pool.request("GET", selection_path(namespace, schema_name, params), None, JSON_HEADERS)
+        if status != 200:
+            raise HttpError("Visit failed: {} {}".format(status, body))
+
+        response = json.loads(body)
+        for document in response.get('documents', []):
+            yield document
+
+        if not response.get('continuation'):
+            break
+        params['continuation'] = response['continuation']
+
+
+async def delete_by_selection(pool, namespace, schema_name, selection, cluster):
+    """
+    delete the selected documents on the server side
+    Output:
+        number of removed documents
+    """
+    params = {'selection': selection, 'cluster': cluster}
+    n_removed = 0
+
+    while True:
+        status, body = await pool.request("DELETE", selection_path(namespace, schema_name, params), None, JSON_HEADERS)
+        if status != 200:
+            raise HttpError("Delete by selection failed: {} {}".format(status, body))
+
+        response = json.loads(body)
+        n_removed += response.get('documentCount', 0)
+
+        if not response.get('continuation'):
+            return n_removed
+        params['continuation'] = response['continuation']
+
+
+def _data_id(doc_id):
+    #id:namespace:doctype::data id -> data id
+    return doc_id.split("::", 1)[1]
+
+
+class ExpirySweeper:
+    """
+    expiry sweeper of a schema
+
+    Input:
+        schema_name - schema name in vespa
+        settings - configuration (sweep_date, sweep_mode, sweep_prune_maps, content_cluster, visit_batch_size
+                   and the asyncio feed settings)
+        url - vespa url (default: settings.vespa_url_local)
+        metrics - FeedMetrics (optional)
+    """
+
+    def __init__(self, schema_name, settings, url=None, metrics=None):
+        self.schema_name = schema_name
+        self.namespace = settings.feed_namespace or schema_name
+        self.url = url or settings.vespa_url_local
+        self.settings = settings
+        self.metrics = metrics or FeedMetrics()
+
+        self.sweep_date = resolve_sweep_date(settings)
+        self.expire_epoch = sweep_date_to_epoch(self.sweep_date)
+
+        self.n_pruned_documents = 0
+        self.n_pruned_entries = 0
+
+    def _visit(self, pool, selection, field_set):
+        settings = self.settings
+        return iter_visit(pool, self.namespace, self.schema_name, selection, settings.content_cluster,
+                          field_set, settings.visit_batch_size)
+
+    async def _iter_remove_operations(self, pool):
+        async for document in self._visit(pool, expired_selection(self.schema_name, self.expire_epoch), "[id]"):
+            yield {'op': 'remove', 'id': _data_id(document['id'])}
+
+    async def _iter_prune_operations(self, pool):
+        field_set = "{}:{}".format(self.schema_name, ",".join(sorted(map_fields)))
+        async for document in self._visit(pool, self.schema_name, field_set):
+            update = prune_update(document.get('fields', {}), self.sweep_date)
+            if update:
+                yield {'op': 'update', 'id': _data_id(document['id']), 'fields': update}
+
+    def _on_prune_done(self, operation, status):
+        #dead-lettered updates did not prune anything
+        if status == 200:
+            self.n_pruned_documents += 1
+            self.n_pruned_entries += len(operation['fields'])
+
+    def _feeder(self, name, on_done=None):
+        dead_letter = feed_recovery.DeadLetterWriter(
+            "{}{}_{}_dead_letter.jsonl".format(self.settings.local_outdir, self.schema_name, name))
+        return AsyncFeeder(self.schema_name, self.settings, self.url, dead_letter=dead_letter, metrics=self.metrics,
+                           on_done=on_done)
+
+    async def sweep(self):
+        """
+        remove the expired documents, then prune the expired map entries
+        Output:
+            report - (dict) sweep_date, removed_documents, remove_secs, pruned_documents, pruned_entries, prune_secs
+        """
+        settings = self.settings
+        report = {'sweep_date': self.sweep_date, 'mode': settings.sweep_mode}
+
+        async with HttpConnectionPool(self.url, 2, settings.timeout) as pool:
+            start_time = time.time()
+            if settings.sweep_mode == "selection":
+                report['removed_documents'] = await delete_by_selection(
+                    pool, self.namespace, self.schema_name, expired_selection(self.schema_name, self.expire_epoch),
+                    settings.content_cluster)
+            elif settings.sweep_mode == "stream":
+                feeder = self._feeder("expiry_remove")
+                await feeder.feed(self._iter_remove_operations(pool))
+                report['removed_documents'] = feeder.n_ok
+            else:
+                raise ValueError("Unknown sweep mode: {}".format(settings.sweep_mode))
+            report['remove_secs'] = time.time() - start_time
+
+            start_time = time.time()
+            if settings.sweep_prune_maps:
+                feeder = self._feeder("expiry_prune", self._on_prune_done)
+                await feeder.feed(self._iter_prune_operations(pool))
+            report['pruned_documents'] = self.n_pruned_documents
+            report['pruned_entries'] = self.n_pruned_entries
+            report['prune_secs'] = time.time() - start_time
+
+        return report
+
+
+def print_report(report):
+    """
+    display a sweep report
+    """
+    print("Expiry sweep ({mode}, expired before {sweep_date}):".format(**report))
+    print("  removed {removed_documents} expired documents in {remove_secs:.1f} secs.".format(**report))
+    print("  pruned {pruned_entries} expired map entries from {pruned_documents} documents in {prune_secs:.1f} secs.".format(**report))
+
+
+def main_process(settings):
+    start_time = time.time()
+
+    sweeper = ExpirySweeper(settings.schema_name, settings)
+    report = run_async(sweeper.sweep())
+    print_report(report)
+    result_cache.notify_data_changed(settings.schema_name, version_dir=settings.cache_version_dir)
+
+    end_time = time.time()
+    print("Execution time: {} secs.".format(end_time-start_time))
+    return report
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - feed export
+write the extracted data as vespa document operations in JSONL (one operation per line,
+the format of vespa-feed-client), so large loads can be handed to the java feed client
+or replayed later through the asyncio feed (data_feed_flag 5)
+
+    {"put": "id:organization:organization::key", "fields": {...}}
+    {"update": "id:organization:organization::key", "fields": {"csp_contract{code}": {"assign": 20991231}}}
+    {"remove": "id:organization:organization::key"}
+
+files in a directory next to each data file (e.g., organization_sample_data.pkl):
+    organization_sample_data_feed/part-00000.jsonl[.gz], part-00001.jsonl[.gz], ...
+    organization_sample_data_feed/replay/part-00000_feed_checkpoint.json, part-00000_dead_letter.jsonl, ...
+        (replay state, outside the shard names)
+
+v0.1 - sharded (optionally gzip) JSONL export with a streaming writer; replay reader
+v0.2 - strict shard names; replay checkpoints and dead letters in a replay subdirectory
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, re, glob, gzip, json, time, itertools
+from . import provider_data_store, provider_data_manifest, provider_data_async_feed, feed_partial_update, feed_recovery
+from .provider_data_async_feed import json_default
+
+try:
+    import orjson #optional fast serializer
+except ImportError:
+    orjson = None
+
+SHARD_PATTERNS = ["part-[0-9]*.jsonl", "part-[0-9]*.jsonl.gz"]
+SHARD_NAME = re.compile(r"^part-\d+\.jsonl(\.gz)?$") #glob can not exclude e.g. part-00000_dead_letter.jsonl
+REPLAY_DIRNAME = "replay"
+
+
+def export_dirname(filename):
+    """
+    export directory of a data file (e.g., x.pkl -> x_feed)
+    """
+    return os.path.splitext(filename)[0] + "_feed"
+
+
+def replay_filename(shard):
+    """
+    base name of the replay checkpoint/dead-letter files of a shard
+    (e.g., x_feed/part-00000.jsonl.gz -> x_feed/replay/part-00000, see feed_recovery)
+    """
+    dirname, name = os.path.split(shard)
+    return os.path.join(dirname, REPLAY_DIRNAME, name.split(".")[0])
+
+
+def _glob_shards(dirname):
+    #shard files of a directory (unordered)
+    filenames = []
+    for pattern in SHARD_PATTERNS:
+        filenames += [x for x in glob.glob(os.path.join(dirname, pattern)) if SHARD_NAME.match(os.path.basename(x))]
+    return filenames
+
+
+def create_serializer(name="auto"):
+    """
+    json serializer of feed documents (dict -> compact utf8 bytes)
+
+    Input:
+        name - "orjson", "json" (stdlib encoder reused across documents) or "auto" (orjson if installed)
+    Output:
+        serialize - function(document) -> bytes
+        name - serializer in use
+    """
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        return (lambda document: orjson.dumps(document, default=json_default)), name
+    elif name == "json":
+        encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'), default=json_default)
+        return (lambda document: encoder.encode(document).encode('utf8')), name
+    else:
+        raise ValueError("Unknown serializer: {}".format(name))
+
+
+def to_document_json(operation, namespace, schema_name):
+    """
+    vespa document json of a feed operation
+    """
+    op = operation.get('op', 'put')
+    doc_id = "id:{}:{}::{}".format(namespace, schema_name, operation['id'])
+
+    if op == 'remove':
+        return {'remove': doc_id}
+    elif op in ('put', 'update'):
+        return {op: doc_id, 'fields': operation['fields']}
+    else:
+        raise ValueError("Unknown feed operation: {}".format(op))
+
+
+def from_document_json(document):
+    """
+    feed operation of a vespa document json (the namespace and document type are dropped)
+    """
+    for op in ('put', 'update', 'remove'):
+        if op in document:
+            data_id = document[op].split("::", 1)[1]
+            if op == 'remove':
+                return {'op': op, 'id': data_id}
+            return {'op': op, 'id': data_id, 'fields': document['fields']}
+
+    raise ValueError("Not a document operation: {}".format(document))
+
+
+class ShardedJsonlWriter:
+    """
+    streaming JSONL writer: lines are buffered up to buffer_size bytes, a new shard is started
+    every shard_size lines and a shard is renamed to its final name only when it is complete
+
+    Input:
+        outdir - output directory (existing shards are removed)
+        shard_size - lines per shard
+        compression - None or "gzip"
+        compress_level - gzip compression level (1 = fastest)
+        buffer_size - max bytes buffered before a write
+    """
+
+    def __init__(self, outdir, shard_size=100000, compression=None, compress_level=1, buffer_size=1 << 20):
+        self.outdir = outdir
+        self.shard_size = max(1, int(shard_size))
+        self.compression = compression
+        self.compress_level = compress_level
+        self.buffer_size = buffer_size
+
+        self.filenames = [] #completed shards
+        self.n_lines = 0
+        self.n_bytes = 0 #uncompressed bytes
+
+        self._file = None
+        self._buffer = []
+        self._buffered = 0
+        self._shard_lines = 0
+
+        os.makedirs(outdir, exist_ok=True)
+        for filename in _glob_shards(outdir):
+            os.remove(filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _open_shard(self):
+        suffix = ".jsonl.gz" if self.compression == "gzip" else ".jsonl"
+        self._filename = os.path.join(self.outdir, "part-{:05d}{}".format(len(self.filenames), suffix))
+
+        if self.compression == "gzip":
+            self._file = gzip.open(self._filename + ".tmp", 'wb', compresslevel=self.compress_level)
+        elif self.compression is None:
+            self._file = open(self._filename + ".tmp", 'wb')
+        else:
+            raise ValueError("Unknown compression: {}".format(self.compression))
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+
+    def _close_shard(self):
+        self._flush()
+        self._file.close()
+        self._file = None
+        os.replace(self._filename + ".tmp", self._filename)
+        self.filenames.append(self._filename)
+        self._shard_lines = 0
+
+    def write(self, line):
+        """
+        write one serialized line (bytes, without the newline)
+        """
+        if self._file is None:
+            self._open_shard()
+
+        self._buffer.append(line)
+        self._buffer.append(b"\n")
+        self._buffered += len(line) + 1
+        self.n_lines += 1
+        self.n_bytes += len(line) + 1
+        self._shard_lines += 1
+
+        if self._buffered >= self.buffer_size:
+            self._flush()
+        if self._shard_lines >= self.shard_size:
+            self._close_shard()
+
+    def close(self):
+        """
+        complete the last shard
+        Output:
+            filenames - list of shard files
+        """
+        if self._file is not None:
+            self._close_shard()
+        return self.filenames
+
+
+def export_operations(operations, outdir, namespace, schema_name, settings):
+    """
+    export feed operations as sharded JSONL
+
+    Input:
+        operations - iterable of feed operations (consumed lazily)
+        outdir - output directory
+        namespace - document namespace
+        schema_name - schema name in vespa
+    Output:
+        writer - the closed ShardedJsonlWriter (filenames, n_lines, n_bytes)
+    """
+    serialize, _ = create_serializer(settings.export_serializer)
+
+    with ShardedJsonlWriter(outdir, settings.export_shard_size, settings.export_compression,
+                            settings.export_compress_level, settings.export_buffer_size) as writer:
+        for operation in operations:
+            writer.write(serialize(to_document_json(operation, namespace, schema_name)))
+
+    return writer
+
+
+def iter_export_operations(data, filename, settings):
+    """
+    feed operations of a data file (puts; in delta mode the new/changed documents, partial updates
+    if configured, and removes)
+
+    Input:
+        data - extracted data frame
+        filename - data file name (.pkl)
+    """
+    id_field = settings.key_id_field
+
+    if not settings.delta_mode:
+        return provider_data_async_feed.iter_put_operations(data, id_field, settings.nan_fill_value,
+                                                            settings.feed_conversion_chunk_size)
+
+    delta = provider_data_manifest.load_delta(filename)
+    data = data[data[id_field].isin(set(delta['new']) | set(delta['changed']))]
+
+    if settings.partial_update:
+        previous = provider_data_store.load_previous(filename, settings)
+        operations = feed_partial_update.iter_update_operations(data, previous, id_field, settings.nan_fill_value,
+                                                                settings.feed_conversion_chunk_size)
+    else:
+        operations = provider_data_async_feed.iter_put_operations(data, id_field, settings.nan_fill_value,
+                                                                  settings.feed_conversion_chunk_size)
+
+    return itertools.chain(operations, provider_data_async_feed.iter_remove_operations(delta['removed']))
+
+
+def list_shards(dirname):
+    """
+    shard files of an export directory (in order)
+    """
+    return sorted(_glob_shards(dirname))
+
+
+def iter_jsonl_operations(filename):
+    """
+    yield the feed operations of an exported JSONL file (plain or gzip)
+    """
+    loads = orjson.loads if orjson is not None else json.loads
+    opener = gzip.open if filename.endswith(".gz") else open
+
+    with opener(filename, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield from_document_json(loads(line))
+
+
+def replay_shards(filename, schema_name, settings, url=None, metrics=None):
+    """
+    replay the exported JSONL shards of a data file with the asyncio feed (data_feed_flag 5);
+    each shard has its own checkpoint and dead-letter file in the replay subdirectory
+
+    Input:
+        filename - data file name (.pkl name, the export directory is next to it)
+        schema_name - schema name in vespa
+        url - vespa url (default: settings.vespa_url_local)
+        metrics - FeedMetrics (optional)
+    Output:
+        (n_ok, n_failed) of the replayed shards
+    """
+    shards = list_shards(export_dirname(filename))
+    if not shards:
+        print("No exported feed files for {}. Skip this file.".format(filename))
+
+    n_ok, n_failed = 0, 0
+    for shard in shards:
+        base = replay_filename(shard)
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        checkpoint = feed_recovery.FeedCheckpoint(feed_recovery.checkpoint_filename(base), feed_recovery.file_signature(shard),
+                                                  settings.checkpoint_interval, settings.resume_feed)
+        if checkpoint.complete:
+            print("Shard already fed (see {}). Skip this shard.".format(checkpoint.filename))
+            continue
+
+        print("Replay feed file: {}".format(shard))
+        dead_letter = feed_recovery.DeadLetterWriter(feed_recovery.dead_letter_filename(base))
+        shard_ok, shard_failed = provider_data_async_feed.feed_operations(
+            iter_jsonl_operations(shard), schema_name, settings, url, checkpoint=checkpoint, dead_letter=dead_letter,
+            metrics=metrics)
+        checkpoint.save(complete=True)
+        n_ok += shard_ok
+        n_failed += shard_failed
+
+    return n_ok, n_failed
+
+
+def main_process(settings):
+    #configuration
+    indir = settings.local_outdir
+    schema_name = settings.schema_name
+    namespace = settings.feed_namespace or schema_name
+
+    if schema_name.startswith('o'):
+        filenames = settings.org_outfiles
+    else:
+        filenames = settings.prov_outfiles
+
+    start_time = time.time()
+    _, serializer_name = create_serializer(settings.export_serializer)
+
+    for filename in filenames:
+        file_st = time.time()
+        filename = indir + filename
+        outdir = export_dirname(filename)
+        print("Export feed operations from file: {}".format(filename))
+
+        data = provider_data_store.load_data(filename, settings)
+        operations = iter_export_operations(data, filename, settings)
+        writer = export_operations(operations, outdir, namespace, schema_name, settings)
+
+        exec_time = time.time() - file_st
+        print("Exported {} operations to {} shards in {} ({:.1f} MB, {:.1f} MB/sec, {} serializer).".format(
+            writer.n_lines, len(writer.filenames), outdir, writer.n_bytes/1e6,
+            writer.n_bytes/1e6/max(exec_time, 1e-9), serializer_name))
+
+    end_time = time.time()
+    print("Execution time: {} secs.".format(end_time-start_time))
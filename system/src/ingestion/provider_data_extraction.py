@@ -6,6 +6,16 @@ read provider data, select required fields, convert it to vespa format based on
 v0.1 - prototype version
 v0.3 - add major sections in procesing
 v0.4 - add accepting patient code to unet (for both organization/practitioner)
+v0.5 - stream raw records from the input file instead of loading the whole json document
+v0.6 - accumulate records column by column and build the data frame once per chunk (replace DataFrame.append)
+v0.7 - multi-process extraction over record chunks and files
+v0.8 - table-driven contract section reducer with cached date parsing
+v0.9 - typed address field parsing (no eval) with a per-record error report
+v1.0 - optional columnar output format (see provider_data_store)
+v1.1 - document manifest and delta for incremental extraction (see provider_data_manifest)
+v1.2 - keep the previous snapshot in delta mode for partial update feeds
+v1.3 - the previous snapshot is kept by the feed after a complete delta feed (see provider_data_feed)
+v1.4 - address fields are parsed per record (remove the unused chunk parser)
 
 @author: Yizhao Ni, PhD, MBA, FAMIA
 @email: yizhao_ni@optum.com
@@ -13,15 +23,46 @@ v0.4 - add accepting patient code to unet (for both organization/practitioner)
 
 import warnings
 import re, os, sys, json, time
+import types
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from .provider_data_reader import iter_provider_records
+from .feed_conversion import iter_batches
+from . import provider_data_store, provider_data_manifest
+from .field_parsers import (
+    FieldParseError,
+    parse_int,
+    parse_float,
+    parse_zipcode,
+    parse_fields,)
 
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
 
+@lru_cache(maxsize=65536)
+def cancel_date_to_int(cancel_date):
+    """
+    convert a cancel date string (e.g., '9999-12-31') to an int date (e.g., 99991231)
+    Note: memoized, most cancel dates repeat across records
+    """
+    return int(datetime.strftime(datetime.strptime(cancel_date, '%Y-%m-%d'),'%Y%m%d'))
+
+
+@lru_cache(maxsize=65536)
+def cancel_date_to_epoch(cancel_date):
+    """
+    convert a cancel date string to unix time epoch (local time, memoized)
+    """
+    return int(time.mktime(datetime.strptime(cancel_date, '%Y-%m-%d').timetuple()))
+
+
+
 def process_provider_data_section(dsection, settings):
     """
     process provider data section
@@ -44,7 +85,7 @@ def process_provider_data_section(dsection, settings):
     
     if void_ind == 'N':
         #convert to unix timestamp epoch
-        expire_date = int(time.mktime(datetime.strptime(dsection['cancelDate'], '%Y-%m-%d').timetuple()))
+        expire_date = cancel_date_to_epoch(dsection['cancelDate'])
        
         org_name = ""
         last_name = dsection['lastName'].lower()
@@ -68,6 +109,32 @@ def process_provider_data_section(dsection, settings):
     
     
     
+#typed fields of the address section: raw field -> parser
+address_field_parsers = {
+    'zipCode': parse_zipcode, #zip code should be a 5-digit string (e.g., 06320 is a valid zip); the current data trim the prefix 0
+    'addressId': parse_int,
+    'latitude': parse_float,
+    'longitude': parse_float,
+    }
+
+
+def build_address_record(dsection, parsed):
+    """
+    build the address record from the raw section record and its parsed typed fields
+    """
+    
+    record = {'address_id': parsed['addressId'],
+              'address_line': dsection['addressLine1'].lower(),
+              'city_name': dsection['cityName'].lower(),
+              'county_name': dsection['countyName'].lower(),
+              'state_code': dsection['stateCode'].lower(),
+              'zipcode': parsed['zipCode'], 
+              'geocode': {'lat': parsed['latitude'], 'lng': parsed['longitude']}
+        }
+    
+    return record
+
+
 def process_provider_address_section(dsection, settings=None):
     """
     process provider address section
@@ -83,24 +150,64 @@ def process_provider_address_section(dsection, settings=None):
         state_code - state code
         zipcode - zipcode 
         geocode - (dict) {'lat':row['lat'], 'lng':row['lng']}
+    Raise:
+        FieldParseError if a typed field can not be parsed
     """
     
     dsection = dsection[0] #get the first record
-    zip_code =eval(dsection['zipCode']) #zip code should be a 5-digit string (e.g., 06320 is a valid zip); the current data trim the prefix 0
-    zip_code = str(100000 + zip_code)[1:] #add 0 to 4 digit zip code
-
-    record = {'address_id': eval(dsection['addressId'].lower()),
-              'address_line': dsection['addressLine1'].lower(),
-              'city_name': dsection['cityName'].lower(),
-              'county_name': dsection['countyName'].lower(),
-              'state_code': dsection['stateCode'].lower(),
-              'zipcode': zip_code, 
-              'geocode': {'lat': eval(dsection['latitude']), 'lng':eval(dsection['longitude'])}
-        }
+    parsed = parse_fields(dsection, address_field_parsers)
+    
+    return build_address_record(dsection, parsed)
+
+
+#contract section specs: section -> output field, id field (record is skipped if empty), 
+#key fields (joined by "-" as the map key) and the date field
+contract_section_specs = {
+    "cspContractData": {'output_field': 'csp_contract', 'id_field': 'cspProviderId',
+                        'key_fields': ['ovationLOBTypeCode'], 'date_field': 'cancelDate'},
+    "nationalProviderIdData": {'output_field': 'national_taxonomy', 'id_field': 'nationalProviderId',
+                               'key_fields': ['taxonomyCode'], 'date_field': 'cancelDate'},
+    "cosmosContractData": {'output_field': 'cosmos_contract', 'id_field': 'cosmosProviderNumber',
+                           'key_fields': ['cosmosDiv', 'cosmosPanelNumber'], 'date_field': 'cancelDate'},
+    "unetContractData": {'output_field': 'unet_contract', 'id_field': 'contractId',
+                         'key_fields': ['marketNumber', 'productOfferId', 'acceptingPatientCode'], 'date_field': 'cancelDate'},
+    "specialtyContractingOrgData": {'output_field': 'specialty_org', 'id_field': 'specialtyTypeCode',
+                                    'key_fields': ['specialtyTypeCode', 'contractingOrgCode', 'primaryCode'], 'date_field': 'cancelDate'},
+    "addressContractingOrgData": {'output_field': 'contract_org', 'id_field': 'contractingOrgCode',
+                                  'key_fields': ['contractingOrgCode', 'primaryCode', 'correspondenceIndicator'], 'date_field': 'cancelDate'},
+    }
+
+
+def reduce_contract_section(dsection, spec, settings):
+    """
+    reduce a contract section (effective records only) in a single pass:
+    map key -> max expire date, keeping non-expired contracts only
     
+    Input:
+        dsection - section data (list of dict)
+        spec - contract section spec (see contract_section_specs)
+    Output (dict): 
+        output_field - (dict) key fields joined by "-" -> max expire date
+    """
     
-    return record
+    id_field = spec['id_field']
+    key_fields = spec['key_fields']
+    date_field = spec['date_field']
+    current_date = settings.current_date
     
+    contract = dict()
+    
+    for record in dsection:
+        if record[id_field] and record['voidedIndicator'] == 'N':
+            expire_date = cancel_date_to_int(record[date_field])
+            
+            if expire_date >= current_date:
+                #get the max expire date for a code for non-expired contracts
+                code = "-".join([record[x] for x in key_fields]).lower()
+                if expire_date > contract.get(code, 0):
+                    contract[code] = expire_date
+                    
+    return {spec['output_field']: contract}
 
 
 def process_csp_contract_section(dsection, settings):
@@ -112,29 +219,7 @@ def process_csp_contract_section(dsection, settings):
     Output (dict): 
         csp_lob_contract - (dict) ovationLOBTypeCode -> max expire date for this contract type
     """
-    
-    
-    csp_contract = dict()
-    
-    
-    for record in dsection:
-        m_id = record['cspProviderId'].lower()
-        void_ind = record['voidedIndicator']
-        
-        if m_id and void_ind == 'N':
-            code = record['ovationLOBTypeCode'].lower()
-            expire_date = int(datetime.strftime(datetime.strptime(record['cancelDate'], '%Y-%m-%d'),'%Y%m%d'))
-            
-            if expire_date >= settings.current_date:
-                #get the max expire date for a code for non-expired contracts
-                if code in csp_contract:
-                    if expire_date > csp_contract[code]:
-                        csp_contract[code] = expire_date
-                else:
-                    csp_contract[code] = expire_date
-        
-        
-    return {'csp_contract': csp_contract}
+    return reduce_contract_section(dsection, contract_section_specs["cspContractData"], settings)
 
 
 def process_national_provider_section(dsection, settings):
@@ -146,29 +231,7 @@ def process_national_provider_section(dsection, settings):
     Output (dict): 
         national_taxonomy - (dict) taxonomy -> max expire date for this taxonomy
     """
-    
-    
-    national_taxonomy = dict()
-    
-    
-    for record in dsection:
-        m_id = record['nationalProviderId'].lower()
-        void_ind = record['voidedIndicator']
-        
-        if m_id and void_ind == 'N':
-            code = record['taxonomyCode'].lower()
-            expire_date = int(datetime.strftime(datetime.strptime(record['cancelDate'], '%Y-%m-%d'),'%Y%m%d'))
-            
-            if expire_date >= settings.current_date:
-                #get the max expire date for a code for non-expired contracts
-                if code in national_taxonomy:
-                    if expire_date > national_taxonomy[code]:
-                        national_taxonomy[code] = expire_date
-                else:
-                    national_taxonomy[code] = expire_date
-        
-        
-    return {'national_taxonomy': national_taxonomy}
+    return reduce_contract_section(dsection, contract_section_specs["nationalProviderIdData"], settings)
 
 
 def process_cosmos_contract_section(dsection, settings):
@@ -180,29 +243,7 @@ def process_cosmos_contract_section(dsection, settings):
     Output (dict): 
         cosmos_contract - (dict) cosmosDiv-cosmosPanelNumber -> max expire date for this contract type
     """
-    
-    
-    cosmos_contract = dict()
-    
-    
-    for record in dsection:
-        m_id = record['cosmosProviderNumber'].lower()
-        void_ind = record['voidedIndicator']
-        
-        if m_id and void_ind == 'N':
-            code = record['cosmosDiv'].lower()+"-"+record['cosmosPanelNumber'].lower()
-            expire_date = int(datetime.strftime(datetime.strptime(record['cancelDate'], '%Y-%m-%d'),'%Y%m%d'))
-            
-            if expire_date >= settings.current_date:
-                #get the max expire date for a code for non-expired contracts
-                if code in cosmos_contract:
-                    if expire_date > cosmos_contract[code]:
-                        cosmos_contract[code] = expire_date
-                else:
-                    cosmos_contract[code] = expire_date
-        
-        
-    return {'cosmos_contract': cosmos_contract}
+    return reduce_contract_section(dsection, contract_section_specs["cosmosContractData"], settings)
 
 
 def process_unet_contract_section(dsection, settings):
@@ -214,29 +255,7 @@ def process_unet_contract_section(dsection, settings):
     Output (dict): 
         unet_contract - (dict) marketNumber-productOfferId-acceptingPatientCode -> max expire date for this contract type
     """
-    
-    
-    unet_contract = dict()
-    
-    
-    for record in dsection:
-        m_id = record['contractId'].lower()
-        void_ind = record['voidedIndicator']
-        
-        if m_id and void_ind == 'N':
-            code = record['marketNumber'].lower()+"-"+record['productOfferId'].lower()+"-"+record['acceptingPatientCode'].lower()
-            expire_date = int(datetime.strftime(datetime.strptime(record['cancelDate'], '%Y-%m-%d'),'%Y%m%d'))
-            
-            if expire_date >= settings.current_date:
-                #get the max expire date for a code for non-expired contracts
-                if code in unet_contract:
-                    if expire_date > unet_contract[code]:
-                        unet_contract[code] = expire_date
-                else:
-                    unet_contract[code] = expire_date
-        
-        
-    return {'unet_contract': unet_contract}
+    return reduce_contract_section(dsection, contract_section_specs["unetContractData"], settings)
 
 
 def process_specialty_type_section(dsection, settings):
@@ -249,29 +268,7 @@ def process_specialty_type_section(dsection, settings):
         specialty_org - (dict) specialtyTypeCode-contractingOrgCode-primaryCode 
         -> max expire date for this specialty type
     """
-    
-    
-    specialty_org = dict()
-    
-    
-    for record in dsection:
-        m_id = record['specialtyTypeCode'].lower()
-        void_ind = record['voidedIndicator']
-        
-        if m_id and void_ind == 'N':
-            code = record['specialtyTypeCode'].lower()+"-"+record['contractingOrgCode'].lower()+"-"+record['primaryCode'].lower()
-            expire_date = int(datetime.strftime(datetime.strptime(record['cancelDate'], '%Y-%m-%d'),'%Y%m%d'))
-            
-            if expire_date >= settings.current_date:
-                #get the max expire date for a code for non-expired contracts
-                if code in specialty_org:
-                    if expire_date > specialty_org[code]:
-                        specialty_org[code] = expire_date
-                else:
-                    specialty_org[code] = expire_date
-        
-        
-    return {'specialty_org': specialty_org}
+    return reduce_contract_section(dsection, contract_section_specs["specialtyContractingOrgData"], settings)
 
 
 def process_contract_org_section(dsection, settings):
@@ -284,29 +281,145 @@ def process_contract_org_section(dsection, settings):
         contract_org - (dict) contractingOrgCode-primaryCode-correspondenceIndicator
         -> max expire date for this contract type
     """
+    return reduce_contract_section(dsection, contract_section_specs["addressContractingOrgData"], settings)
+
+
+
+class RecordAccumulator:
+    """
+    columnar record accumulator: collect section outputs column by column 
+    and build the data frame once per chunk (instead of copying the frame for every record)
     
+    Input:
+        chunk_size - number of records per data frame chunk
+    """
     
-    contract_org = dict()
+    def __init__(self, chunk_size=100000):
+        self.chunk_size = max(1, int(chunk_size))
+        self.columns = dict() #column name -> list of values (insertion order = column order)
+        self.n_rows = 0 #number of rows in the current chunk
+        self.frames = []
+        
+    def add(self, record):
+        """
+        add one record (dict: column -> value) to the current chunk
+        """
+        n_rows = self.n_rows
+        columns = self.columns
+        
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [np.nan]*n_rows #new column: fill earlier rows with NaN
+            column.append(value)
+        
+        self.n_rows = n_rows = n_rows + 1
+        
+        #fill columns missing from this record with NaN
+        if len(record) != len(columns):
+            for column in columns.values():
+                if len(column) < n_rows:
+                    column.append(np.nan)
+                    
+        if n_rows >= self.chunk_size:
+            self.flush()
+            
+    def flush(self):
+        """
+        build a data frame from the current chunk
+        """
+        if self.n_rows:
+            self.frames.append(pd.DataFrame(self.columns))
+            self.columns = dict()
+            self.n_rows = 0
+            
+    def to_frame(self):
+        """
+        return all accumulated records as one data frame
+        """
+        self.flush()
+        
+        if not self.frames:
+            return pd.DataFrame()
+        elif len(self.frames) == 1:
+            return self.frames[0]
+        else:
+            return pd.concat(self.frames, ignore_index=True)
+            
+    def __len__(self):
+        return sum(len(x) for x in self.frames) + self.n_rows
+        
+
+
+def process_record(data, settings, errors=None):
+    """
+    process one provider record with all section processes
+    Input:
+        data - raw provider record (dict)
+        errors - (list) error report; receives one entry per field that can not be parsed
+    Output:
+        data_dict - (dict) extracted fields; None for void, unidentified or invalid records
+    """
     
+    if not data['enterpriseProviderId']:
+        return None
     
-    for record in dsection:
-        m_id = record['contractingOrgCode'].lower()
-        void_ind = record['voidedIndicator']
+    data_dict = dict()
+    data_dict['enterprise_provider_id'] = data['enterpriseProviderId']
+    data_dict['generated_key'] = data['generatedKey']
+
+    #process each section
+    for process_name in process_names:
+        process = processes.get(process_name)
         
-        if m_id and void_ind == 'N':
-            code = record['contractingOrgCode'].lower()+"-"+record['primaryCode'].lower()+"-"+record['correspondenceIndicator'].lower()
-            expire_date = int(datetime.strftime(datetime.strptime(record['cancelDate'], '%Y-%m-%d'),'%Y%m%d'))
-            
-            if expire_date >= settings.current_date:
-                #get the max expire date for a code for non-expired contracts
-                if code in contract_org:
-                    if expire_date > contract_org[code]:
-                        contract_org[code] = expire_date
-                else:
-                    contract_org[code] = expire_date
+        try:
+            record = process(data[process_name], settings)
+        except FieldParseError as e:
+            print("Invalid record during process: {} (ignore this document {}): {}".format(process_name, data_dict['generated_key'], e))
+            if errors is not None:
+                errors.extend({'generated_key': data_dict['generated_key'], 'section': process_name, 
+                               'field': field, 'value': value, 'error': message} for field, value, message in e.errors)
+            return None
+        
+        if record:
+            data_dict.update(record)
+        else:
+            if record == None: #None reserved for void provider record
+                print("Void record during process: {} (ignore this document {}).".format(process_name, data_dict['generated_key'] ))
+                return None #ignore void record in the update
+            else:
+                print("Empty record during process: {}.".format(process_name))
+                
+    return data_dict
+
+
+def extract_records(records, settings, display=True):
+    """
+    extract all records into a data frame 
+    Input:
+        records - iterable of raw provider records
+        display - display progress information
+    Output:
+        df - data frame of the extracted records
+        rindex - number of raw records processed
+        errors - error report (list of dict: generated_key, section, field, value, error)
+    """
+    
+    accumulator = RecordAccumulator(settings.extraction_chunk_size)
+    errors = []
+    rindex = 0
+    
+    for rindex, data in enumerate(records, 1):
+        data_dict = process_record(data, settings, errors)
         
+        #add record to the current chunk
+        if data_dict:
+            accumulator.add(data_dict)
         
-    return {'contract_org': contract_org}
+        if display and rindex % settings.num_dispay == 0:
+            print("Have processed {} records.".format(rindex))
+            
+    return accumulator.to_frame(), rindex, errors
 
 
 
@@ -317,55 +430,142 @@ def clean_data_with_all_processes(filename, outfilename, settings):
         filename - input file name
         outfilename - output file name
     Output:
-        save data frame to outfilename as a pkl file
+        save data frame to outfilename (pkl file or columnar directory, see settings.output_format)
     """
     
     print("Process file: {}\n".format(filename))
     
-    with open(filename,'r', encoding='utf8') as f:
-        df = pd.DataFrame()
-        all_data = json.load(f) #each element is a record
-        
-        for rindex in range(1, len(all_data)+1):
-            data = all_data[rindex-1]
-            data_dict = None
-            
-            if data['enterpriseProviderId']:
-                data_dict = dict()
-                data_dict['enterprise_provider_id'] = data['enterpriseProviderId']
-                data_dict['generated_key'] = data['generatedKey']
-            
-                #process each section
-                for process_name in process_names:
-                    process = processes.get(process_name)
-                    record = process(data[process_name], settings)
-                    
-                    if record:
-                        data_dict.update(record)
-                    else:
-                        if record == None: #None reserved for void provider record
-                            print("Void record during process: {} (ignore this document {}).".format(process_name, data_dict['generated_key'] ))
-                            data_dict = None
-                            break #ignore void record in the update
-                        else:
-                            print("Empty record during process: {}.".format(process_name))
-
-                #add record to data frame
-                if data_dict:
-                    df = df.append(data_dict, ignore_index=True)
-            
-            if rindex % settings.num_dispay == 0:
-                print("Have processed {} records.".format(rindex))
-          
+    #each element of the top-level array is a record (read one at a time)
+    df, rindex, errors = extract_records(iter_provider_records(filename, settings), settings)
+    
+    save_data_frame(df, rindex, errors, outfilename, settings)
+
+
+def save_data_frame(df, rindex, errors, outfilename, settings):
+    """
+    save the extracted data frame (and the error report if any record is invalid)
+    Input:
+        df - extracted data frame
+        rindex - number of raw records processed
+        errors - error report (list of dict)
+        outfilename - output file name
+    """
+    
     print("Processed a total of {} records.".format(rindex))        
     print("Data frame shape: {}\n".format(df.shape))
+    
+    if errors:
+        errorfilename = error_report_filename(outfilename)
+        print("Invalid fields: {} (see {}).".format(len(errors), errorfilename))
+        with open(errorfilename, 'w', encoding='utf8') as f:
+            for error in errors:
+                f.write(json.dumps(error, default=str) + "\n")
+                
     print("Save data frame.\n")
     
-    #save df to pickle file
-    df.to_pickle(outfilename)
+    #save df to pickle file (or columnar directory)
+    provider_data_store.save_data(df, outfilename, settings)
+    
+    #delta against the previous extraction
+    if settings.delta_mode:
+        provider_data_manifest.update_manifest(df, outfilename, settings)
     print("-----------------")
 
 
+
+def error_report_filename(outfilename):
+    """
+    error report file name of an output file (e.g., x.pkl -> x_errors.jsonl)
+    """
+    return os.path.splitext(outfilename)[0] + "_errors.jsonl"
+
+
+def settings_snapshot(settings):
+    """
+    copy the configuration values into a picklable namespace (for worker processes)
+    """
+    
+    values = {key: value for key, value in vars(settings).items() 
+              if not key.startswith('_') and not isinstance(value, types.ModuleType) and not callable(value)}
+    
+    return types.SimpleNamespace(**values)
+
+
+def extract_record_chunk(records, settings):
+    """
+    worker task: extract a chunk of raw records into a data frame
+    """
+    return extract_records(records, settings, display=False)
+
+
+def clean_data_in_parallel(filenames, outfilenames, data_types, settings):
+    """
+    function to clean data files with a process pool over record chunks and files.
+    Chunks are submitted in file order and collected in submission order, 
+    so the output of each file keeps the original record order.
+    
+    Input:
+        filenames - input file names
+        outfilenames - output file names
+        data_types - data type of each file (organization/practitioner)
+    Output:
+        save data frame of each file to its outfilename (pkl file or columnar directory)
+    """
+    
+    num_workers = settings.num_workers
+    chunk_size = settings.parallel_chunk_size
+    max_pending = 2*num_workers #bound the number of chunks held in memory
+    
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque() #(future, file index); future None marks the end of a file
+        frames = []
+        errors = []
+        counts = {'records': 0}
+        
+        def collect():
+            future, findex = pending.popleft()
+            
+            if future is None:
+                #all chunks of the file are collected
+                frames_nonempty = [x for x in frames if len(x)]
+                if not frames_nonempty:
+                    df = pd.DataFrame()
+                elif len(frames_nonempty) == 1:
+                    df = frames_nonempty[0]
+                else:
+                    df = pd.concat(frames_nonempty, ignore_index=True)
+                    
+                save_data_frame(df, counts['records'], errors, outfilenames[findex], settings)
+                frames.clear()
+                errors.clear()
+                counts['records'] = 0
+            else:
+                df, rindex, chunk_errors = future.result()
+                frames.append(df)
+                errors.extend(chunk_errors)
+                previous = counts['records']
+                counts['records'] += rindex
+                
+                if previous//settings.num_dispay != counts['records']//settings.num_dispay:
+                    print("Have processed {} records.".format(counts['records']))
+                    
+        for findex, filename in enumerate(filenames):
+            print("Process file: {}\n".format(filename))
+            settings.data_type = data_types[findex] #add a temp data type indicator
+            worker_settings = settings_snapshot(settings)
+            
+            for chunk in iter_batches(iter_provider_records(filename, settings), chunk_size):
+                pending.append((executor.submit(extract_record_chunk, chunk, worker_settings), findex))
+                
+                while len(pending) > max_pending:
+                    collect()
+                    
+            pending.append((None, findex))
+            
+        while pending:
+            collect()
+
+
 #process mapping dictionary 
 processes = {
              "providerData": process_provider_data_section,
@@ -401,13 +601,19 @@ def main_process(settings):
     #data extraction/cleaning from the raw data file
     start_time = time.time()
 
-    for findex in file_indices:
-        filename = indir + filenames[findex]
-        outfilename = outdir + outfilenames[findex]
-        settings.data_type = settings.data_types[findex] #add a temp data type indicator
-        
-        #single thread processing
-        clean_data_with_all_processes(filename, outfilename, settings)
+    if settings.num_workers > 1:
+        #multi-process processing (chunks of all files share one process pool)
+        clean_data_in_parallel([indir + filenames[findex] for findex in file_indices],
+                               [outdir + outfilenames[findex] for findex in file_indices],
+                               [settings.data_types[findex] for findex in file_indices], settings)
+    else:
+        for findex in file_indices:
+            filename = indir + filenames[findex]
+            outfilename = outdir + outfilenames[findex]
+            settings.data_type = settings.data_types[findex] #add a temp data type indicator
+            
+            #single thread processing
+            clean_data_with_all_processes(filename, outfilename, settings)
         
     end_time = time.time()
     print("Execution time: {} secs.".format(end_time-start_time))
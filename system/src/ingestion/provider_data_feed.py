@@ -5,6 +5,19 @@ Provider data ingestion - step 2
 Feed data into vespa schema via pyvespa
 
 v0.1 - prototype version
+v0.2 - load extracted data in the configured output format (pickle/columnar)
+v0.3 - delta feed: put new/changed documents and remove disappeared ones (see provider_data_manifest)
+v0.4 - asyncio feed through a pooled HTTP client (data_feed_flag 4, see provider_data_async_feed)
+v0.5 - lazy row conversion with per-field NaN handling; batches are fed as they are produced
+v0.6 - resumable feed: retries with backoff, dead-letter file and per-file checkpoints (batch, point-wise and asyncio feed)
+v0.7 - partial update delta feed against the previous snapshot (asyncio feed, see feed_partial_update)
+v0.8 - replay exported JSONL feed files (data_feed_flag 5, see provider_data_export)
+v0.9 - feed metrics with a summary per file and per run (see feed_metrics)
+v1.0 - invalidate the registered search result caches after the feed
+v1.1 - delta mode: the manifest of a file is committed after its feed completed without failed documents
+v1.2 - the previous snapshot for partial updates is kept at the same commit point
+v1.3 - resumable batch feed: retries of transient failures, dead-letter file and a checkpoint per batch
+v1.4 - publish the data version of the schema for the search result caches of other processes
 
 @author: Yizhao Ni, PhD, MBA, FAMIA
 @email: yizhao_ni@optum.com
@@ -25,51 +38,126 @@ from vespa.package import (
     QueryProfileType,
     QueryTypeField,)
 
-import sys, os, time
+import sys, os, time, json, itertools
 from vespa.application import Vespa
 import pandas as pd
+from . import provider_data_store, provider_data_manifest, provider_data_async_feed, feed_recovery, feed_partial_update
+from . import provider_data_export, feed_metrics
+from ..search import result_cache
+from .feed_conversion import iter_vespa_rows, iter_vespa_documents, iter_batches
 
 
 
-def convert_df_to_vespa_dictlist(data, id_field):
+def convert_df_to_vespa_dictlist(data, id_field, fill_value=999999):
     """
     convert a data frame to vespa dictionary list
+    Note: the feed paths use the lazy iter_vespa_documents instead
     
     Inputs:
         data - data frame with all required fields
         id_filed - the id field
+        fill_value - value for NaN fields
         
     Outputs:
         data_list - the dictionary list in vespa format
     """
     
-    data_list = []
+    return list(iter_vespa_documents(data, id_field, fill_value))
+
+
+def feed_batch_with_retry(batch, vespa_app, schema_name, settings, metrics=None):
+    """
+    feed a batch, re-feeding the documents with a transient failure (timeout/connection error, 429, 5xx)
+    with jittered exponential backoff
+    
+    Input:
+        batch - list of documents in vespa dictionary format ({'id', 'fields'})
+        metrics - FeedMetrics (optional)
+    Output:
+        results - list of (status, body, attempts) in the batch order (status None if the request failed)
+    """
     
-    for idx, row in data.iterrows():
-        temp_data = dict()
-        temp_data['id'] = row[id_field]
-        temp_data['fields'] = dict(row)
-        data_list.append(temp_data)
+    results = [None]*len(batch)
+    pending = list(range(len(batch)))
+    attempt = 0
+    while pending:
+        try:
+            responses = vespa_app.feed_batch([batch[n] for n in pending], schema = schema_name, connections=settings.num_connections, 
+                                             batch_size = settings.batch_size, total_timeout = settings.timeout)
+            responses = [(response.status_code, response.json) for response in responses]
+        except OSError as e: #connection errors and timeouts of the whole batch
+            responses = [(None, str(e))]*len(pending)
         
-    return data_list
+        retry = []
+        for n, (status, body) in zip(pending, responses):
+            if status != 200 and feed_recovery.is_retryable(status) and attempt < settings.max_retries:
+                retry.append(n)
+                if metrics:
+                    metrics.on_retry(status)
+            else:
+                results[n] = (status, body, attempt + 1)
+                if metrics:
+                    metrics.on_done('put', status)
+        
+        pending = retry
+        if pending:
+            attempt += 1
+            time.sleep(feed_recovery.backoff_delay(attempt, settings.retry_backoff_base, settings.retry_backoff_max))
+    
+    return results
 
 
-def feed_data_by_batch(data, id_field, vespa_app, schema_name, settings):
+def feed_data_by_batch(data, id_field, vespa_app, schema_name, settings, checkpoint=None, dead_letter=None, metrics=None):
     """
     batch feed data using dictionary list (large GC in JVM)
+    Note: documents are converted lazily and each batch is fed as soon as it is complete;
+    the checkpoint is saved after each batch
     
     Input:
         data - data frame with all required fields
         id_field - the id_field
         vespa_app - vespa app connection
         schema_name - schema name in vespa
+        checkpoint - FeedCheckpoint (optional, resume + a checkpoint per batch)
+        dead_letter - DeadLetterWriter for documents that failed after all retries (optional)
+        metrics - FeedMetrics (optional, document results only)
+    Output:
+        (n_ok, n_failed)
     """
     
-    data_list = convert_df_to_vespa_dictlist(data, id_field)
+    start_position = checkpoint.start_position if checkpoint else 0
+    if start_position:
+        print("Resume feed from checkpoint: skip {} records.".format(start_position))
     
-    response = vespa_app.feed_batch(data_list, schema = schema_name, connections=settings.num_connections, 
-                                    batch_size = settings.batch_size, total_timeout = settings.timeout)
-    return response
+    documents = iter_vespa_documents(data.iloc[start_position:], id_field, settings.nan_fill_value, settings.feed_conversion_chunk_size)
+    
+    n_ok, n_failed = 0, 0
+    index = start_position
+    for batch in iter_batches(documents, settings.batch_size):
+        results = feed_batch_with_retry(batch, vespa_app, schema_name, settings, metrics)
+        
+        for document, (status, body, attempts) in zip(batch, results):
+            failed = status != 200
+            if failed:
+                n_failed += 1
+                print("Error: {} {} for document {} after {} attempts. Skip this example.".format(status, body, document['id'], attempts))
+                if dead_letter:
+                    dead_letter.write({'op': 'put', 'id': document['id'], 'fields': document['fields']}, status, body, attempts)
+            else:
+                n_ok += 1
+            if checkpoint:
+                checkpoint.mark_done(index, failed)
+            index += 1
+        
+        #low watermark after each batch
+        if checkpoint:
+            checkpoint.save()
+        print("Have processed {} records.".format(index))
+    
+    if dead_letter:
+        dead_letter.close()
+    print("In total processed {} records ({} failed).".format(n_ok + n_failed, n_failed))
+    return n_ok, n_failed
 
 
 def feed_data_by_df(data, id_field, vespa_app, schema_name, settings):
@@ -86,7 +174,47 @@ def feed_data_by_df(data, id_field, vespa_app, schema_name, settings):
     return response
 
     
-def feed_data_by_point(data, id_field, vespa_app, schema_name, settings):
+def feed_data_point_with_retry(temp_data, id_field, vespa_app, schema_name, settings, metrics=None):
+    """
+    feed a data point, retrying transient failures (timeout/connection error, 429, 5xx)
+    with jittered exponential backoff
+    
+    Input:
+        metrics - FeedMetrics (optional)
+    Output:
+        status - HTTP status (None if the request failed)
+        body - response json (or error message)
+        attempts - number of attempts
+    """
+    
+    n_bytes = len(json.dumps({'fields': temp_data}, default=provider_data_async_feed.json_default)) if metrics else 0
+    
+    attempt = 0
+    while True:
+        start_time = time.perf_counter()
+        try:
+            response = vespa_app.feed_data_point(schema = schema_name,
+                                                 data_id = temp_data[id_field], 
+                                                 fields = temp_data)
+            status, body = response.status_code, response.json
+        except OSError as e: #connection errors and timeouts
+            status, body = None, str(e)
+        
+        if metrics:
+            metrics.observe('put', status, time.perf_counter() - start_time, n_bytes)
+        
+        if status == 200 or not feed_recovery.is_retryable(status) or attempt >= settings.max_retries:
+            if metrics:
+                metrics.on_done('put', status)
+            return status, body, attempt + 1
+        
+        attempt += 1
+        if metrics:
+            metrics.on_retry(status)
+        time.sleep(feed_recovery.backoff_delay(attempt, settings.retry_backoff_base, settings.retry_backoff_max))
+
+
+def feed_data_by_point(data, id_field, vespa_app, schema_name, settings, checkpoint=None, dead_letter=None, metrics=None):
     """
     feed point-by-point
     
@@ -95,32 +223,169 @@ def feed_data_by_point(data, id_field, vespa_app, schema_name, settings):
         id_field - the id_field
         vespa_app - vespa app connection
         schema_name - schema name in vespa
-        debug - display feed information
+        checkpoint - FeedCheckpoint (optional, resume + periodic checkpoints)
+        dead_letter - DeadLetterWriter for documents that failed after all retries (optional)
+        metrics - FeedMetrics (optional)
     """
     
     debug = settings.data_feed_debug
+    start_position = checkpoint.start_position if checkpoint else 0
+    if start_position:
+        print("Resume feed from checkpoint: skip {} records.".format(start_position))
     
     count_example = 0
-    for idx, row in data.iterrows():
-        temp_data = dict(row)
-        response = vespa_app.feed_data_point(schema = schema_name,
-                                             data_id = temp_data[id_field], 
-                                             fields = temp_data)
-    
-        if len(response.json) < 1:
-            print("Error: {}. Skip this example.".format(response.json))
+    rows = iter_vespa_rows(data.iloc[start_position:], settings.nan_fill_value, settings.feed_conversion_chunk_size)
+    for index, temp_data in enumerate(rows, start_position):
+        status, body, attempts = feed_data_point_with_retry(temp_data, id_field, vespa_app, schema_name, settings, metrics)
+        failed = status != 200 or len(body) < 1
+    
+        if failed:
+            print("Error: {} {} after {} attempts. Skip this example.".format(status, body, attempts))
+            if dead_letter:
+                dead_letter.write({'op': 'put', 'id': temp_data[id_field], 'fields': temp_data}, status, body, attempts)
 #            input("Type any key to continue...")
         elif debug:
-            print("Feed doc: {}".format(response.json))
+            print("Feed doc: {}".format(body))
         else:  
             count_example +=1
         
             if count_example%settings.num_dispay == 0:
                 print("Have processed {} records.".format(count_example))
+        
+        if checkpoint:
+            checkpoint.mark_done(index, failed)
             
+    if checkpoint:
+        checkpoint.save()
+    if dead_letter:
+        dead_letter.close()
     print("In total processed {} records.".format(count_example))
 
 
+def feed_data_by_async(data, id_field, schema_name, settings, remove_ids=(), checkpoint=None, dead_letter=None, metrics=None):
+    """
+    asyncio feed to /document/v1 with a bounded number of in-flight operations
+    
+    Input:
+        data - data frame with all required fields
+        id_field - the id_field
+        schema_name - schema name in vespa
+        remove_ids - document ids to remove after the puts (delta feed)
+        checkpoint - FeedCheckpoint (optional, resume + periodic checkpoints)
+        dead_letter - DeadLetterWriter for operations that failed after all retries (optional)
+        metrics - FeedMetrics (optional)
+    """
+    
+    operations = provider_data_async_feed.iter_put_operations(data, id_field, settings.nan_fill_value, 
+                                                              settings.feed_conversion_chunk_size)
+    operations = itertools.chain(operations, provider_data_async_feed.iter_remove_operations(remove_ids))
+    return provider_data_async_feed.feed_operations(operations, schema_name, settings, 
+                                                    checkpoint=checkpoint, dead_letter=dead_letter, metrics=metrics)
+
+
+def feed_data_by_async_update(data, filename, id_field, schema_name, settings, remove_ids=(), checkpoint=None, dead_letter=None, metrics=None):
+    """
+    asyncio delta feed with partial updates: new documents are put, changed documents are
+    updated with their changed fields/map entries against the previous snapshot
+    
+    Input:
+        data - data frame of the new/changed documents
+        filename - data file name (.pkl name, the previous snapshot is next to it)
+        id_field - the id_field
+        schema_name - schema name in vespa
+        remove_ids - document ids to remove after the updates
+        checkpoint - FeedCheckpoint (optional, resume + periodic checkpoints)
+        dead_letter - DeadLetterWriter for operations that failed after all retries (optional)
+        metrics - FeedMetrics (optional)
+    """
+    
+    previous = provider_data_store.load_previous(filename, settings)
+    if previous is None:
+        print("No previous snapshot: changed documents are fed as puts.")
+    
+    operations = feed_partial_update.iter_update_operations(data, previous, id_field, settings.nan_fill_value, 
+                                                            settings.feed_conversion_chunk_size)
+    operations = itertools.chain(operations, provider_data_async_feed.iter_remove_operations(remove_ids))
+    return provider_data_async_feed.feed_operations(operations, schema_name, settings, 
+                                                    checkpoint=checkpoint, dead_letter=dead_letter, metrics=metrics)
+
+
+def feed_data_by_replay(filename, schema_name, settings, metrics=None):
+    """
+    replay the exported JSONL shards of a data file with the asyncio feed
+    (see provider_data_export.replay_shards)
+    
+    Input:
+        filename - data file name (.pkl name, the export directory is next to it)
+        schema_name - schema name in vespa
+        metrics - FeedMetrics (optional)
+    """
+    
+    return provider_data_export.replay_shards(filename, schema_name, settings, metrics=metrics)
+
+
+def create_feed_recovery(filename, settings):
+    """
+    feed checkpoint and dead-letter writer of a data file (see feed_recovery)
+    
+    Input:
+        filename - data file name (.pkl name, as in the settings)
+    Output:
+        checkpoint - FeedCheckpoint (valid until the data file is re-extracted)
+        dead_letter - DeadLetterWriter
+    """
+    
+    source = provider_data_store.data_filename(filename, settings)
+    if os.path.isdir(source):
+        source = os.path.join(source, provider_data_store.META_FILE) #columnar: the meta file is written last
+    
+    checkpoint = feed_recovery.FeedCheckpoint(feed_recovery.checkpoint_filename(filename), feed_recovery.file_signature(source), 
+                                              settings.checkpoint_interval, settings.resume_feed)
+    dead_letter = feed_recovery.DeadLetterWriter(feed_recovery.dead_letter_filename(filename))
+    return checkpoint, dead_letter
+
+
+def count_failed(responses):
+    """
+    number of failed pyvespa responses
+    """
+    return sum(response.status_code != 200 for response in responses or ())
+
+
+def commit_delta_feed(filename, settings, n_failed):
+    """
+    commit point of a delta feed: after a file is fed without failed documents, its pending
+    manifest becomes the fed manifest (see provider_data_manifest) and, for partial updates, the
+    data becomes the previous snapshot; with failed documents the next extraction is still compared
+    with the last fed manifest/snapshot, so they are fed again
+    """
+    if not settings.delta_mode:
+        return
+    if n_failed:
+        print("Delta feed of {} has {} failed documents: the manifest is not committed.".format(filename, n_failed))
+        return
+    provider_data_manifest.commit_manifest(filename)
+    if settings.partial_update:
+        provider_data_store.keep_previous(filename, settings)
+
+
+def remove_data_by_batch(data_ids, vespa_app, schema_name, settings):
+    """
+    batch remove documents
+    
+    Input:
+        data_ids - document ids to remove
+        vespa_app - vespa app connection
+        schema_name - schema name in vespa
+    """
+    
+    batch = [{'id': data_id} for data_id in data_ids]
+    
+    response = vespa_app.delete_batch(batch, schema = schema_name, connections=settings.num_connections, 
+                                      total_timeout = settings.timeout)
+    return response
+
+
 def main_process(settings):
     #configuration
     indir = settings.local_outdir
@@ -136,37 +401,93 @@ def main_process(settings):
     
     id_field = settings.key_id_field
     data_feed_flag = settings.data_feed_flag
+    partial_update = settings.delta_mode and settings.partial_update
+    
+    if partial_update and data_feed_flag != 4:
+        print("Partial updates need the asyncio feed (data_feed_flag 4): changed documents are fed as puts.")
 
     if data_feed_flag > 0:
         #data feed from the processed data file
         start_time = time.time()
         vespa_app = Vespa(url = settings.vespa_url_local) #connect to local host
+        
+        #run metrics (per file summaries are the differences of snapshots)
+        metrics = feed_metrics.FeedMetrics()
+        reporter = feed_metrics.create_reporter(metrics, settings)
     
         for findex in file_indices:
             file_st = time.time()
+            file_snapshot = metrics.snapshot()
             filename = indir + filenames[findex]
             print("Feed data from file: {}".format(filename))
             
-            data = pd.read_pickle(filename)
-            data = data.fillna(999999) #can not process NaN 
+            if data_feed_flag == 5:
+                #replay exported feed files
+                feed_data_by_replay(filename, schema_name, settings, metrics)
+                feed_metrics.print_summary("File summary", feed_metrics.summarize(metrics.snapshot(), file_snapshot))
+                print("File process time: {} secs.".format(time.time()-file_st))
+                continue
+            
+            checkpoint, dead_letter = None, None
+            if data_feed_flag in (1, 2, 4):
+                #resumable feed paths
+                checkpoint, dead_letter = create_feed_recovery(filename, settings)
+                if checkpoint.complete:
+                    print("File already fed (see {}). Skip this file.".format(checkpoint.filename))
+                    continue
+            
+            data = provider_data_store.load_data(filename, settings)
             
+            if settings.delta_mode:
+                #only new/changed documents are fed
+                delta = provider_data_manifest.load_delta(filename)
+                data = data[data[id_field].isin(set(delta['new']) | set(delta['changed']))]
+                print("Delta feed: {} new, {} changed, {} removed documents.".format(
+                    len(delta['new']), len(delta['changed']), len(delta['removed'])))
+                
+            #NaN is replaced per field during the document conversion (no copy of the frame)
             
+            n_failed = 0
             if data_feed_flag == 1:
                 #batch feed
-                responses = feed_data_by_batch(data, id_field, vespa_app, schema_name, settings)
+                feed_data_by_batch(data, id_field, vespa_app, schema_name, settings, checkpoint, dead_letter, metrics)
             elif data_feed_flag == 2:
                 #feed by data point
-                feed_data_by_point(data, id_field, vespa_app, schema_name, settings)
+                feed_data_by_point(data, id_field, vespa_app, schema_name, settings, checkpoint, dead_letter, metrics)
             elif data_feed_flag == 3:
                 #batch feed
+                data = data.fillna(settings.nan_fill_value) #can not process NaN 
                 responses = feed_data_by_df(data, id_field, vespa_app, schema_name, settings)
+                n_failed = count_failed(responses)
+            elif data_feed_flag == 4:
+                #asyncio feed (delta removes are fed as remove operations)
+                remove_ids = delta['removed'] if settings.delta_mode else ()
+                if partial_update:
+                    feed_data_by_async_update(data, filename, id_field, schema_name, settings, remove_ids, checkpoint, dead_letter, metrics)
+                else:
+                    feed_data_by_async(data, id_field, schema_name, settings, remove_ids, checkpoint, dead_letter, metrics)
             else:
                 sys.exit("Unknown data feed flag: {}. Stop.".format(data_feed_flag))
             
+            if settings.delta_mode and delta['removed'] and data_feed_flag != 4:
+                #remove documents that disappeared since the previous extraction
+                n_failed += count_failed(remove_data_by_batch(delta['removed'], vespa_app, schema_name, settings))
+            
+            if checkpoint:
+                #failed operations of the checkpointed feed (the delta removes of flags 1 and 2 are counted above)
+                n_failed += checkpoint.failed
+            commit_delta_feed(filename, settings, n_failed)
+            if checkpoint:
+                checkpoint.save(complete=True)
+            
             
+            feed_metrics.print_summary("File summary", feed_metrics.summarize(metrics.snapshot(), file_snapshot))
             file_et = time.time()
             print("File process time: {} secs.".format(file_et-file_st))
             
+        reporter.stop()
+        feed_metrics.print_summary("Run summary", feed_metrics.summarize(metrics.snapshot()))
+        result_cache.notify_data_changed(schema_name, version_dir=settings.cache_version_dir)
         end_time = time.time()
         print("Execution time: {} secs.".format(end_time-start_time))
     
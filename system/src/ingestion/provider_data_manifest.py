@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - document manifest
+keep a manifest (generated_key -> hash of the normalized document) per extracted file,
+so a delta run only feeds new/changed documents and removes the disappeared ones
+
+files next to each output file (e.g., organization_sample_data.pkl):
+    organization_sample_data_manifest.json - manifest of the last fed extraction
+    organization_sample_data_manifest_pending.json - manifest of the latest extraction (not fed yet)
+    organization_sample_data_delta.json - new/changed/removed keys against the last fed manifest
+
+the pending manifest replaces the fed manifest (and the delta is cleared) only after the feed of the
+file completed without failed documents (commit_manifest); until then every extraction is compared
+with the last fed manifest, so the delta of an extraction that was not (completely) fed is kept
+
+v0.1 - manifest and delta for incremental extraction/feed
+v0.2 - the manifest is committed after a complete feed (pending manifest until then)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, json, hashlib
+
+
+def manifest_filename(filename):
+    """
+    manifest file name of an output file (e.g., x.pkl -> x_manifest.json)
+    """
+    return os.path.splitext(filename)[0] + "_manifest.json"
+
+
+def pending_manifest_filename(filename):
+    """
+    pending manifest file name of an output file (e.g., x.pkl -> x_manifest_pending.json)
+    """
+    return os.path.splitext(filename)[0] + "_manifest_pending.json"
+
+
+def delta_filename(filename):
+    """
+    delta file name of an output file (e.g., x.pkl -> x_delta.json)
+    """
+    return os.path.splitext(filename)[0] + "_delta.json"
+
+
+def document_hash(fields):
+    """
+    hash of a normalized document (keys and map entries sorted, compact json)
+
+    Input:
+        fields - document fields (dict)
+    Output:
+        hex digest (str)
+    """
+    content = json.dumps(fields, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(content.encode('utf8'), digest_size=16).hexdigest()
+
+
+def build_manifest(df, id_field):
+    """
+    manifest of an extracted data frame
+
+    Input:
+        df - extracted data frame
+        id_field - document id field
+    Output:
+        manifest - (dict) document id -> document hash
+    """
+    columns = list(df.columns)
+    id_index = columns.index(id_field)
+    manifest = dict()
+
+    for row in zip(*[df[x].tolist() for x in columns]):
+        manifest[row[id_index]] = document_hash(dict(zip(columns, row)))
+
+    return manifest
+
+
+def compute_delta(old_manifest, new_manifest):
+    """
+    compare two manifests
+
+    Output:
+        delta - (dict) new, changed and removed document ids
+    """
+    new_keys = []
+    changed_keys = []
+
+    for key, doc_hash in new_manifest.items():
+        old_hash = old_manifest.get(key)
+        if old_hash is None:
+            new_keys.append(key)
+        elif old_hash != doc_hash:
+            changed_keys.append(key)
+
+    removed_keys = [key for key in old_manifest if key not in new_manifest]
+
+    return {'new': new_keys, 'changed': changed_keys, 'removed': removed_keys}
+
+
+def load_manifest(filename):
+    """
+    load the fed manifest of an output file (empty if no extraction was fed)
+    """
+    infilename = manifest_filename(filename)
+
+    if not os.path.exists(infilename):
+        return dict()
+
+    with open(infilename, 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def _write_json(data, outfilename):
+    #write to a temp file first so an interrupted run keeps the previous file
+    tempfilename = outfilename + ".tmp"
+    with open(tempfilename, 'w', encoding='utf8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tempfilename, outfilename)
+
+
+def update_manifest(df, filename, settings):
+    """
+    compute the delta of an extracted data frame against the fed manifest,
+    then save the delta and the new manifest as the pending manifest
+
+    Input:
+        df - extracted data frame
+        filename - output file name
+    Output:
+        delta - (dict) new, changed and removed document ids
+    """
+    old_manifest = load_manifest(filename)
+    new_manifest = build_manifest(df, settings.key_id_field) if len(df) else dict()
+    delta = compute_delta(old_manifest, new_manifest)
+
+    _write_json(delta, delta_filename(filename))
+    _write_json(new_manifest, pending_manifest_filename(filename))
+
+    print("Delta against the last fed extraction: {} new, {} changed, {} removed.".format(
+        len(delta['new']), len(delta['changed']), len(delta['removed'])))
+
+    return delta
+
+
+def commit_manifest(filename):
+    """
+    after a complete feed of an output file: the pending manifest becomes the fed manifest
+    and the delta is cleared
+    Output:
+        True if a pending manifest was committed
+    """
+    pending = pending_manifest_filename(filename)
+    if not os.path.exists(pending):
+        return False
+
+    os.replace(pending, manifest_filename(filename))
+    if os.path.exists(delta_filename(filename)):
+        os.remove(delta_filename(filename))
+    return True
+
+
+def load_delta(filename):
+    """
+    load the delta of an output file (empty if the last extraction is fed)
+
+    Output:
+        delta - (dict) new, changed and removed document ids
+    """
+    if not os.path.exists(delta_filename(filename)):
+        return {'new': [], 'changed': [], 'removed': []}
+
+    with open(delta_filename(filename), 'r', encoding='utf8') as f:
+        return json.load(f)
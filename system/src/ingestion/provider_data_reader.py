@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - raw data reader
+incrementally read provider records from the top-level json array of a provider export,
+so peak memory depends on the largest record rather than the file size
+
+v0.1 - streaming reader for clean_data_with_all_processes
+v0.2 - reject a trailing comma before the closing bracket (as json.load); numbers split across chunks
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import json
+
+_WHITESPACE = " \t\n\r"
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+
+def _skip_whitespace(buffer, pos):
+    """
+    move the position to the next non-whitespace character
+    """
+    n = len(buffer)
+    while pos < n and buffer[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def iter_json_array(f, chunk_size=1 << 20):
+    """
+    yield the elements of a top-level json array one at a time
+
+    Input:
+        f - text file handle positioned at the start of the json document
+        chunk_size - number of characters read per chunk
+    Output:
+        generator of decoded elements (dict for provider records)
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    read_size = chunk_size
+
+    def fill(buffer, pos):
+        #drop consumed text and append the next chunk
+        chunk = f.read(read_size)
+        return buffer[pos:] + chunk, 0, not chunk
+
+    #find the opening bracket
+    while True:
+        pos = _skip_whitespace(buffer, pos)
+        if pos < len(buffer) or eof:
+            break
+        buffer, pos, eof = fill(buffer, pos)
+
+    if pos >= len(buffer) or buffer[pos] != '[':
+        raise ValueError("Expect a top-level json array in the provider data file.")
+    pos += 1
+    expect_value = True #no separator needed before the first element
+    after_comma = False #an element must follow a separator
+
+    while True:
+        pos = _skip_whitespace(buffer, pos)
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of file inside the top-level json array.")
+            buffer, pos, eof = fill(buffer, pos)
+            continue
+
+        char = buffer[pos]
+        if char == ']':
+            if after_comma:
+                raise ValueError("Unexpected ']' after ',' in the top-level json array.")
+            return
+        if not expect_value:
+            if char != ',':
+                raise ValueError("Expect ',' or ']' between json array elements, found '{}'.".format(char))
+            pos += 1
+            expect_value = after_comma = True
+            continue
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            element, end = None, None
+
+        #an element ending at the buffer boundary (e.g. a number, also "2." of "2.5") may still be incomplete
+        tail = end
+        while tail is not None and tail < len(buffer) and buffer[tail] in _NUMBER_CHARS:
+            tail += 1
+        if end is None or (tail >= len(buffer) and not eof):
+            if eof:
+                raise ValueError("Malformed json element at character {} of the current chunk.".format(pos))
+            buffer, pos, eof = fill(buffer, pos)
+            read_size = min(2*read_size, 1 << 28) #grow the chunk for large records
+            continue
+
+        read_size = chunk_size
+        pos = end
+        expect_value = after_comma = False
+
+        #keep the buffer bounded by the current record
+        if pos > chunk_size:
+            buffer, pos = buffer[pos:], 0
+
+        yield element
+
+
+def iter_provider_records(filename, settings=None):
+    """
+    yield provider records from a provider export file
+
+    Input:
+        filename - input file name (json array of provider records)
+        settings - configuration (json_read_chunk_size)
+    Output:
+        generator of provider records (dict)
+    """
+
+    chunk_size = getattr(settings, 'json_read_chunk_size', 1 << 20)
+
+    with open(filename, 'r', encoding='utf8') as f:
+        for record in iter_json_array(f, chunk_size):
+            yield record
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Provider data ingestion - extracted data store
+save/load the extracted data frame as a pickle file or as a columnar directory
+(one numpy array per column; string/json columns as utf8 bytes plus offsets)
+
+the columnar format is memory-mapped on load, so consumers read only the columns
+and rows they use (column projection + row selection)
+
+v0.1 - pickle and columnar formats
+v0.2 - keep the previous snapshot for partial update feeds
+v0.3 - the previous snapshot is the last fed data (copied after a complete feed)
+v0.4 - the columnar directory is written next to the output and swapped in when complete
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, json, shutil
+import numpy as np
+import pandas as pd
+
+META_FILE = "meta.json"
+
+
+def data_filename(filename, settings):
+    """
+    data file name for the configured output format
+    Note: the configured output names end with .pkl; the columnar format uses a .cols directory
+    """
+    if settings.output_format == "columnar":
+        return os.path.splitext(filename)[0] + ".cols"
+    elif settings.output_format == "pickle":
+        return filename
+    else:
+        raise ValueError("Unknown output format: {}".format(settings.output_format))
+
+
+def _column_kind(series):
+    """
+    storage kind of a column: numeric, string or json
+    """
+    if series.dtype.kind in "biuf":
+        return "numeric"
+
+    values = series.tolist()
+    if all(isinstance(x, str) for x in values):
+        return "string"
+    return "json"
+
+
+def _encode_strings(values):
+    """
+    encode strings as one utf8 byte array plus offsets (n+1)
+    """
+    encoded = [x.encode('utf8') for x in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+def _remove(filename):
+    #remove a data file or columnar directory (if any)
+    if os.path.isdir(filename):
+        shutil.rmtree(filename)
+    elif os.path.exists(filename):
+        os.remove(filename)
+
+
+def save_columnar(df, dirname):
+    """
+    save a data frame as a columnar directory
+    (written to dirname.tmp and swapped in, so a reader never sees a partial or mixed directory
+    and memory-mapped files of the old directory are not truncated)
+
+    Input:
+        df - data frame
+        dirname - output directory
+    """
+
+    outdirname = dirname
+    dirname = outdirname + ".tmp"
+    _remove(dirname)
+    os.makedirs(dirname)
+    columns = []
+
+    for name in df.columns:
+        series = df[name]
+        kind = _column_kind(series)
+
+        if kind == "numeric":
+            np.save(os.path.join(dirname, name + ".npy"), series.to_numpy())
+        else:
+            values = series.tolist()
+            if kind == "json":
+                values = [json.dumps(x, separators=(',', ':')) for x in values]
+            data, offsets = _encode_strings(values)
+            np.save(os.path.join(dirname, name + ".data.npy"), data)
+            np.save(os.path.join(dirname, name + ".offsets.npy"), offsets)
+
+        columns.append({'name': name, 'kind': kind})
+
+    #meta file is written last (marks a complete directory)
+    with open(os.path.join(dirname, META_FILE), 'w', encoding='utf8') as f:
+        json.dump({'n_rows': len(df), 'columns': columns}, f)
+
+    _remove(outdirname)
+    os.replace(dirname, outdirname)
+
+
+class StringColumn:
+    """
+    memory-mapped string/json column (utf8 bytes plus offsets); values are decoded on access
+    """
+
+    def __init__(self, data, offsets, kind):
+        self.data = data
+        self.offsets = offsets
+        self.kind = kind
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _decode(self, start, end):
+        value = bytes(self.data[start:end]).decode('utf8')
+        return json.loads(value) if self.kind == "json" else value
+
+    def __getitem__(self, n):
+        return self._decode(self.offsets[n], self.offsets[n+1])
+
+    def take(self, indices):
+        """
+        decode the values of the selected rows
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices].tolist()
+        ends = self.offsets[indices + 1].tolist()
+        return [self._decode(start, end) for start, end in zip(starts, ends)]
+
+    def tolist(self):
+        return self.take(np.arange(len(self)))
+
+
+class ColumnarTable:
+    """
+    memory-mapped view of a columnar directory
+
+    Input:
+        dirname - columnar directory
+        mmap - memory-map the column files (otherwise load them in memory)
+    """
+
+    def __init__(self, dirname, mmap=True):
+        with open(os.path.join(dirname, META_FILE), 'r', encoding='utf8') as f:
+            meta = json.load(f)
+
+        self.dirname = dirname
+        self.n_rows = meta['n_rows']
+        self.kinds = {x['name']: x['kind'] for x in meta['columns']}
+        self.columns = [x['name'] for x in meta['columns']]
+        self.mmap_mode = 'r' if mmap else None
+        self._cache = dict()
+
+    def __len__(self):
+        return self.n_rows
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.dirname, filename), mmap_mode=self.mmap_mode)
+
+    def column(self, name):
+        """
+        get a column (numpy array for numeric columns, StringColumn otherwise);
+        only the files of the requested column are opened
+        """
+        if name not in self._cache:
+            kind = self.kinds[name]
+            if kind == "numeric":
+                self._cache[name] = self._load(name + ".npy")
+            else:
+                self._cache[name] = StringColumn(self._load(name + ".data.npy"), self._load(name + ".offsets.npy"), kind)
+
+        return self._cache[name]
+
+    def take(self, indices, columns=None):
+        """
+        data frame with the selected rows and columns
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        columns = columns or self.columns
+        data = dict()
+
+        for name in columns:
+            column = self.column(name)
+            if isinstance(column, StringColumn):
+                data[name] = column.take(indices)
+            else:
+                data[name] = np.asarray(column[indices])
+
+        return pd.DataFrame(data, columns=columns)
+
+    def to_frame(self, columns=None):
+        """
+        data frame with all rows of the selected columns
+        """
+        return self.take(np.arange(self.n_rows), columns)
+
+
+def save_data(df, filename, settings):
+    """
+    save an extracted data frame in the configured output format
+
+    Input:
+        df - extracted data frame
+        filename - output file name (.pkl)
+    Output:
+        outfilename - name of the file/directory written
+    """
+    outfilename = data_filename(filename, settings)
+
+    if settings.output_format == "columnar":
+        save_columnar(df, outfilename)
+    else:
+        df.to_pickle(outfilename)
+
+    return outfilename
+
+
+def previous_filename(filename):
+    """
+    file name of the previous extraction snapshot (e.g., x.pkl -> x_previous.pkl)
+    """
+    base, ext = os.path.splitext(filename)
+    return base + "_previous" + ext
+
+
+def keep_previous(filename, settings):
+    """
+    copy the current data file to the previous snapshot after the file is completely fed,
+    so partial updates are computed against the data in vespa
+
+    Input:
+        filename - output file name (.pkl)
+    Output:
+        True if a previous snapshot was kept
+    """
+    current = data_filename(filename, settings)
+    previous = data_filename(previous_filename(filename), settings)
+
+    if not os.path.exists(current):
+        return False
+
+    #copy next to the snapshot, then swap it in
+    tempfilename = previous + ".tmp"
+    _remove(tempfilename)
+    if os.path.isdir(current):
+        shutil.copytree(current, tempfilename)
+    else:
+        shutil.copyfile(current, tempfilename)
+
+    _remove(previous)
+    os.replace(tempfilename, previous)
+    return True
+
+
+def load_previous(filename, settings):
+    """
+    load the previous extraction snapshot of a data file (None if there is no snapshot)
+    """
+    previous = previous_filename(filename)
+    if not os.path.exists(data_filename(previous, settings)):
+        return None
+
+    return load_data(previous, settings)
+
+
+def load_data(filename, settings, columns=None):
+    """
+    load an extracted data frame in the configured output format
+
+    Input:
+        filename - data file name (.pkl)
+        columns - column projection (None for all columns)
+    Output:
+        data - data frame
+    """
+    infilename = data_filename(filename, settings)
+
+    if settings.output_format == "columnar":
+        return ColumnarTable(infilename).to_frame(columns)
+
+    data = pd.read_pickle(infilename)
+    return data[columns] if columns else data
+
+
+def sample_data(filename, settings, n_samples, columns=None, rng=np.random):
+    """
+    load n_samples random rows (without replacement) of an extracted data frame;
+    with the columnar format only the selected rows of the projected columns are read
+
+    Input:
+        filename - data file name (.pkl)
+        n_samples - number of rows
+        columns - column projection (None for all columns)
+        rng - random generator (np.random or np.random.Generator)
+    Output:
+        data - data frame of the sampled rows
+    """
+    infilename = data_filename(filename, settings)
+
+    if settings.output_format == "columnar":
+        table = ColumnarTable(infilename)
+        selected_indices = rng.permutation(len(table))[:n_samples]
+        return table.take(selected_indices, columns)
+
+    data = pd.read_pickle(infilename)
+    selected_indices = rng.permutation(len(data))[:n_samples]
+    data = data.iloc[selected_indices]
+    return data[columns] if columns else data
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+Search - embedded search engine
+in-memory (python/numpy) search over an extracted data frame for offline relevance checks, fast tests
+and a degraded-mode fallback; it answers the query shapes of query_builder with the rank profiles of
+the schema file (see schema_profiles):
+
+    matching - userQuery (all terms) over the default fieldset, geoLocation radius filter (grid index
+               over geocode) and sameElement contract filters (map key with an expire date > value)
+    ranking - first-phase expression of the rank profile with vespa's bm25 (k1=1.2, b=0.75, idf and
+              average field length over the indexed documents) and distance(geocode)
+    result - search_client.SearchResponse with the generated_key, relevance and summary features
+
+differences to vespa: tokens are lowercased words with accents removed (no stemming), the statistics
+are global (vespa computes them per content node) and ties are broken by document order
+
+usage (from the system directory):
+    python -m src.search.embedded_engine data.pkl --schema organization --queryfile ../query/sample_query_organization.txt
+        [--vespa-url http://localhost:8080 --k 10]   (top-k agreement with a running vespa)
+
+v0.1 - bm25/geo engine with the schema rank profiles, top-k agreement with vespa
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import re, sys, time, argparse, unicodedata
+import numpy as np
+import pandas as pd
+from collections import Counter, defaultdict
+from .schema_profiles import RankExpression, load_schema, KM_PER_DEGREE
+from .search_client import Hit, SearchResponse, create_search_client
+from .result_cache import query_params, SOURCES
+
+TOKEN = re.compile(r"\w+")
+GEO_LOCATION = re.compile(r'geoLocation\(\s*(\w+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*"\s*([\d.]+)\s*(\w+)\s*"\s*\)')
+SAME_ELEMENT = re.compile(r'(\w+)\s+contains\s+sameElement\(\s*key\s+contains\s+"([^"]*)"\s*,\s*value\s*>\s*(-?\d+)\s*\)')
+DISTANCE_UNITS = {'m': 0.001, 'km': 1.0, 'mi': 1.609344, 'mile': 1.609344, 'miles': 1.609344}
+NO_POSITION_DEGREES = 6400.0 #distance of a document (or a query) without a position (vespa: 6400000000 micro-degrees)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """
+    index/query tokens of a text (lowercased words, accents removed)
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text.lower())
+    return TOKEN.findall("".join(x for x in text if not unicodedata.combining(x)))
+
+
+def is_map_column(column):
+    """
+    whether a data frame column holds map fields (dict values)
+    """
+    return any(isinstance(x, dict) for x in column.head(100))
+
+
+#few candidates in a long posting are looked up by binary search, otherwise the posting is
+#scattered into a dense array of n_docs
+def _lookup(docs, values, candidates, n_docs):
+    #values of sorted docs at the candidate docs (0 where a candidate is not in docs)
+    if not len(docs) or not len(candidates):
+        return np.zeros(len(candidates), dtype=values.dtype)
+    if len(candidates)*16 < len(docs):
+        pos = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+        return np.where(docs[pos] == candidates, values[pos], np.zeros(1, dtype=values.dtype))
+
+    dense = np.zeros(n_docs, dtype=values.dtype)
+    dense[docs] = values
+    return dense[candidates]
+
+
+def _contains(docs, candidates, n_docs):
+    #bool mask of the candidates in docs (sorted for the binary search)
+    if not len(docs) or not len(candidates):
+        return np.zeros(len(candidates), dtype=bool)
+    if len(candidates)*16 < len(docs):
+        return docs[np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)] == candidates
+
+    dense = np.zeros(n_docs, dtype=bool)
+    dense[docs] = True
+    return dense[candidates]
+
+
+def _as_array(value, size):
+    #rank expression value (a constant or an array) as an array of size values
+    return np.full(size, value, dtype=float) if np.ndim(value) == 0 else value
+
+
+class FieldIndex:
+    """
+    inverted index of a text field: term -> (sorted doc ids, bm25 contributions), field lengths
+
+    the bm25 contribution of a term to a document does not depend on the query, so it is computed
+    once per posting: idf*tf*(k1 + 1)/(tf + k1*(1 - b + b*field length/average field length))
+    """
+
+    def __init__(self, values):
+        #tokenize each distinct value once
+        codes, uniques = pd.factorize(pd.Series(values).fillna("").astype(str))
+        order = np.argsort(codes, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+
+        value_lengths = np.zeros(len(uniques), dtype=np.float32)
+        entries = defaultdict(list) #term -> [(value index, tf)]
+        for n, value in enumerate(uniques):
+            counts = Counter(tokenize(value))
+            value_lengths[n] = sum(counts.values())
+            for term, tf in counts.items():
+                entries[term].append((n, tf))
+
+        self.n_docs = len(codes)
+        self.lengths = value_lengths[codes] if len(codes) else np.zeros(0, dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if self.n_docs and self.lengths.mean() > 0 else 1.0
+        self.postings = dict()
+
+        norm = BM25_K1*(1 - BM25_B + BM25_B*self.lengths/self.avg_length)
+        for term, values in entries.items():
+            docs = np.concatenate([order[bounds[n]:bounds[n + 1]] for n, _ in values])
+            tfs = np.repeat(np.array([tf for _, tf in values], dtype=np.float32),
+                            [bounds[n + 1] - bounds[n] for n, _ in values])
+            sort = np.argsort(docs, kind='stable')
+            docs, tfs = docs[sort], tfs[sort]
+            idf = np.log(1 + (self.n_docs - len(docs) + 0.5)/(len(docs) + 0.5))
+            self.postings[term] = (docs, (idf*tfs*(BM25_K1 + 1)/(tfs + norm[docs])).astype(np.float32))
+
+    def bm25(self, terms, candidates):
+        """
+        vespa bm25 of the candidate docs for the query terms (a repeated term counts again)
+        """
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                scores += _lookup(posting[0], posting[1], candidates, self.n_docs)
+        return scores
+
+
+class GeoIndex:
+    """
+    grid index of the document positions (cells of grid_size degrees; docs of a cell row are contiguous)
+    """
+
+    def __init__(self, positions, grid_size=0.5):
+        lat = np.array([x.get('lat', np.nan) if isinstance(x, dict) else np.nan for x in positions], dtype=float)
+        lng = np.array([x.get('lng', np.nan) if isinstance(x, dict) else np.nan for x in positions], dtype=float)
+        self.lat, self.lng = lat, lng
+        self.grid_size = grid_size
+        self.n_cols = int(np.ceil(360/grid_size)) + 1
+
+        valid = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lng))
+        cells = self._cell(lat[valid], lng[valid])
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        self.docs = valid[order].astype(np.int32)
+
+    def _cell(self, lat, lng):
+        rows = np.floor((np.asarray(lat) + 90)/self.grid_size).astype(np.int64)
+        cols = np.floor((np.asarray(lng) + 180)/self.grid_size).astype(np.int64)
+        return rows*self.n_cols + cols
+
+    def _ranges(self, lat, lng, radius_degrees):
+        #doc ranges (start, end) of the cells covering the bounding box of the radius
+        lng_radius = min(180.0, radius_degrees/max(np.cos(np.radians(lat)), 1e-6))
+        first_row, last_row = [int(np.floor((x + 90)/self.grid_size)) for x in (lat - radius_degrees, lat + radius_degrees)]
+        first_col, last_col = [int(np.floor((x + 180)/self.grid_size)) for x in (lng - lng_radius, lng + lng_radius)]
+        first_col, last_col = max(first_col, 0), min(last_col, self.n_cols - 1)
+
+        starts = np.searchsorted(self.cells, [row*self.n_cols + first_col for row in range(first_row, last_row + 1)])
+        ends = np.searchsorted(self.cells, [row*self.n_cols + last_col for row in range(first_row, last_row + 1)], side='right')
+        return starts, ends
+
+    def estimate(self, lat, lng, radius_degrees):
+        """
+        number of docs in the cells of a radius (the cost of a grid lookup)
+        """
+        starts, ends = self._ranges(lat, lng, radius_degrees)
+        return int((ends - starts).sum())
+
+    def within(self, lat, lng, radius_degrees):
+        """
+        doc ids in the cells of a radius (unsorted candidates; filter with distance)
+        """
+        starts, ends = self._ranges(lat, lng, radius_degrees)
+        return np.concatenate([self.docs[s:e] for s, e in zip(starts, ends)] or [np.zeros(0, np.int32)])
+
+    def distance(self, lat, lng, candidates):
+        """
+        vespa distance (in degrees) of the candidate docs: euclidean with longitude scaled by
+        cos(query latitude), NO_POSITION_DEGREES without a position
+        """
+        dlat = self.lat[candidates] - lat
+        dlng = (self.lng[candidates] - lng)*np.cos(np.radians(lat))
+        distance = np.sqrt(dlat*dlat + dlng*dlng)
+        distance[np.isnan(distance)] = NO_POSITION_DEGREES
+        return distance
+
+
+class MapIndex:
+    """
+    attribute index of a map<string,int> field: key -> (sorted doc ids, values)
+    """
+
+    def __init__(self, entries):
+        keys = defaultdict(list)
+        for doc, values in enumerate(entries):
+            if isinstance(values, dict):
+                for key, value in values.items():
+                    keys[key].append((doc, value))
+        self.keys = {key: (np.array([x[0] for x in pairs], dtype=np.int32), np.array([x[1] for x in pairs], dtype=np.int64))
+                     for key, pairs in keys.items()}
+
+    def filter(self, candidates, key, min_value, n_docs):
+        """
+        candidates with the key and a value > min_value (sameElement(key contains "key", value>min_value))
+        """
+        docs, values = self.keys.get(key, (np.zeros(0, np.int32), np.zeros(0, np.int64)))
+        if not len(docs) or not len(candidates):
+            return candidates[:0]
+        if len(candidates)*16 < len(docs):
+            pos = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+            return candidates[(docs[pos] == candidates) & (values[pos] > min_value)]
+        return candidates[_contains(docs[values > min_value], candidates, n_docs)]
+
+
+class EmbeddedSearchEngine:
+    """
+    embedded search engine of one schema
+
+    Input:
+        data - extracted data frame (one row per document)
+        schema_name - schema (document type) name
+        sd_file - schema file with the fieldsets and rank profiles
+        grid_size - cell size (in degrees) of the geo index
+    """
+
+    def __init__(self, data, schema_name, sd_file, grid_size=0.5):
+        self.schema_name = schema_name
+        self.fieldsets, self.profiles = load_schema(sd_file)
+        self.n_docs = len(data)
+        self.keys = data['generated_key'].astype(str).to_numpy()
+
+        text_fields = sorted(set(field for fields in self.fieldsets.values() for field in fields if field in data))
+        self.fields = {field: FieldIndex(data[field].tolist()) for field in text_fields}
+        self.geo = GeoIndex(data['geocode'].tolist(), grid_size) if 'geocode' in data else None
+        self.maps = {field: MapIndex(data[field].tolist()) for field in data.columns
+                     if field != 'geocode' and data[field].dtype == object and is_map_column(data[field])}
+
+        #userQuery matches a term in any field of the default fieldset
+        self.default_fields = [field for field in self.fieldsets.get('default', text_fields) if field in self.fields]
+        self._match = dict()
+        self._expressions = dict()
+
+    def _term_docs(self, term):
+        #sorted docs with the term in a default field (cached)
+        docs = self._match.get(term)
+        if docs is None:
+            postings = [self.fields[field].postings[term][0] for field in self.default_fields
+                        if term in self.fields[field].postings]
+            docs = np.unique(np.concatenate(postings)) if postings else np.zeros(0, np.int32)
+            self._match[term] = docs
+        return docs
+
+    def _profile(self, name):
+        #compiled (first phase, summary features, rank features used) of a rank profile
+        if name not in self._expressions:
+            if name not in self.profiles or not self.profiles[name].first_phase:
+                raise ValueError("Unknown rank profile {} of schema {}".format(name, self.schema_name))
+            profile = self.profiles[name]
+            first_phase = RankExpression(profile.first_phase, profile)
+            summary_features = [(x, RankExpression(x, profile)) for x in profile.summary_features]
+            features = sorted(first_phase.features().union(*[x.features() for _, x in summary_features]))
+            self._expressions[name] = (first_phase, summary_features, features)
+        return self._expressions[name]
+
+    def match(self, terms, geo=None, contracts=()):
+        """
+        sorted doc ids matching all terms, the geo filter ((lat, lng, radius in degrees)) and the contract filters
+        """
+        if not terms:
+            return np.zeros(0, np.int32)
+
+        postings = sorted((self._term_docs(term) for term in set(terms)), key=len)
+        candidates = postings[0]
+        for docs in postings[1:]:
+            candidates = candidates[_contains(docs, candidates, self.n_docs)]
+
+        for field, key, min_value in contracts:
+            if field not in self.maps:
+                return np.zeros(0, np.int32)
+            candidates = self.maps[field].filter(candidates, key, min_value, self.n_docs)
+
+        if geo is not None and len(candidates):
+            lat, lng, radius = geo
+            #grid lookup only when the cells hold fewer docs than the text matches
+            if self.geo.estimate(lat, lng, radius) < len(candidates):
+                dense = np.zeros(self.n_docs, dtype=bool)
+                dense[self.geo.within(lat, lng, radius)] = True
+                candidates = candidates[dense[candidates]]
+            candidates = candidates[self.geo.distance(lat, lng, candidates) <= radius]
+
+        return candidates
+
+    def search(self, query):
+        """
+        run one query (query parameters or a /search/ url line, see query_builder)
+        Output:
+            SearchResponse (status 400 with the error for an unsupported query)
+        """
+        start_time = time.perf_counter()
+        params = query_params(query)
+
+        try:
+            yql = params.get('yql', "")
+            source = SOURCES.search(yql)
+            if not source or source.group(1) != self.schema_name:
+                raise ValueError("Query sources are not the schema {}".format(self.schema_name))
+
+            geo = GEO_LOCATION.search(yql)
+            if geo is not None:
+                if self.geo is None:
+                    raise ValueError("No geocode field for the geoLocation filter")
+                if geo.group(5) not in DISTANCE_UNITS:
+                    raise ValueError("Unsupported distance unit: {}".format(geo.group(5)))
+                geo = (float(geo.group(2)), float(geo.group(3)),
+                       float(geo.group(4))*DISTANCE_UNITS[geo.group(5)]/KM_PER_DEGREE)
+            contracts = [(field, key, int(value)) for field, key, value in SAME_ELEMENT.findall(yql)]
+            profile = params.get('ranking.profile', params.get('ranking', "default"))
+            first_phase, summary_features, rank_features = self._profile(profile)
+            n_hits = int(params.get('hits', 10))
+        except ValueError as e:
+            return SearchResponse(400, 0, [], time.perf_counter() - start_time, str(e))
+
+        terms = tokenize(params.get('query', ""))
+        candidates = self.match(terms, geo, contracts)
+
+        #rank features of the candidates
+        features = dict()
+        for kind, field in rank_features:
+            if kind == 'bm25':
+                features[(kind, field)] = self.fields[field].bm25(terms, candidates) if field in self.fields \
+                    else np.zeros(len(candidates))
+            else:
+                features[(kind, field)] = self.geo.distance(geo[0], geo[1], candidates) if geo is not None \
+                    else np.full(len(candidates), NO_POSITION_DEGREES)
+
+        scores = _as_array(first_phase.evaluate(features), len(candidates))
+        n_hits = min(n_hits, len(candidates))
+        top = np.argpartition(-scores, n_hits - 1)[:n_hits] if 0 < n_hits < len(candidates) else np.arange(n_hits)
+        top = top[np.lexsort((candidates[top], -scores[top]))]
+
+        #summary features of the returned hits only
+        top_features = {name: values[top] for name, values in features.items()}
+        summaries = [(name, _as_array(expression.evaluate(top_features), len(top))) for name, expression in summary_features]
+        hits = [Hit(str(self.keys[candidates[n]]), float(scores[n]), {name: float(values[k]) for name, values in summaries})
+                for k, n in enumerate(top)]
+        return SearchResponse(200, len(candidates), hits, time.perf_counter() - start_time, None)
+
+    def search_many(self, queries):
+        """
+        run a query set (the interface of search_client.SearchClient)
+        Output:
+            responses - list of SearchResponse in the query order
+        """
+        return [self.search(query) for query in queries]
+
+
+def top_k_agreement(expected, actual, k=10):
+    """
+    top-k agreement of two result lists (e.g., vespa and the embedded engine)
+    Output:
+        overlap - mean share of the expected top-k keys in the actual top-k (1 for two empty results)
+        exact - share of the queries with the same top-k keys in the same order
+    """
+    overlaps, exact = [], 0
+    for x, y in zip(expected, actual):
+        x_keys = [hit.generated_key for hit in x.hits[:k]]
+        y_keys = [hit.generated_key for hit in y.hits[:k]]
+        overlaps.append(len(set(x_keys) & set(y_keys))/len(x_keys) if x_keys else float(not y_keys))
+        exact += x_keys == y_keys
+
+    return (float(np.mean(overlaps)) if overlaps else 1.0), (exact/len(overlaps) if overlaps else 1.0)
+
+
+def create_engine(settings, data, schema_name=None):
+    """
+    embedded engine of a data frame with the schema file of the settings (config_dir, embedded_grid_size)
+    """
+    schema_name = schema_name or settings.schema_name
+    return EmbeddedSearchEngine(data, schema_name, settings.config_dir + "schemas/" + schema_name + ".sd",
+                                settings.embedded_grid_size)
+
+
+def main(argv=None):
+    from .. import constant
+    from ..ingestion import provider_data_store
+
+    parser = argparse.ArgumentParser(description="embedded bm25/geo search engine")
+    parser.add_argument("data", help="extracted data file (.pkl, or the .cols directory with --output-format columnar)")
+    parser.add_argument("--schema", default=constant.schema_name)
+    parser.add_argument("--sd-file", default=None, help="schema file (default: ../resources/application/schemas/<schema>.sd)")
+    parser.add_argument("--output-format", default=constant.output_format)
+    parser.add_argument("--queryfile", required=True, help="/search/ url lines (e.g., ../query/sample_query_organization.txt)")
+    parser.add_argument("--n-queries", type=int, default=None)
+    parser.add_argument("--vespa-url", default=None, help="compare the top-k with a running vespa")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    settings = argparse.Namespace(output_format=args.output_format)
+    data = provider_data_store.load_data(args.data, settings).reset_index(drop=True)
+    sd_file = args.sd_file or "../resources/application/schemas/{}.sd".format(args.schema)
+
+    start_time = time.time()
+    engine = EmbeddedSearchEngine(data, args.schema, sd_file, constant.embedded_grid_size)
+    print("Indexed {} documents in {:.1f} secs.".format(engine.n_docs, time.time() - start_time))
+
+    with open(args.queryfile, 'r', encoding='utf8') as file:
+        queries = [line.strip() for line in file if line.strip()][:args.n_queries]
+
+    start_time = time.time()
+    responses = engine.search_many(queries)
+    elapsed = time.time() - start_time
+    failed = sum(response.status != 200 for response in responses)
+    print("Ran {} queries in {:.2f} secs ({:.0f} Q/s, {} failed, {:.1f}% zero hits).".format(
+        len(queries), elapsed, len(queries)/elapsed if elapsed else 0.0, failed,
+        100*sum(not response.total_count for response in responses)/max(len(responses), 1)))
+
+    if args.vespa_url:
+        with create_search_client(constant, args.vespa_url) as client:
+            expected = client.search_many(queries)
+        overlap, exact = top_k_agreement(expected, responses, args.k)
+        print("Top-{} agreement with vespa: {:.1%} overlap, {:.1%} identical.".format(args.k, overlap, exact))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Search - query builder
+build the vespa query shapes of the tutorial: userQuery over the default fieldset, an optional
+geoLocation filter and an optional sameElement contract filter, with the matching rank profile
+
+    select generated_key from sources organization where(userQuery() and geoLocation(geocode, lat, lng, "25 miles")
+        and csp_contract contains sameElement(key contains "code", value>20230601));
+
+v0.1 - query shapes of query_generation
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import urllib.parse
+
+GEO_RADIUS = "25 miles"
+
+
+def ranking_profile(schema_name, geo=False):
+    """
+    rank profile of a schema (org_bm25, org_geo_filter, prov_bm25, prov_geo_filter)
+    """
+    prefix = "org" if schema_name.startswith("o") else "prov"
+    return "{}_{}".format(prefix, "geo_filter" if geo else "bm25")
+
+
+def geo_clause(lat, lng, radius=GEO_RADIUS):
+    """
+    geo filter clause (documents within radius of lat/lng)
+    """
+    return ' and geoLocation(geocode, {}, {}, "{}")'.format(lat, lng, radius)
+
+
+def contract_clause(field, key, min_value):
+    """
+    structured filter clause (a map entry with the key and a value (expire date) > min_value)
+    """
+    return ' and {} contains sameElement(key contains "{}", value>{})'.format(field, key, min_value)
+
+
+def build_yql(schema_name, geo=None, contract_filter=None):
+    """
+    yql of a query
+
+    Input:
+        schema_name - schema name in vespa
+        geo - (lat, lng) or (lat, lng, radius) for the geo filter (None = no geo filter)
+        contract_filter - (field, key, min_value) for the structured filter (None = no filter)
+    """
+    return 'select generated_key from sources {} where(userQuery(){}{});'.format(
+        schema_name, geo_clause(*geo) if geo else "", contract_clause(*contract_filter) if contract_filter else "")
+
+
+def build_query(schema_name, query, hits=10, geo=None, contract_filter=None, timeout='15s', extra=None):
+    """
+    query parameters of a search request
+
+    Input:
+        schema_name - schema name in vespa
+        query - user query (search terms)
+        hits - number of returned results
+        geo - (lat, lng) or (lat, lng, radius) for the geo filter (None = no geo filter)
+        contract_filter - (field, key, min_value) for the structured filter (None = no filter)
+        timeout - server time out
+        extra - additional query parameters (dict, e.g., {'presentation.timing': 'true'})
+    Output:
+        params - (dict) query parameters
+    """
+    params = {'yql': build_yql(schema_name, geo, contract_filter),
+              'query': query,
+              'hits': hits,
+              'ranking.profile': ranking_profile(schema_name, geo is not None),
+              'timeout': timeout,
+              'ranking.softtimeout.enable': 'false'}
+
+    if extra:
+        params.update(extra)
+
+    return params
+
+
+def query_path(params):
+    """
+    /search/ request path of query parameters (the url line format of vespa-fbench)
+    """
+    return "/search/?" + urllib.parse.urlencode(params)
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Search - query result cache
+client-side cache of search responses in front of the search client:
+    key - normalized query text, rank profile, hits, filters (yql) and the geoLocation
+          coordinates quantized to a grid (nearby user locations share an entry)
+    eviction - LRU with a time to live, bounded by the number of entries and the estimated memory
+    metrics - hits, misses, hit ratio, evictions, expirations and invalidations
+    invalidation - register_cache(cache) makes a cache drop the entries of a schema (or of changed
+                   documents) when notify_data_changed is called after a feed or an expiry sweep;
+                   across processes, the feed/sweep publishes a data version marker per schema and
+                   a cache with the same version_dir drops the entries of a schema whose marker changed
+
+v0.1 - LRU/TTL result cache with geo-quantized keys
+v0.2 - async clients are detected from a coroutine search method (or set explicitly)
+v0.3 - data version markers per schema for caches in other processes than the feed/sweep
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import os, re, time, weakref, inspect
+import urllib.parse
+from collections import OrderedDict, defaultdict
+
+GEO_LOCATION = re.compile(r'geoLocation\(\s*geocode\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,')
+SOURCES = re.compile(r'from\s+sources\s+(\w+)')
+IGNORED_PARAMS = frozenset(['timeout', 'ranking.softtimeout.enable', 'presentation.timing', 'trace.level'])
+
+_caches = weakref.WeakSet() #caches invalidated by notify_data_changed
+
+
+def query_params(query):
+    """
+    query parameters of a query (dict or /search/ url line)
+    """
+    if isinstance(query, dict):
+        return query
+    return dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(query.strip()).query))
+
+
+def quantize(value, grid):
+    """
+    snap a coordinate to the grid (in degrees)
+    """
+    return round(round(float(value)/grid)*grid, 6)
+
+
+def cache_key(query, geo_grid=None):
+    """
+    cache key of a query
+
+    Input:
+        query - query parameters (dict) or /search/ url line
+        geo_grid - grid (in degrees) for the geoLocation coordinates (None = exact coordinates)
+    Output:
+        key - (tuple) normalized query text, yql (with quantized coordinates) and the other
+              result-affecting parameters
+    """
+    params = query_params(query)
+    text = " ".join(str(params.get('query', "")).lower().split())
+    yql = " ".join(str(params.get('yql', "")).split())
+
+    if geo_grid:
+        yql = GEO_LOCATION.sub(lambda m: "geoLocation(geocode, {}, {},".format(
+            quantize(m.group(1), geo_grid), quantize(m.group(2), geo_grid)), yql)
+
+    others = tuple(sorted((name, str(value)) for name, value in params.items()
+                          if name not in IGNORED_PARAMS and name not in ('query', 'yql')))
+    return (text, yql) + others
+
+
+def version_filename(dirname, schema_name):
+    """
+    data version marker file of a schema
+    """
+    return os.path.join(dirname, "{}_data_version".format(schema_name))
+
+
+def read_data_version(dirname, schema_name):
+    """
+    published data version of a schema (None if no version was published)
+    """
+    try:
+        with open(version_filename(dirname, schema_name), encoding='utf8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def publish_data_version(dirname, schema_name):
+    """
+    publish a new data version of a schema (write + rename, so readers never see a partial marker)
+    """
+    os.makedirs(dirname, exist_ok=True)
+    filename = version_filename(dirname, schema_name)
+    tempfilename = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tempfilename, 'w', encoding='utf8') as f:
+        f.write("{}-{}".format(time.time_ns(), os.getpid()))
+    os.replace(tempfilename, filename)
+
+
+def response_size(key, response):
+    """
+    estimated memory (bytes) of a cache entry
+    """
+    size = 200 + sum(len(x) for x in key if isinstance(x, str)) + 60*len(key)
+    for hit in response.hits:
+        size += 150 + len(hit.generated_key or "") + 100*len(hit.summary_features or ())
+    return size
+
+
+class ResultCache:
+    """
+    LRU/TTL cache of search responses
+
+    Input:
+        max_entries - max number of cached queries
+        max_bytes - max estimated memory of the cached responses
+        ttl - time to live (in sec) of an entry (None = no expiry)
+        geo_grid - grid (in degrees) for the geoLocation coordinates of the keys (None = exact)
+        version_dir - directory of the data version markers (None = in-process invalidation only)
+        version_check_interval - min time (in sec) between two reads of the markers
+    """
+
+    def __init__(self, max_entries=100000, max_bytes=256 << 20, ttl=300, geo_grid=0.05,
+                 version_dir=None, version_check_interval=1.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.geo_grid = geo_grid
+        self.version_dir = version_dir
+        self.version_check_interval = version_check_interval
+
+        self._versions = {} #schema -> data version of the cached entries
+        self._version_check_time = 0.0
+
+        self._entries = OrderedDict() #key -> (expire time, schema, response, size), in LRU order
+        self._doc_keys = defaultdict(set) #generated_key -> cache keys of the responses with the document
+        self.n_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.coalesced = 0 #duplicate queries of a batch served by one request
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, query):
+        return cache_key(query, self.geo_grid)
+
+    def get(self, key):
+        """
+        cached response of a key (None on a miss, an expired entry or a changed data version)
+        """
+        if self.version_dir:
+            self._check_versions()
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if entry[0] is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def put(self, key, response):
+        """
+        cache a successful response (errors are not cached)
+        """
+        if response.status != 200 or response.error:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        size = response_size(key, response)
+        if size > self.max_bytes:
+            return
+
+        match = SOURCES.search(key[1])
+        schema_name = match.group(1) if match else None
+        if self.version_dir and schema_name is not None and schema_name not in self._versions:
+            self._versions[schema_name] = read_data_version(self.version_dir, schema_name)
+
+        expire_time = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (expire_time, schema_name, response, size)
+        self.n_bytes += size
+        for hit in response.hits:
+            self._doc_keys[hit.generated_key].add(key)
+
+        while len(self._entries) > self.max_entries or self.n_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _check_versions(self):
+        #drop the entries of the schemas with a new published data version
+        now = time.monotonic()
+        if now - self._version_check_time < self.version_check_interval:
+            return
+        self._version_check_time = now
+
+        for schema_name, version in list(self._versions.items()):
+            current = read_data_version(self.version_dir, schema_name)
+            if current != version:
+                self._versions[schema_name] = current
+                self.invalidate(schema_name)
+
+    def _remove(self, key):
+        _, _, response, size = self._entries.pop(key)
+        self.n_bytes -= size
+        for hit in response.hits:
+            keys = self._doc_keys.get(hit.generated_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._doc_keys[hit.generated_key]
+
+    def invalidate(self, schema_name=None, doc_ids=None):
+        """
+        drop cached responses
+
+        Input:
+            schema_name - drop the entries of this schema (None = all schemas)
+            doc_ids - drop only the entries with one of these documents (None = all entries);
+                      Note: new documents can change any result, so pass doc_ids only for updates/removes
+        Output:
+            number of dropped entries
+        """
+        if doc_ids is None:
+            keys = [key for key, entry in self._entries.items() if schema_name is None or entry[1] == schema_name]
+        else:
+            keys = set()
+            for doc_id in doc_ids:
+                keys.update(self._doc_keys.get(doc_id, ()))
+            keys = [key for key in keys if schema_name is None or self._entries[key][1] == schema_name]
+
+        for key in keys:
+            self._remove(key)
+
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        return self.invalidate()
+
+    def stats(self):
+        """
+        cache metrics (dict)
+        """
+        lookups = self.hits + self.misses
+        return {'entries': len(self._entries), 'bytes': self.n_bytes, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits/lookups if lookups else 0.0, 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations, 'coalesced': self.coalesced}
+
+
+def register_cache(cache):
+    """
+    invalidate the cache on notify_data_changed (weak reference, no unregister needed)
+    """
+    _caches.add(cache)
+    return cache
+
+
+def notify_data_changed(schema_name=None, doc_ids=None, version_dir=None):
+    """
+    invalidation hook after a feed or an expiry sweep: registered caches drop the entries of the schema
+    (or of the changed documents, see ResultCache.invalidate)
+    Note: registered caches live in this process (fast path); with a version_dir, a new data version of
+    the schema is published for the caches of other processes
+    """
+    if version_dir and schema_name is not None:
+        publish_data_version(version_dir, schema_name)
+
+    dropped = sum(cache.invalidate(schema_name, doc_ids) for cache in list(_caches))
+    if dropped:
+        print("Invalidated {} cached search results.".format(dropped))
+    return dropped
+
+
+def create_cache(settings):
+    """
+    registered result cache from the settings
+    """
+    return register_cache(ResultCache(settings.cache_max_entries, settings.cache_max_bytes,
+                                      settings.cache_ttl, settings.cache_geo_grid,
+                                      settings.cache_version_dir, settings.cache_version_check_interval))
+
+
+class CachedSearchClient:
+    """
+    search client with a result cache (wraps SearchClient or AsyncSearchClient; the
+    search/search_many methods are coroutines for an AsyncSearchClient)
+
+    Input:
+        client - SearchClient or AsyncSearchClient (or any client with the same search/search_many methods)
+        cache - ResultCache
+        is_async - the client methods are coroutines (None = a coroutine client.search)
+    """
+
+    def __init__(self, client, cache, is_async=None):
+        self.client = client
+        self.cache = cache
+        self._async = inspect.iscoroutinefunction(client.search) if is_async is None else is_async
+
+    def _lookup(self, queries):
+        #cached responses and the distinct missed keys (the first query of each key)
+        keys = [self.cache.key(query) for query in queries]
+        responses = []
+        missed = OrderedDict()
+
+        for query, key in zip(queries, keys):
+            if key in missed:
+                self.cache.coalesced += 1
+                responses.append(None)
+                continue
+
+            response = self.cache.get(key)
+            if response is None:
+                missed[key] = query
+            responses.append(response)
+
+        return keys, responses, missed
+
+    def _merge(self, keys, responses, missed, fetched):
+        fetched = dict(zip(missed, fetched))
+        for key, response in fetched.items():
+            self.cache.put(key, response)
+        return [response if response is not None else fetched[key] for key, response in zip(keys, responses)]
+
+    def search(self, query):
+        if self._async:
+            return self._search_async(query)
+
+        key = self.cache.key(query)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.client.search(query)
+            self.cache.put(key, response)
+        return response
+
+    def search_many(self, queries, concurrency=None):
+        """
+        run a query set: cached responses are reused and each distinct missed query runs once
+        """
+        queries = list(queries)
+        if self._async:
+            return self._search_many_async(queries, concurrency)
+
+        keys, responses, missed = self._lookup(queries)
+        return self._merge(keys, responses, missed, self.client.search_many(missed.values(), concurrency))
+
+    async def _search_async(self, query):
+        key = self.cache.key(query)
+        response = self.cache.get(key)
+        if response is None:
+            response = await self.client.search(query)
+            self.cache.put(key, response)
+        return response
+
+    async def _search_many_async(self, queries, concurrency):
+        keys, responses, missed = self._lookup(queries)
+        return self._merge(keys, responses, missed, await self.client.search_many(missed.values(), concurrency))
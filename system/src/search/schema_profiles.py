@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Search - schema profiles
+fieldsets and rank profiles of a vespa schema (.sd) file, so the embedded search engine ranks with
+the constants, functions, first-phase expressions and summary features the vespa application defines
+
+rank expressions are compiled (no eval) from the subset used by the schemas:
+    numbers, constants, functions, + - * / and parentheses,
+    bm25(field), distance(field) (micro-degrees) and distance(field).km
+
+v0.1 - fieldsets and rank profiles with a rank expression compiler
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import re
+from collections import namedtuple
+
+RankProfile = namedtuple('RankProfile', ['name', 'constants', 'functions', 'first_phase', 'summary_features'])
+
+BLOCK_START = re.compile(r"\b(rank-profile|fieldset)\s+(\w+)[^{]*\{")
+FUNCTION = re.compile(r"\bfunction\s+(\w+)\s*\(\s*\)\s*\{\s*expression\s*(?::\s*([^\n}]+)|\{([^}]*)\})")
+FIRST_PHASE = re.compile(r"\bfirst-phase\s*\{\s*expression\s*(?::\s*([^\n}]+)|\{([^}]*)\})")
+CONSTANTS = re.compile(r"\bconstants\s*\{([^}]*)\}")
+CONSTANT = re.compile(r"(\w+)\s*:\s*(-?[\d.eE+-]+)")
+SUMMARY_FEATURES = re.compile(r"\bsummary-features\s*(?::\s*([^\n}]+)|\{([^}]*)\})")
+FIELDS = re.compile(r"\bfields\s*:\s*([^\n}]+)")
+EXPRESSION_TOKEN = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?)|(\w+)|(.))")
+
+KM_PER_DEGREE = 111.19508 #vespa distance: km per degree (mean earth radius), i.e., 0.00011119508 km per micro-degree
+
+
+def _block(text, start):
+    #text of a {...} block starting after the opening brace at start
+    depth = 1
+    for n in range(start, len(text)):
+        if text[n] == "{":
+            depth += 1
+        elif text[n] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:n]
+    raise ValueError("Unbalanced braces in the schema")
+
+
+def _feature_list(match):
+    #names of a summary-features block (one per line or space separated outside parentheses)
+    text = (match.group(1) or match.group(2) or "") if match else ""
+    return re.findall(r"[\w.]+(?:\([^)]*\)(?:\.\w+)?)?", text)
+
+
+def parse_schema(text):
+    """
+    fieldsets and rank profiles of a schema text
+    Output:
+        fieldsets - {name: [field names]}
+        profiles - {name: RankProfile (constants: {name: value}, functions: {name: expression text})}
+    """
+    fieldsets, profiles = dict(), dict()
+
+    for match in BLOCK_START.finditer(text):
+        kind, name = match.groups()
+        block = _block(text, match.end())
+
+        if kind == "fieldset":
+            fields = FIELDS.search(block)
+            fieldsets[name] = [x.strip() for x in fields.group(1).split(",") if x.strip()] if fields else []
+            continue
+
+        constants = dict()
+        for constants_block in CONSTANTS.findall(block):
+            constants.update({key: float(value) for key, value in CONSTANT.findall(constants_block)})
+        functions = {x.group(1): (x.group(2) or x.group(3)).strip() for x in FUNCTION.finditer(block)}
+        first_phase = FIRST_PHASE.search(block)
+        profiles[name] = RankProfile(name, constants, functions,
+                                     (first_phase.group(1) or first_phase.group(2)).strip() if first_phase else None,
+                                     _feature_list(SUMMARY_FEATURES.search(block)))
+
+    return fieldsets, profiles
+
+
+def load_schema(sd_file):
+    """
+    fieldsets and rank profiles of a schema (.sd) file (see parse_schema)
+    """
+    with open(sd_file, 'r', encoding='utf8') as file:
+        return parse_schema(file.read())
+
+
+class RankExpression:
+    """
+    compiled rank expression of a profile
+
+    Input:
+        text - expression text (e.g., "bm25_org_weight*bm25_organization + bm25_address_weight*bm25_address")
+        profile - RankProfile (constants and functions the names refer to)
+
+    evaluate(features) computes the expression over numpy arrays (one value per document); features
+    has bm25(field) -> array and distance(field) -> distance in degrees
+    """
+
+    def __init__(self, text, profile):
+        self.text = text
+        self.profile = profile
+        self._tokens = [x for x in EXPRESSION_TOKEN.findall(text) if any(x)]
+        self._pos = 0
+        self._node = self._expression()
+        if self._pos != len(self._tokens):
+            raise ValueError("Unsupported rank expression: {}".format(text))
+        self._tokens = None
+
+    #----------------- parser: node = (operator, operands...) -----------------
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else ("", "", "")
+
+    def _take(self, symbol=None):
+        token = self._peek()
+        if symbol is not None and token[2] != symbol:
+            raise ValueError("Expected '{}' in the rank expression: {}".format(symbol, self.text))
+        self._pos += 1
+        return token
+
+    def _expression(self):
+        node = self._term()
+        while self._peek()[2] in ("+", "-"):
+            node = (self._take()[2], node, self._term())
+        return node
+
+    def _term(self):
+        node = self._unary()
+        while self._peek()[2] in ("*", "/"):
+            node = (self._take()[2], node, self._unary())
+        return node
+
+    def _unary(self):
+        if self._peek()[2] == "-":
+            self._take()
+            return ('neg', self._unary())
+        return self._primary()
+
+    def _primary(self):
+        number, name, symbol = self._take()
+        if number:
+            return ('number', float(number))
+        if symbol == "(":
+            node = self._expression()
+            self._take(")")
+            return node
+        if not name:
+            raise ValueError("Unsupported rank expression: {}".format(self.text))
+
+        if self._peek()[2] != "(":
+            if name in self.profile.constants:
+                return ('number', self.profile.constants[name])
+            if name in self.profile.functions:
+                return ('function', name, RankExpression(self.profile.functions[name], self.profile))
+            raise ValueError("Unknown name {} in rank profile {}".format(name, self.profile.name))
+
+        self._take("(")
+        argument = self._take()[1]
+        self._take(")")
+        if name == "bm25":
+            return ('bm25', argument)
+        if name == "constant" and argument in self.profile.constants:
+            return ('number', self.profile.constants[argument])
+        if name == "distance":
+            unit = None
+            if self._peek()[2] == ".":
+                self._take()
+                unit = self._take()[1]
+            if unit not in (None, "km"):
+                raise ValueError("Unsupported distance unit: {}".format(unit))
+            return ('distance', argument, unit)
+        raise ValueError("Unsupported rank feature {}() in rank profile {}".format(name, self.profile.name))
+
+    #----------------- evaluation -----------------
+    def features(self, node=None):
+        """
+        rank features (('bm25', field) / ('distance', field)) the expression uses
+        """
+        node = node or self._node
+        if node[0] == 'bm25':
+            return {('bm25', node[1])}
+        if node[0] == 'distance':
+            return {('distance', node[1])}
+        if node[0] == 'function':
+            return node[2].features()
+        return set().union(*[self.features(x) for x in node[1:] if isinstance(x, tuple)])
+
+    def evaluate(self, features, node=None):
+        node = node or self._node
+        kind = node[0]
+
+        if kind == 'number':
+            return node[1]
+        if kind == 'bm25':
+            return features[('bm25', node[1])]
+        if kind == 'distance':
+            degrees = features[('distance', node[1])]
+            return degrees*KM_PER_DEGREE if node[2] == "km" else degrees*1e6
+        if kind == 'function':
+            return node[2].evaluate(features)
+        if kind == 'neg':
+            return -self.evaluate(features, node[1])
+
+        left, right = self.evaluate(features, node[1]), self.evaluate(features, node[2])
+        if kind == "+":
+            return left + right
+        if kind == "-":
+            return left - right
+        if kind == "*":
+            return left*right
+        return left/right
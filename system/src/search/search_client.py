@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Search - search client
+pooled keep-alive client for the vespa /search/ api with asyncio and synchronous interfaces;
+search_many runs large query sets with a bounded number of queries in flight
+
+queries are query parameters (dict, see query_builder.build_query) or /search/ url lines
+(e.g., the lines of query/sample_query_organization.txt)
+
+responses are parsed to the total count and the hits (generated_key, relevance, summary features) only
+
+v0.1 - sync/async search client with bounded parallel execution
+v0.2 - parse_stats (total count, number of hits and the presentation.timing of a response)
+
+@author: Yizhao Ni, PhD, MBA, FAMIA
+@email: yizhao_ni@optum.com
+"""
+
+import asyncio, json, time, threading
+from collections import namedtuple
+from ..http_pool import HttpConnectionPool, HttpError
+from .query_builder import query_path
+
+try:
+    import orjson #optional fast parser
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+Hit = namedtuple('Hit', ['generated_key', 'relevance', 'summary_features'])
+SearchResponse = namedtuple('SearchResponse', ['status', 'total_count', 'hits', 'latency', 'error'])
+
+
+def search_path(query):
+    """
+    request path of a query (query parameters or a /search/ url line)
+    """
+    if isinstance(query, dict):
+        return query_path(query)
+    return query.strip()
+
+
+def parse_response(body):
+    """
+    parse a /search/ response body
+
+    Output:
+        total_count - number of matched documents
+        hits - list of Hit (generated_key, relevance, summary features)
+        errors - list of errors reported by vespa (None if no error)
+    """
+    root = _loads(body).get('root', {})
+
+    hits = []
+    for child in root.get('children', ()):
+        fields = child.get('fields')
+        if fields is not None:
+            hits.append(Hit(fields.get('generated_key'), child.get('relevance'), fields.get('summaryfeatures')))
+
+    return root.get('fields', {}).get('totalCount', 0), hits, root.get('errors')
+
+
+def parse_stats(body):
+    """
+    statistics of a /search/ response body (without building the hits)
+
+    Output:
+        total_count - number of matched documents
+        n_hits - number of returned hits
+        timing - (dict) querytime, summaryfetchtime, searchtime in sec (None without presentation.timing)
+    """
+    response = _loads(body)
+    root = response.get('root', {})
+    return root.get('fields', {}).get('totalCount', 0), len(root.get('children', ())), response.get('timing')
+
+
+class AsyncSearchClient:
+    """
+    asyncio search client (use as an async context manager)
+
+    Input:
+        url - vespa url (e.g., http://localhost:8080)
+        max_connections - keep-alive connections (also max queries in flight)
+        timeout - client time out (in sec) per query
+    """
+
+    def __init__(self, url, max_connections=32, timeout=15):
+        self.max_connections = max_connections
+        self.pool = HttpConnectionPool(url, max_connections, timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    async def search(self, query):
+        """
+        run one query
+        Output:
+            SearchResponse (status None if the request failed)
+        """
+        start_time = time.perf_counter()
+
+        try:
+            status, body = await self.pool.request("GET", search_path(query))
+        except (HttpError, OSError, asyncio.TimeoutError) as e:
+            return SearchResponse(None, 0, [], time.perf_counter() - start_time, str(e) or type(e).__name__)
+
+        latency = time.perf_counter() - start_time
+        if status != 200:
+            return SearchResponse(status, 0, [], latency, body.decode('utf8', errors='replace'))
+
+        total_count, hits, errors = parse_response(body)
+        return SearchResponse(status, total_count, hits, latency, errors)
+
+    async def search_many(self, queries, concurrency=None):
+        """
+        run a query set with at most concurrency queries in flight
+
+        Input:
+            queries - iterable of queries (consumed lazily)
+            concurrency - max queries in flight (default: max_connections)
+        Output:
+            responses - list of SearchResponse in the query order
+        """
+        responses = dict()
+        iterator = enumerate(queries) #shared by the workers
+
+        async def worker():
+            for n, query in iterator:
+                responses[n] = await self.search(query)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency or self.max_connections)])
+        return [responses[n] for n in range(len(responses))]
+
+
+class SearchClient:
+    """
+    synchronous search client: an event loop in a background thread keeps the connection pool
+    alive across calls (use as a context manager or call close())
+
+    Input:
+        url - vespa url (e.g., http://localhost:8080)
+        max_connections - keep-alive connections (also max queries in flight)
+        timeout - client time out (in sec) per query
+    """
+
+    def __init__(self, url, max_connections=32, timeout=15):
+        self._client = AsyncSearchClient(url, max_connections, timeout)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def search(self, query):
+        """
+        run one query (see AsyncSearchClient.search)
+        """
+        return self._run(self._client.search(query))
+
+    def search_many(self, queries, concurrency=None):
+        """
+        run a query set with bounded parallelism (see AsyncSearchClient.search_many)
+        """
+        return self._run(self._client.search_many(queries, concurrency))
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._client.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def create_search_client(settings, url=None):
+    """
+    synchronous search client from the settings (search_connections, search_timeout)
+    """
+    return SearchClient(url or settings.vespa_url_local, settings.search_connections, settings.search_timeout)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""
+shared fixtures: settings from src/constant.py (with fast retries) and a local vespa server
+
+run from the system directory:
+    python -m pytest -q tests
+"""
+
+import types
+import pytest
+from src import constant
+from src.evaluation.local_vespa_server import LocalVespaServer
+
+
+@pytest.fixture
+def settings():
+    settings = types.SimpleNamespace(**{name: getattr(constant, name) for name in dir(constant) if not name.startswith('_')})
+    settings.retry_backoff_base = 0.001
+    settings.retry_backoff_max = 0.01
+    settings.checkpoint_interval = 10
+    return settings
+
+
+@pytest.fixture
+def server():
+    with LocalVespaServer() as server:
+        yield server
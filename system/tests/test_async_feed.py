@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+AsyncFeeder against the local vespa server: retries, 429 throttling, timeouts, dead letters and
+checkpoint/resume
+"""
+
+import json
+import pytest
+from src.evaluation.local_vespa_server import FaultInjection
+from src.ingestion.provider_data_async_feed import feed_operations
+from src.ingestion.feed_recovery import FeedCheckpoint, DeadLetterWriter
+
+SCHEMA_NAME = "organization"
+
+
+def put_operations(n_docs):
+    return [{'op': 'put', 'id': str(n), 'fields': {'organization': "org {}".format(n), 'value': n}}
+            for n in range(n_docs)]
+
+
+def stored_documents(server):
+    return server.documents.get((SCHEMA_NAME, SCHEMA_NAME), dict())
+
+
+def read_dead_letters(filename):
+    with open(filename, 'r', encoding='utf8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_feed(server, settings):
+    assert feed_operations(put_operations(50), SCHEMA_NAME, settings, url=server.url) == (50, 0)
+    assert len(stored_documents(server)) == 50
+    assert stored_documents(server)['7'] == {'organization': "org 7", 'value': 7}
+
+
+def test_retry_transient_errors(server, settings):
+    server.faults = FaultInjection(error_rate=0.3, kinds=['put'], seed=1)
+    settings.max_retries = 20
+
+    assert feed_operations(put_operations(100), SCHEMA_NAME, settings, url=server.url) == (100, 0)
+    assert len(stored_documents(server)) == 100
+    statuses = server.stats()['statuses']
+    assert statuses.get("injected put 500", 0) + statuses.get("injected put 503", 0) > 0
+    assert statuses["put 200"] == 100
+
+
+def test_throttle_429(server, settings):
+    server.faults = FaultInjection(throttle_rate=0.4, kinds=['put'], seed=2)
+    settings.max_retries = 20
+
+    assert feed_operations(put_operations(100), SCHEMA_NAME, settings, url=server.url) == (100, 0)
+    assert len(stored_documents(server)) == 100
+    assert server.stats()['statuses'].get("injected put 429", 0) > 0
+
+
+def test_retries_exhausted(server, settings, tmp_path):
+    server.faults = FaultInjection(throttle_rate=1.0, kinds=['put'])
+    settings.max_retries = 2
+    dead_letter = DeadLetterWriter(str(tmp_path / "dead_letter.jsonl"))
+
+    assert feed_operations(put_operations(5), SCHEMA_NAME, settings, url=server.url, dead_letter=dead_letter) == (0, 5)
+    dead_letters = read_dead_letters(dead_letter.filename)
+    assert sorted(x['id'] for x in dead_letters) == ['0', '1', '2', '3', '4']
+    assert all(x['status'] == 429 and x['attempts'] == 3 for x in dead_letters)
+
+
+def test_timeout(server, settings, tmp_path):
+    server.faults = FaultInjection(latency=300, kinds=['put'])
+    settings.timeout = 0.05
+    settings.max_retries = 1
+    dead_letter = DeadLetterWriter(str(tmp_path / "dead_letter.jsonl"))
+
+    assert feed_operations(put_operations(3), SCHEMA_NAME, settings, url=server.url, dead_letter=dead_letter) == (0, 3)
+    dead_letters = read_dead_letters(dead_letter.filename)
+    assert all(x['status'] is None and x['attempts'] == 2 and "timed out" in x['error'] for x in dead_letters)
+
+
+def test_operation_error_is_dead_lettered(server, settings, tmp_path):
+    #an operation that can not be encoded fails alone; the checkpoint still passes it
+    operations = put_operations(50)
+    operations[10]['fields']['value'] = {1, 2}
+    checkpoint = FeedCheckpoint(str(tmp_path / "checkpoint.json"), "signature", interval=10)
+    dead_letter = DeadLetterWriter(str(tmp_path / "dead_letter.jsonl"))
+
+    assert feed_operations(operations, SCHEMA_NAME, settings, url=server.url,
+                           checkpoint=checkpoint, dead_letter=dead_letter) == (49, 1)
+    assert checkpoint.position == 50
+    assert checkpoint.failed == 1
+    dead_letters = read_dead_letters(dead_letter.filename)
+    assert [x['id'] for x in dead_letters] == ['10']
+    assert dead_letters[0]['error'].startswith("TypeError")
+
+
+def test_checkpoint_resume(server, settings, tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    operations = put_operations(100)
+
+    def interrupted():
+        for n, operation in enumerate(operations):
+            if n == 60:
+                raise KeyboardInterrupt
+            yield operation
+
+    with pytest.raises(KeyboardInterrupt):
+        feed_operations(interrupted(), SCHEMA_NAME, settings, url=server.url,
+                        checkpoint=FeedCheckpoint(checkpoint_file, "signature", interval=10))
+
+    #the checkpoint stops before the first operation that was still in flight
+    checkpoint = FeedCheckpoint(checkpoint_file, "signature", interval=10)
+    start_position = checkpoint.start_position
+    assert 0 < start_position <= 60
+    assert all(str(n) in stored_documents(server) for n in range(start_position))
+    server.reset_stats()
+
+    n_resumed = 100 - start_position
+    assert feed_operations(operations, SCHEMA_NAME, settings, url=server.url, checkpoint=checkpoint) == (n_resumed, 0)
+    assert server.stats()['operations']['put'] == n_resumed
+    assert len(stored_documents(server)) == 100
+
+    #a changed input (new signature) starts from the beginning
+    assert FeedCheckpoint(checkpoint_file, "new signature", interval=10).start_position == 0
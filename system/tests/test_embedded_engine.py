@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+EmbeddedSearchEngine rankings on a tiny corpus against a hand-written bm25 reference
+(organization schema, org_bm25 profile: 2*bm25(org_name) + bm25(address_line) + bm25(city_name) + bm25(county_name)),
+and the geoLocation radius, sameElement contract filters and distance_mile against hand-computed values
+"""
+
+import math, os
+import pandas as pd
+import pytest
+from src.search.embedded_engine import EmbeddedSearchEngine, top_k_agreement
+from src.search.search_client import Hit, SearchResponse
+
+SD_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "resources", "application", "schemas", "organization.sd")
+
+CORPUS = pd.DataFrame({
+    'generated_key': ["k0", "k1", "k2", "k3", "k4"],
+    'org_name': ["Acme Clinic", "Acme Acme Health", "City Clinic Center", "River Hospital", "Acme"],
+    'address_line': ["1 Main St", "2 Oak Ave", "3 Acme Rd", "4 Main St", ""],
+    'city_name': ["Springfield", "Springfield", "Shelbyville", "Shelbyville", "Capital"],
+    'county_name': ["Clark", "Clark", "Clark", "Lake", "Lake"],
+    #from (40, -75): 0, 0.1 degree north, 0.2 degree east, 1 degree north, no position
+    'geocode': [{'lat': 40.0, 'lng': -75.0}, {'lat': 40.1, 'lng': -75.0}, {'lat': 40.0, 'lng': -74.8},
+                {'lat': 41.0, 'lng': -75.0}, None],
+    'csp_contract': [{'C1': 20271231}, {'C1': 20200101, 'C2': 20301231}, {'C2': 20301231}, {'C1': 20301231}, None],
+})
+FIELD_WEIGHTS = {'org_name': 2.0, 'address_line': 1.0, 'city_name': 1.0, 'county_name': 1.0}
+KM_PER_DEGREE = 111.19508
+MILE_PER_KM = 0.621371 #distance_mile of the geo rank profiles
+
+
+def reference_bm25(field, terms, n):
+    #vespa bm25 (k1=1.2, b=0.75) of document n over the corpus statistics
+    documents = [value.lower().split() for value in CORPUS[field]]
+    avg_length = sum(len(x) for x in documents)/len(documents)
+    score = 0.0
+    for term in terms:
+        n_matches = sum(term in x for x in documents)
+        idf = math.log(1 + (len(documents) - n_matches + 0.5)/(n_matches + 0.5))
+        tf = documents[n].count(term)
+        score += idf*tf*2.2/(tf + 1.2*(0.25 + 0.75*len(documents[n])/avg_length))
+    return score
+
+
+def reference_search(text):
+    #documents with all terms in some field, ranked by the weighted bm25 (ties in document order)
+    terms = text.lower().split()
+    hits = []
+    for n, key in enumerate(CORPUS['generated_key']):
+        tokens = set(" ".join(CORPUS.loc[n, field] for field in FIELD_WEIGHTS).lower().split())
+        if all(term in tokens for term in terms):
+            score = sum(weight*reference_bm25(field, terms, n) for field, weight in FIELD_WEIGHTS.items())
+            hits.append((-score, n, Hit(key, score, None)))
+    return SearchResponse(200, len(hits), [hit for _, _, hit in sorted(hits)], 0.0, None)
+
+
+def query(text, filters="", profile="org_bm25"):
+    return {'yql': "select * from sources organization where userQuery(){}".format(filters), 'query': text,
+            'ranking.profile': profile, 'hits': 10}
+
+
+def geo_filter(radius):
+    return ' and geoLocation(geocode, 40.0, -75.0, "{}")'.format(radius)
+
+
+def contract_filter(key, min_value):
+    return ' and csp_contract contains sameElement(key contains "{}", value>{})'.format(key, min_value)
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return EmbeddedSearchEngine(CORPUS, "organization", SD_FILE)
+
+
+def test_hand_computed_score(engine):
+    #"hospital" is only in org_name of k3: idf = ln(1 + 4.5/1.5), length 2, average length 2.2
+    expected = 2*math.log(4)*2.2/(1 + 1.2*(0.25 + 0.75*2/2.2))
+    response = engine.search(query("hospital"))
+
+    assert [hit.generated_key for hit in response.hits] == ["k3"]
+    assert response.hits[0].relevance == pytest.approx(expected, rel=1e-5)
+    assert response.hits[0].summary_features['bm25_organization'] == pytest.approx(expected/2, rel=1e-5)
+
+
+@pytest.mark.parametrize("text", ["acme", "clinic", "acme clinic", "springfield", "main st", "clark acme", "nothing"])
+def test_ranking_matches_reference(engine, text):
+    expected = reference_search(text)
+    response = engine.search(query(text))
+
+    assert response.status == 200
+    assert response.total_count == expected.total_count
+    assert [hit.generated_key for hit in response.hits] == [hit.generated_key for hit in expected.hits]
+    assert [hit.relevance for hit in response.hits] == pytest.approx([hit.relevance for hit in expected.hits], rel=1e-5)
+
+
+def test_top_k_agreement(engine):
+    texts = ["acme", "clinic", "acme clinic", "springfield", "lake"]
+    expected = [reference_search(text) for text in texts]
+
+    assert top_k_agreement(expected, engine.search_many([query(text) for text in texts]), k=3) == (1.0, 1.0)
+    #a different order of the same keys overlaps but agrees exactly only for a single hit
+    reversed_hits = [x._replace(hits=x.hits[::-1]) for x in expected]
+    n_single = sum(len(x.hits) <= 1 for x in expected)
+    assert top_k_agreement(expected, reversed_hits, k=10) == (1.0, n_single/len(texts))
+
+
+def test_unsupported_query(engine):
+    assert engine.search(dict(query("acme"), **{'ranking.profile': "unknown"})).status == 400
+    assert engine.search(dict(query("acme"), yql="select * from sources provider where userQuery()")).status == 400
+
+
+@pytest.mark.parametrize("grid_size", [0.01, 0.5])
+def test_geo_filter(grid_size):
+    #the 0.01 degree grid is looked up (fewer docs in the cells than text matches), the 0.5 grid is not
+    engine = EmbeddedSearchEngine(CORPUS, "organization", SD_FILE, grid_size)
+    distance_k2 = 0.2*math.cos(math.radians(40))*KM_PER_DEGREE #17.0 km
+
+    #10 miles = 16.1 km: k2 is outside and k4 has no position
+    response = engine.search(query("acme", geo_filter("10 mi"), "org_geo_filter"))
+    assert sorted(hit.generated_key for hit in response.hits) == ["k0", "k1"]
+    assert response.total_count == 2
+
+    #geo_ranking: closest first
+    response = engine.search(query("clark", geo_filter("20 km"), "geo_ranking"))
+    assert [hit.generated_key for hit in response.hits] == ["k0", "k1", "k2"]
+    assert [hit.summary_features['distance_mile'] for hit in response.hits] == pytest.approx(
+        [0.0, MILE_PER_KM*0.1*KM_PER_DEGREE, MILE_PER_KM*distance_k2], rel=1e-5)
+    assert [hit.relevance for hit in response.hits] == pytest.approx([0.0, -0.1*KM_PER_DEGREE, -distance_k2], rel=1e-5)
+
+    assert engine.search(query("lake", geo_filter("100 km"), "geo_ranking")).total_count == 0
+    assert [hit.generated_key for hit in engine.search(query("lake", geo_filter("112 km"), "geo_ranking")).hits] == ["k3"]
+
+
+def test_contract_filter(engine):
+    #k1 has an expired C1 and an unexpired C2: sameElement matches key and value of the same entry
+    response = engine.search(query("acme", contract_filter("C1", 20261017)))
+    assert [hit.generated_key for hit in response.hits] == ["k0"]
+
+    response = engine.search(query("acme", contract_filter("C1", 20190101)))
+    assert sorted(hit.generated_key for hit in response.hits) == ["k0", "k1"]
+
+    response = engine.search(query("acme", contract_filter("C2", 20261017)))
+    assert sorted(hit.generated_key for hit in response.hits) == ["k1", "k2"]
+    assert engine.search(query("acme", contract_filter("C3", 0))).total_count == 0
+
+
+def test_geo_and_contract_filter(engine):
+    response = engine.search(query("acme", geo_filter("10 mi") + contract_filter("C2", 20261017), "org_geo_filter"))
+    assert [hit.generated_key for hit in response.hits] == ["k1"]
+    assert response.hits[0].summary_features['distance_mile'] == pytest.approx(MILE_PER_KM*0.1*KM_PER_DEGREE, rel=1e-5)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+ExpirySweeper against the local vespa server: removes and map entry pruning
+"""
+
+from src.evaluation.local_vespa_server import FaultInjection
+from src.ingestion.provider_data_expiry import ExpirySweeper
+from src.http_pool import run_async
+
+SCHEMA_NAME = "organization"
+SWEEP_DATE = 20230601
+
+
+def load_documents(server):
+    #doc n expires (doc_expire_date) when n % 5 == 0; every doc has one expired and one effective contract
+    server.documents[(SCHEMA_NAME, SCHEMA_NAME)] = {
+        str(n): {'doc_expire_date': 0 if n % 5 == 0 else 4102444800,
+                 'csp_contract': {"expired": 20200101, "effective": 99991231}}
+        for n in range(20)}
+
+
+def sweep(server, settings, outdir):
+    settings.sweep_date = SWEEP_DATE
+    settings.sweep_mode = "stream"
+    settings.feed_namespace = None
+    settings.local_outdir = str(outdir) + "/" #dead-letter files
+    return run_async(ExpirySweeper(SCHEMA_NAME, settings, url=server.url).sweep())
+
+
+def test_sweep(server, settings, tmp_path):
+    load_documents(server)
+    report = sweep(server, settings, tmp_path)
+
+    documents = server.documents[(SCHEMA_NAME, SCHEMA_NAME)]
+    assert report['removed_documents'] == 4
+    assert (report['pruned_documents'], report['pruned_entries']) == (16, 16)
+    assert len(documents) == 16
+    assert all(fields['csp_contract'] == {"effective": 99991231} for fields in documents.values())
+
+
+def test_failed_prunes_are_not_counted(server, settings, tmp_path):
+    settings.max_retries = 0
+    load_documents(server)
+    server.faults = FaultInjection(throttle_rate=1.0, kinds=['update'])
+    report = sweep(server, settings, tmp_path)
+
+    assert report['removed_documents'] == 4
+    assert (report['pruned_documents'], report['pruned_entries']) == (0, 0)
+    assert (tmp_path / "organization_expiry_prune_dead_letter.jsonl").exists()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+HttpConnectionPool against the local vespa server: keep-alive reuse, concurrency and timeouts
+"""
+
+import asyncio, json
+import pytest
+from src.http_pool import HttpConnectionPool, run_async
+from src.evaluation.local_vespa_server import FaultInjection
+
+SEARCH_PATH = "/search/?yql=select%20*%20from%20sources%20organization%20where%20true"
+
+
+def test_keep_alive_reuse(server):
+    async def requests():
+        async with HttpConnectionPool(server.url, max_connections=4) as pool:
+            responses = [await pool.request("GET", SEARCH_PATH) for _ in range(10)]
+            return responses, pool.n_connects
+
+    responses, n_connects = run_async(requests())
+
+    assert [status for status, _ in responses] == [200]*10
+    assert 'root' in json.loads(responses[0][1])
+    assert n_connects == 1
+
+
+def test_max_connections(server):
+    server.faults = FaultInjection(latency=20)
+
+    async def requests():
+        async with HttpConnectionPool(server.url, max_connections=3) as pool:
+            responses = await asyncio.gather(*[pool.request("GET", SEARCH_PATH) for _ in range(12)])
+            return responses, pool.n_connects
+
+    responses, n_connects = run_async(requests())
+
+    assert [status for status, _ in responses] == [200]*12
+    assert n_connects <= 3
+
+
+def test_timeout(server):
+    server.faults = FaultInjection(latency=500)
+
+    async def request():
+        async with HttpConnectionPool(server.url, timeout=0.05) as pool:
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.request("GET", SEARCH_PATH)
+
+            task = asyncio.current_task()
+            #the timeout withdraws its cancel request (python 3.11+)
+            if hasattr(task, 'cancelling'):
+                assert task.cancelling() == 0
+
+            #the task is still usable after the timeout
+            await asyncio.sleep(0.01)
+
+    run_async(request())
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+LocalVespaServer: visit pages with writes between the pages
+"""
+
+import json
+from src.http_pool import HttpConnectionPool, run_async
+
+VISIT_PATH = "/document/v1/organization/organization/docid?selection=organization&wantedDocumentCount=3"
+
+
+def visit_with_writes(server):
+    async def visit():
+        visited = []
+        async with HttpConnectionPool(server.url) as pool:
+            for n in range(10):
+                await pool.request("POST", "/document/v1/organization/organization/docid/{}".format(n),
+                                   json.dumps({'fields': {'value': n}}).encode('utf8'))
+
+            continuation = None
+            while True:
+                path = VISIT_PATH + ("&continuation=" + continuation if continuation else "")
+                status, body = await pool.request("GET", path)
+                assert status == 200
+                page = json.loads(body)
+                visited.extend(x['id'].split("::")[1] for x in page['documents'])
+
+                #a new id after the current page, a removed id and an update (no id change)
+                if len(visited) == 3:
+                    await pool.request("POST", "/document/v1/organization/organization/docid/8a", b'{"fields": {}}')
+                    await pool.request("DELETE", "/document/v1/organization/organization/docid/9")
+                    await pool.request("PUT", "/document/v1/organization/organization/docid/5",
+                                       b'{"fields": {"value": {"assign": 50}}}')
+
+                continuation = page.get('continuation')
+                if not continuation:
+                    return visited
+
+    return run_async(visit())
+
+
+def test_visit_pages_follow_writes(server):
+    assert visit_with_writes(server) == ["0", "1", "2", "3", "4", "5", "6", "7", "8", "8a"]
+    assert server.documents[("organization", "organization")]["5"] == {'value': 50}
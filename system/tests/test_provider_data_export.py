@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+JSONL export and replay against the local vespa server: the replay checkpoints and dead letters
+stay outside the shard names, so a second replay (or a re-export) only sees the shards
+"""
+
+import os, json
+import pytest
+from src.evaluation.local_vespa_server import FaultInjection
+from src.ingestion import provider_data_export
+from src.ingestion.provider_data_export import export_dirname, export_operations, list_shards, replay_shards
+
+SCHEMA_NAME = "organization"
+
+
+def put_operations(n_docs):
+    return [{'op': 'put', 'id': str(n), 'fields': {'org_name': "org {}".format(n)}} for n in range(n_docs)]
+
+
+def export(filename, settings, compression):
+    settings.export_shard_size = 20
+    settings.export_compression = compression
+    return export_operations(put_operations(50), export_dirname(filename), SCHEMA_NAME, SCHEMA_NAME, settings)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_replay_twice(server, settings, tmp_path, compression):
+    filename = str(tmp_path / "organization_data.pkl")
+    settings.feed_namespace = None
+    settings.max_retries = 0
+    shards = export(filename, settings, compression).filenames
+    assert len(shards) == 3
+
+    server.faults = FaultInjection(error_rate=0.3, kinds=['put'], seed=3)
+    n_ok, n_failed = replay_shards(filename, SCHEMA_NAME, settings, url=server.url)
+    assert n_failed > 0 and n_ok + n_failed == 50
+    assert len(server.documents[(SCHEMA_NAME, SCHEMA_NAME)]) == n_ok
+
+    replay_dir = os.path.join(export_dirname(filename), provider_data_export.REPLAY_DIRNAME)
+    dead_letters = [x for x in os.listdir(replay_dir) if x.endswith("_dead_letter.jsonl")]
+    n_dead_letters = sum(1 for name in dead_letters for _ in open(os.path.join(replay_dir, name), encoding='utf8'))
+    assert n_dead_letters == n_failed
+
+    #the replay state is not a shard: a second replay skips the fed shards
+    assert list_shards(export_dirname(filename)) == shards
+    assert replay_shards(filename, SCHEMA_NAME, settings, url=server.url) == (0, 0)
+
+    #a re-export replaces the shards and keeps the replay dead letters
+    export(filename, settings, compression)
+    assert list_shards(export_dirname(filename)) == shards
+    assert sorted(x for x in os.listdir(replay_dir) if x.endswith("_dead_letter.jsonl")) == sorted(dead_letters)
+
+
+def test_shard_names(tmp_path):
+    for name in ["part-00000.jsonl", "part-00001.jsonl.gz", "part-00000_dead_letter.jsonl",
+                 "part-00000.jsonl_dead_letter.jsonl", "part-00000_feed_checkpoint.json", "part-x.jsonl"]:
+        (tmp_path / name).write_text(json.dumps({'put': "id:organization:organization::1", 'fields': {}}))
+
+    assert [os.path.basename(x) for x in list_shards(str(tmp_path))] == ["part-00000.jsonl", "part-00001.jsonl.gz"]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+streaming json array reader against json.loads (small chunks split elements across reads)
+"""
+
+import io, json
+import pytest
+from src.ingestion.provider_data_reader import iter_json_array
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 20])
+@pytest.mark.parametrize("text", ['[]', ' [ ] ', '[1, 2.5e3, "x,]"]', '[{"a": [1, 2]},\n {"b": {"c": null}}]'])
+def test_valid_arrays(text, chunk_size):
+    assert list(iter_json_array(io.StringIO(text), chunk_size)) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1 << 20])
+@pytest.mark.parametrize("text", ['[1,]', '[1, \n ]', '[,]', '[1 2]', '[1, 2', '{"a": 1}'])
+def test_invalid_arrays(text, chunk_size):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(text), chunk_size))
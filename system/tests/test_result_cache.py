@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+CachedSearchClient with synchronous and asynchronous clients
+"""
+
+import asyncio
+from src.search.result_cache import ResultCache, CachedSearchClient, notify_data_changed, publish_data_version
+from src.search.search_client import SearchResponse
+
+QUERY = {'yql': "select * from sources organization where userQuery()", 'query': "acme"}
+
+
+class Client:
+    def __init__(self):
+        self.n_queries = 0
+
+    def search(self, query):
+        self.n_queries += 1
+        return SearchResponse(200, 0, [], 0.0, None)
+
+    def search_many(self, queries, concurrency=None):
+        return [self.search(query) for query in queries]
+
+
+class AsyncClient(Client):
+    #an async client without a connection pool attribute
+    async def search(self, query):
+        return Client.search(self, query)
+
+    async def search_many(self, queries, concurrency=None):
+        return [await self.search(query) for query in queries]
+
+
+def test_sync_client():
+    client = Client()
+    cached = CachedSearchClient(client, ResultCache())
+
+    assert cached.search(QUERY).status == 200
+    assert [x.status for x in cached.search_many([QUERY, dict(QUERY, query="clinic")])] == [200, 200]
+    assert client.n_queries == 2
+
+
+def test_async_client():
+    client = AsyncClient()
+    cached = CachedSearchClient(client, ResultCache())
+
+    async def run():
+        first = await cached.search(QUERY)
+        return first, await cached.search_many([QUERY, QUERY, dict(QUERY, query="clinic")])
+
+    first, responses = asyncio.run(run())
+    assert first.status == 200 and [x.status for x in responses] == [200]*3
+    assert client.n_queries == 2
+
+
+def test_explicit_is_async():
+    assert CachedSearchClient(Client(), ResultCache(), is_async=True)._async
+    assert not CachedSearchClient(AsyncClient(), ResultCache(), is_async=False)._async
+
+
+def test_data_version_marker(tmp_path):
+    #a feed/sweep in another process publishes a data version (the cache is not registered)
+    version_dir = str(tmp_path / "data_versions")
+    cache = ResultCache(version_dir=version_dir, version_check_interval=0)
+    cached = CachedSearchClient(Client(), cache)
+    practitioner = dict(QUERY, yql="select * from sources practitioner where userQuery()")
+
+    cached.search_many([QUERY, practitioner])
+    notify_data_changed("practitioner", version_dir=version_dir)
+    assert cache.get(cache.key(QUERY)) is not None
+    assert cache.get(cache.key(practitioner)) is None
+
+    cached.search(practitioner)
+    publish_data_version(version_dir, "organization")
+    assert cache.get(cache.key(QUERY)) is None
+    assert cache.get(cache.key(practitioner)) is not None
+    assert cache.invalidations == 2